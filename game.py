@@ -8,10 +8,33 @@
 #  For Python 2.7.
 
 import pygame
+import pygame._sdl2.video as sdl2_video
 import sys
 import math
 import random
 import os
+import time
+import bisect
+import heapq
+import argparse
+import collections
+import struct
+import hashlib
+import mmap
+import threading
+import gc
+import tracemalloc
+import json
+import re
+import traceback
+import multiprocessing
+import http.server
+import urllib.request
+
+try:
+  import numpy
+except ImportError:     # numpy is only needed for the particle effects, the batched raycasts and the learning environments
+  numpy = None
 
 # time of the last frame in milliseconds
 frame_time = 0.0
@@ -21,6 +44,16 @@ frame_time = 0.0
 
 #-----------------------------------------------------------------------
 
+## Gets a precise current time from a monotonic clock, only usable for
+#  measuring intervals (it's not affected by system clock adjustments).
+#
+#  @return time in milliseconds (float)
+
+def get_precise_time():
+  return time.perf_counter() * 1000.0
+
+#-----------------------------------------------------------------------
+
 def text_to_fixed_width(text, width):
   if len(text) > width:
     return text[:width]
@@ -29,6 +62,214 @@ def text_to_fixed_width(text, width):
 
 #-----------------------------------------------------------------------
 
+## Read-only file-like view of an asset pack entry, the data are read
+#  straight from the memory-mapped pack.
+
+class AssetView:
+  def read(self, size = -1):
+    if size < 0 or self.position + size > len(self.data):
+      size = len(self.data) - self.position
+
+    result = self.data[self.position:self.position + size].tobytes()
+    self.position += size
+    return result
+
+  def readinto(self, buffer):
+    size = min(len(buffer),len(self.data) - self.position)
+    buffer[:size] = self.data[self.position:self.position + size]
+    self.position += size
+    return size
+
+  def seek(self, offset, whence = 0):
+    if whence == 1:
+      offset += self.position
+    elif whence == 2:
+      offset += len(self.data)
+
+    self.position = max(0,min(offset,len(self.data)))
+    return self.position
+
+  def tell(self):
+    return self.position
+
+  def close(self):
+    return
+
+  ## Initialises the view.
+  #
+  #  @param data memoryview of the entry data
+  #  @param name entry name
+
+  def __init__(self, data, name):
+    self.data = data
+    self.name = name
+    self.position = 0
+
+#-----------------------------------------------------------------------
+
+## Single-file asset pack. The pack starts with a header (magic, version,
+#  entry count) followed by an index of the entries (name, offset, size,
+#  SHA-1 hash) and the entry data. The pack is memory-mapped and the
+#  entries are accessed through AssetView objects without copying them.
+
+class AssetPack:
+  MAGIC = b"DUCKPACK"
+  VERSION = 1
+  HEADER_FORMAT = "<8sII"
+  ENTRY_FORMAT = "<QQ20s"     # offset, size, hash (follows the name)
+
+  ## Builds a pack from all the files in a directory.
+  #
+  #  @param directory directory with the asset files
+  #  @param filename pack file to be written
+  #  @param excluded_extensions files with these extensions are not packed
+  #  @return number of packed files
+
+  @staticmethod
+  def build(directory, filename, excluded_extensions = (".lvl",".pack")):
+    names = sorted([name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory,name)) and
+      not os.path.splitext(name)[1] in excluded_extensions])
+    contents = []
+
+    for name in names:
+      with open(os.path.join(directory,name),"rb") as input_file:
+        contents.append(input_file.read())
+
+    index_size = 0
+
+    for name in names:
+      index_size += 2 + len(name.encode("utf-8")) + struct.calcsize(AssetPack.ENTRY_FORMAT)
+
+    offset = struct.calcsize(AssetPack.HEADER_FORMAT) + index_size
+
+    with open(filename,"wb") as output_file:
+      output_file.write(struct.pack(AssetPack.HEADER_FORMAT,AssetPack.MAGIC,AssetPack.VERSION,len(names)))
+
+      for i in range(len(names)):
+        encoded_name = names[i].encode("utf-8")
+        output_file.write(struct.pack("<H",len(encoded_name)) + encoded_name)
+        output_file.write(struct.pack(AssetPack.ENTRY_FORMAT,offset,len(contents[i]),hashlib.sha1(contents[i]).digest()))
+        offset += len(contents[i])
+
+      for content in contents:
+        output_file.write(content)
+
+    return len(names)
+
+  ## Checks the hashes of all the entries.
+  #
+  #  @return list of names of the entries whose data don't match
+
+  def verify(self):
+    return [name for name in self.entries if hashlib.sha1(self.open(name).data).digest() != self.entries[name][2]]
+
+  ## Opens an entry.
+  #
+  #  @param name entry name
+  #  @return AssetView or None if there is no such entry
+
+  def open(self, name):
+    entry = self.entries.get(name)
+
+    if entry == None:
+      return None
+
+    return AssetView(self.data[entry[0]:entry[0] + entry[1]],name)
+
+  ## Opens a pack file.
+  #
+  #  @param filename pack file name
+
+  def __init__(self, filename):
+    with open(filename,"rb") as input_file:
+      self.mapping = mmap.mmap(input_file.fileno(),0,access = mmap.ACCESS_READ)
+
+    self.data = memoryview(self.mapping)
+    magic, version, count = struct.unpack_from(AssetPack.HEADER_FORMAT,self.mapping,0)
+
+    if magic != AssetPack.MAGIC or version != AssetPack.VERSION:
+      raise IOError("not an asset pack: " + filename)
+
+    ## (offset, size, hash) indexed by entry name
+    self.entries = {}
+    position = struct.calcsize(AssetPack.HEADER_FORMAT)
+
+    for i in range(count):
+      name_length = struct.unpack_from("<H",self.mapping,position)[0]
+      position += 2
+      name = self.data[position:position + name_length].tobytes().decode("utf-8")
+      position += name_length
+      self.entries[name] = struct.unpack_from(AssetPack.ENTRY_FORMAT,self.mapping,position)
+      position += struct.calcsize(AssetPack.ENTRY_FORMAT)
+
+#-----------------------------------------------------------------------
+
+## Provides the resource files (images, sounds, fonts) either from an
+#  asset pack or as loose files from the resource directory. The loose
+#  files are used for anything that isn't in the pack, e.g. in the
+#  development.
+
+class ResourceLoader:
+  ## Starts using an asset pack.
+  #
+  #  @param filename pack file name
+  #  @return True if the pack has been opened, False otherwise
+
+  def use_pack(self, filename):
+    try:
+      self.pack = AssetPack(filename)
+    except (IOError,OSError,ValueError,struct.error):
+      self.pack = None
+
+    return self.pack != None
+
+  ## Opens a resource.
+  #
+  #  @param name resource file name (without the directory)
+  #  @return AssetView or a path to the loose file
+
+  def open(self, name):
+    if self.pack != None:
+      result = self.pack.open(name)
+
+      if result != None:
+        return result
+
+    return os.path.join(self.directory,name)
+
+  def load_image(self, name):
+    return pygame.image.load(self.open(name),name)
+
+  def load_sound(self, name):
+    return pygame.mixer.Sound(self.open(name))
+
+  def load_font(self, name, size):
+    return pygame.font.Font(self.open(name),size)
+
+  def __init__(self, directory):
+    ## directory with the loose resource files
+    self.directory = directory
+    ## the AssetPack in use or None
+    self.pack = None
+
+## loader of the game resources
+resource_loader = ResourceLoader("resources")
+
+#-----------------------------------------------------------------------
+
+## Converts an image to a format with per pixel alpha.
+#
+#  @param image pygame.Surface
+#  @return converted pygame.Surface
+
+def convert_alpha(image):
+  if pygame.display.get_surface() != None:
+    return pygame.Surface.convert_alpha(image)
+
+  result = pygame.Surface(image.get_size(),pygame.SRCALPHA)
+  result.blit(image,(0,0))
+  return result
+
 ## Prepares image after loading for its use.
 #
 #  @param image image to be prepared (pygame.Surface)
@@ -41,10 +282,13 @@ def text_to_fixed_width(text, width):
 #  @return prepared image
 
 def prepare_image(image, transparent_color = None, transparency_mask = None):
-  result = pygame.Surface.convert(image)
+  if pygame.display.get_surface() != None:
+    result = pygame.Surface.convert(image)
+  else:     # no display surface with the texture backend, a plain 32 bit format is used
+    result = image.convert(32)
 
   if transparency_mask != None:
-    result = pygame.Surface.convert_alpha(result)
+    result = convert_alpha(result)
 
     for y in range(image.get_height()):
       for x in range(image.get_width()):
@@ -55,7 +299,7 @@ def prepare_image(image, transparent_color = None, transparency_mask = None):
         result.set_at((x,y),color)
 
   elif transparent_color != None:
-    result = pygame.Surface.convert_alpha(result)
+    result = convert_alpha(result)
 
     for y in range(image.get_height()):
       for x in range(image.get_width()):
@@ -69,6 +313,500 @@ def prepare_image(image, transparent_color = None, transparency_mask = None):
 
 #-----------------------------------------------------------------------
 
+## Histogram of sampled values (e.g. times in milliseconds) with fixed
+#  bucket boundaries.
+
+class Histogram:
+  DEFAULT_BOUNDS = (2,4,8,12,16,20,25,33,50,66,100,200)
+
+  ## Adds a new sample to the histogram.
+  #
+  #  @param value sampled value (float)
+
+  def add(self, value):
+    self.counts[bisect.bisect_left(self.bounds,value)] += 1
+    self.samples += 1
+    self.total += value
+    self.maximum = max(self.maximum,value)
+
+  def get_mean(self):
+    if self.samples == 0:
+      return 0
+
+    return self.total / float(self.samples)
+
+  ## Gets an approximate percentile of the samples.
+  #
+  #  @param percentile percentile to get (0 to 100)
+  #  @return upper bound of the bucket the percentile falls into (but
+  #          at most the maximum sample)
+
+  def get_percentile(self, percentile):
+    limit = self.samples * percentile / 100.0
+    count = 0
+
+    for i in range(len(self.counts)):
+      count += self.counts[i]
+
+      if count >= limit and count > 0:
+        return min(self.bounds[i],self.maximum) if i < len(self.bounds) else self.maximum
+
+    return 0
+
+  ## Gets one line summary of the histogram.
+  #
+  #  @return string
+
+  def get_summary(self):
+    return "mean %.1f, p95 %.1f, max %.1f (%d)" % (self.get_mean(),self.get_percentile(95),self.maximum,self.samples)
+
+  ## Gets the text lines with the whole histogram drawn as bars.
+  #
+  #  @return list of strings
+
+  def get_report_lines(self):
+    result = []
+    peak = max(max(self.counts),1)
+
+    for i in range(len(self.counts)):
+      if i < len(self.bounds):
+        label = "<= " + str(self.bounds[i])
+      else:
+        label = " > " + str(self.bounds[-1])
+
+      result.append("  " + text_to_fixed_width(label,7) + " " + text_to_fixed_width(str(self.counts[i]),7) + " " + "#" * int(math.ceil(40.0 * self.counts[i] / peak)))
+
+    return result
+
+  ## Initialises a new histogram.
+  #
+  #  @param bounds upper bounds of the buckets in ascending order, one
+  #         more bucket is added for all values above the last bound
+
+  def __init__(self, bounds = DEFAULT_BOUNDS):
+    self.bounds = bounds
+    self.counts = [0] * (len(bounds) + 1)
+    self.samples = 0
+    self.total = 0.0
+    self.maximum = 0.0
+
+#-----------------------------------------------------------------------
+
+## Collects named runtime statistics: simple values and histograms. The
+#  statistics can be shown as an overlay or printed as a report.
+
+class Stats:
+  ## Sets a simple named value.
+  #
+  #  @param name value name (string)
+  #  @param value the value
+
+  def set_value(self, name, value):
+    if not name in self.values:
+      self.names.append(name)
+
+    self.values[name] = value
+
+  ## Adds a sample to a named histogram, the histogram is created if it
+  #  doesn't exist.
+  #
+  #  @param name histogram name (string)
+  #  @param value sampled value
+  #  @param bounds bucket bounds used if the histogram is created
+
+  def add_sample(self, name, value, bounds = Histogram.DEFAULT_BOUNDS):
+    if not name in self.histograms:
+      self.names.append(name)
+      self.histograms[name] = Histogram(bounds)
+
+    self.histograms[name].add(value)
+
+  ## Gets short lines (one per statistic) suitable for an overlay.
+  #
+  #  @return list of strings
+
+  def get_overlay_lines(self):
+    result = []
+
+    for name in self.names:
+      if name in self.histograms:
+        result.append(name + ": " + self.histograms[name].get_summary())
+      else:
+        result.append(name + ": " + str(self.values[name]))
+
+    return result
+
+  ## Gets the full report including the histograms.
+  #
+  #  @return list of strings
+
+  def get_report_lines(self):
+    result = []
+
+    for name in self.names:
+      if name in self.histograms:
+        result.append(name + ": " + self.histograms[name].get_summary())
+        result += self.histograms[name].get_report_lines()
+      else:
+        result.append(name + ": " + str(self.values[name]))
+
+    return result
+
+  def __init__(self):
+    ## names of all statistics in the order of their creation
+    self.names = []
+    ## simple values by name
+    self.values = {}
+    ## histograms by name
+    self.histograms = {}
+
+## global statistics of the running game
+stats = Stats()
+
+#-----------------------------------------------------------------------
+
+## Records the times of the startup milestones (such as the first frame
+#  presented) relative to the creation of the timeline. Each milestone
+#  is recorded only once and is published as a value in the statistics.
+
+class StartupTimeline:
+
+  ## Records a milestone, a milestone that has already been recorded is
+  #  ignored.
+  #
+  #  @param name milestone name (string)
+
+  def mark(self, name):
+    with self.lock:
+      if name in self.milestones:
+        return
+
+      self.milestones[name] = get_precise_time() - self.start_time
+
+    stats.set_value("startup: " + name + " [ms]","%.1f" % self.milestones[name])
+
+  ## Checks whether a milestone has been recorded.
+  #
+  #  @param name milestone name (string)
+  #  @return True or False
+
+  def has_mark(self, name):
+    return name in self.milestones
+
+  def __init__(self):
+    self.start_time = get_precise_time()
+    ## milestone times in milliseconds by name
+    self.milestones = {}
+    self.lock = threading.Lock()
+
+## timeline of the program startup, starts at the module import
+startup_timeline = StartupTimeline()
+
+#-----------------------------------------------------------------------
+
+## Measures the latency from receiving an input event to presenting the
+#  first frame that was simulated with the input applied.
+
+class InputLatencyMeter:
+
+  ## Records that an input event has been received.
+  #
+  #  @param time time of receiving the event in milliseconds
+
+  def input_received(self, time):
+    self.pending.append(time)
+
+  ## Records that a frame has been presented (flipped to the screen),
+  #  all pending inputs are considered displayed by it.
+  #
+  #  @param time time of presenting the frame in milliseconds
+
+  def frame_presented(self, time):
+    for input_time in self.pending:
+      stats.add_sample(self.name,time - input_time)
+
+    self.pending = []
+
+  ## Initialises a new meter.
+  #
+  #  @param name name of the histogram the latencies will be recorded to
+
+  def __init__(self, name):
+    self.name = name
+    ## times of received inputs that haven't been displayed yet
+    self.pending = []
+
+#-----------------------------------------------------------------------
+
+## Controls the garbage collector so that the collections don't happen
+#  in the middle of a level: when a level starts, the objects existing
+#  at that moment are frozen (moved to a generation that is never
+#  collected) and the automatic collection is disabled; the collection
+#  is done at the safe points (menus and level transitions). If too
+#  many objects are allocated during the level, only the youngest
+#  generation is collected, which is fast as the level objects are
+#  frozen. The collection pauses are recorded in the statistics.
+
+class GarbageCollectorControl:
+  MAX_DEFERRED = 100000     # allocated objects after which the youngest generation is collected in a level
+
+  ## Called when a level has been loaded and is about to be played.
+
+  def level_started(self):
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+    self.in_level = True
+    stats.set_value("gc frozen objects",gc.get_freeze_count())
+
+  ## Called when a level has been restarted, the restart is taken as a
+  #  safe point: the previous run is collected and the new one is frozen.
+  #  This makes the restart a bit slower (a full collection), but the
+  #  dead runs don't pile up in the frozen objects when the level is
+  #  retried many times.
+
+  def level_restarted(self):
+    if self.in_level:
+      gc.unfreeze()
+      gc.collect()
+      gc.freeze()
+      stats.set_value("gc frozen objects",gc.get_freeze_count())
+
+  ## Called at a safe point (in the menus, when a level ends), collects
+  #  everything deferred during the level.
+
+  def safe_point(self):
+    if not self.in_level:
+      return
+
+    self.in_level = False
+    gc.unfreeze()
+    gc.collect()
+    gc.enable()
+
+  ## Called once per frame, collects the youngest generation if too
+  #  many objects have been allocated in the level.
+
+  def frame_finished(self):
+    if self.in_level and gc.get_count()[0] > GarbageCollectorControl.MAX_DEFERRED:
+      gc.collect(0)
+
+  def __gc_callback(self, phase, info):
+    if phase == "start":
+      self.collection_start = get_precise_time()
+    else:
+      stats.add_sample("gc pause gen " + str(info["generation"]) + (" in level" if self.in_level else "") + " [ms]",
+        get_precise_time() - self.collection_start)
+
+  def __init__(self):
+    ## whether a level is being played (the collection is deferred)
+    self.in_level = False
+    self.collection_start = 0.0
+    gc.callbacks.append(self.__gc_callback)
+
+#-----------------------------------------------------------------------
+
+## Records the memory allocations of each frame with tracemalloc: the
+#  peak of the memory allocated during the frame, the memory retained by
+#  the frame and the number of allocated memory blocks. The top
+#  allocation sites can be printed at the end. Tracing slows the program
+#  down noticeably, so it is only meant for finding the allocations.
+
+class AllocationTracker:
+  TOP_SITES = 10     # number of allocation sites in the report
+
+  ## Called at the start of a frame.
+
+  def frame_started(self):
+    tracemalloc.reset_peak()
+    self.frame_memory = tracemalloc.get_traced_memory()[0]
+    self.frame_blocks = sys.getallocatedblocks()
+
+  ## Called at the end of a frame, records the frame allocations.
+
+  def frame_finished(self):
+    current, peak = tracemalloc.get_traced_memory()
+    stats.add_sample("frame alloc peak [kB]",(peak - self.frame_memory) / 1024.0)
+    stats.add_sample("frame retained [kB]",max(current - self.frame_memory,0) / 1024.0)
+    blocks = sys.getallocatedblocks()
+    stats.set_value("allocated blocks (last frame change)",str(blocks) + " (" + "%+d" % (blocks - self.frame_blocks) + ")")
+
+  ## Gets the lines describing the sites with the most allocated memory.
+  #
+  #  @return list of strings
+
+  def get_report_lines(self):
+    result = ["top allocation sites:"]
+
+    for statistic in tracemalloc.take_snapshot().statistics("lineno")[:AllocationTracker.TOP_SITES]:
+      result.append("  " + str(statistic))
+
+    return result
+
+  def __init__(self):
+    tracemalloc.start()
+    self.frame_memory = 0
+    self.frame_blocks = 0
+
+#-----------------------------------------------------------------------
+
+## Measures how much memory the game data takes by categories (images,
+#  level maps, entities, caches) and checks the sizes against budgets.
+#  The sizes of the Python objects are estimates (the object sizes
+#  summed over the reachable objects), the images are counted by their
+#  pixel data.
+
+class MemoryAccounting:
+  ## default budgets in MB by category, the categories without a budget
+  #  aren't checked
+  DEFAULT_BUDGETS = {"backgrounds": 16,"sprites": 16,"player frames": 8,"tiles": 32,"chunks": 96,"text cache": 16,"textures": 192,
+    "level templates": 16,"level map": 8,"entities": 8,"level indices": 16}
+  MEGABYTE = 1048576.0
+
+  ## Gets the size of the pixel data of an image, subsurfaces share the
+  #  data of their parent and count as 0.
+  #
+  #  @param image pygame.Surface or None
+  #  @return size in bytes
+
+  @staticmethod
+  def get_surface_size(image):
+    if image == None or image.get_parent() != None:
+      return 0
+
+    return image.get_pitch() * image.get_height()
+
+  ## Sums the sizes of images in nested lists, tuples and dicts.
+  #
+  #  @param images the images
+  #  @return size in bytes
+
+  @staticmethod
+  def get_surfaces_size(images):
+    if isinstance(images,pygame.Surface):
+      return MemoryAccounting.get_surface_size(images)
+    elif isinstance(images,dict):
+      images = images.values()
+    elif not isinstance(images,(list,tuple)):
+      return 0
+
+    return sum(MemoryAccounting.get_surfaces_size(item) for item in images)
+
+  ## Estimates the size of an object including the objects reachable
+  #  from it through containers and attributes.
+  #
+  #  @param what the object
+  #  @param seen set of ids of the objects that have already been
+  #         counted, they aren't counted again
+  #  @param stop_types tuple of types whose objects aren't counted (e.g.
+  #         the objects the measured object only references)
+  #  @return size in bytes
+
+  @staticmethod
+  def get_object_size(what, seen, stop_types = ()):
+    result = 0
+    stack = [what]
+
+    while len(stack) > 0:
+      item = stack.pop()
+
+      if id(item) in seen or isinstance(item,stop_types) or isinstance(item,(pygame.Surface,type)) or callable(item):
+        continue
+
+      seen.add(id(item))
+      result += sys.getsizeof(item)
+
+      if isinstance(item,dict):
+        stack.extend(item.keys())
+        stack.extend(item.values())
+      elif isinstance(item,(list,tuple,set,frozenset,collections.deque)):
+        stack.extend(item)
+      elif hasattr(item,"__dict__"):
+        stack.append(item.__dict__)
+
+    return result
+
+  ## Measures the memory usage.
+  #
+  #  @param renderer Renderer or None
+  #  @param level the current Level or None
+  #  @return list of (category, size in bytes) in the order of the
+  #          report
+
+  def measure(self, renderer, level):
+    result = []
+
+    if renderer != None:
+      result += renderer.get_memory_usage()
+
+    seen = set()
+    result.append(("level templates",LevelTemplate.get_cache_memory_usage(seen)))
+
+    if level != None:
+      result += level.get_memory_usage(seen)
+
+    return result
+
+  ## Checks the measured sizes against the budgets, each exceeded
+  #  budget is reported only once until reset is called.
+  #
+  #  @param usage result of measure
+  #  @param context description of the situation for the warnings (e.g.
+  #         the level name)
+  #  @return list of warning strings for the newly exceeded budgets
+
+  def check(self, usage, context):
+    result = []
+
+    for item in usage:
+      budget = self.budgets.get(item[0])
+
+      if budget == None or item[1] <= budget * MemoryAccounting.MEGABYTE or item[0] in self.exceeded:
+        continue
+
+      self.exceeded.add(item[0])
+      result.append("memory budget exceeded (" + context + "): " + item[0] + " %.1f MB > %.1f MB" % (item[1] / MemoryAccounting.MEGABYTE,budget))
+
+    return result
+
+  ## Forgets the exceeded budgets (e.g. when a new level starts).
+
+  def reset(self):
+    self.exceeded = set()
+
+  ## Gets the lines describing measured usage.
+  #
+  #  @param usage result of measure
+  #  @return list of strings
+
+  def get_report_lines(self, usage):
+    result = []
+
+    for item in usage:
+      budget = self.budgets.get(item[0])
+      line = text_to_fixed_width(item[0],16) + " %8.2f MB" % (item[1] / MemoryAccounting.MEGABYTE)
+
+      if budget != None:
+        line += " / %.0f MB" % budget + (" EXCEEDED" if item[1] > budget * MemoryAccounting.MEGABYTE else "")
+
+      result.append(line)
+
+    result.append(text_to_fixed_width("total",16) + " %8.2f MB" % (sum(item[1] for item in usage) / MemoryAccounting.MEGABYTE))
+    return result
+
+  ## Initialises the accounting.
+  #
+  #  @param budgets dict of budgets in MB by category overriding the
+  #         default ones
+
+  def __init__(self, budgets = {}):
+    self.budgets = dict(MemoryAccounting.DEFAULT_BUDGETS)
+    self.budgets.update(budgets)
+    ## categories whose budget has been reported as exceeded
+    self.exceeded = set()
+
+#-----------------------------------------------------------------------
+
 class MapGridObject:
   OBJECT_TILE = 0
   OBJECT_FINISH = 1
@@ -156,1400 +894,6576 @@ class MapGridObject:
 
 #-----------------------------------------------------------------------
 
-class Level:
+## Index of the interactive map cells (pickups, hazards, the finish and
+#  trampolines), it is built when the level is loaded so that the
+#  per-step cost doesn't depend on the number of the cells.
 
-  STATE_PLAYING = 0
-  STATE_WON = 1
-  STATE_LOST = 2
+class TriggerIndex:
+  TRIGGER_TYPES = (MapGridObject.OBJECT_COIN,MapGridObject.OBJECT_EGG,MapGridObject.OBJECT_FINISH,MapGridObject.OBJECT_SPIKES,MapGridObject.OBJECT_TRAMPOLINE)
 
-  ## Loads the level from given file.
-  #
-  #  @param filename file to be loaded
+  ## Builds the index from the level map.
 
-  def load_from_file(self,filename):
-    self.filename = filename
+  def build(self):
+    self.cells = {}
 
-    with open(filename) as input_file:
-      content = input_file.readlines()
+    for x in range(self.level.width):
+      for y in range(self.level.height):
+        self.update_cell(x,y)
 
-    for i in range(len(content)):    # get rid of newlines and spaces
-      content[i] = ((content[i])[:-1]).rstrip()
+  ## Updates the index for given cell after the map has changed.
+  #
+  #  @param x x position of the cell
+  #  @param y y position of the cell
 
-    line_number = 0
+  def update_cell(self, x, y):
+    map_grid_object = self.level.map_array[x][y]
 
-    while line_number < len(content):
-      if content[line_number] == "name:":
-        line_number += 1
-        self.name = content[line_number]
-      elif content[line_number] == "background:":
-        line_number += 1
-        self.background_name = content[line_number]
-        line_number += 1
-        self.background_color = pygame.Color(content[line_number])
-      elif content[line_number].rstrip() == "tiles:":
-        while True:
-          line_number += 1
-          if line_number >= len(content) or len(content[line_number]) == 0:
-            break
+    if map_grid_object != None and map_grid_object.object_type in TriggerIndex.TRIGGER_TYPES:
+      self.cells[(x,y)] = map_grid_object
+    else:
+      self.cells.pop((x,y),None)
 
-          helper_list = content[line_number].split()
-          self.tiles.append((int(helper_list[0]),helper_list[1],int(helper_list[2])))
+  ## Removes given cell from the index.
+  #
+  #  @param x x position of the cell
+  #  @param y y position of the cell
 
-      elif content[line_number] == "outside:":
-        line_number += 1
-        self.outside_tile = MapGridObject()
-        self.outside_tile.object_type = MapGridObject.OBJECT_TILE
-        self.outside_tile.tile_id = int(content[line_number])
-        self.outside_tile.tile_variant = 1
+  def remove(self, x, y):
+    self.cells.pop((x,y),None)
 
-      elif content[line_number] == "scores:":
-        line_number += 1
+  ## Gets the trigger object at given cell.
+  #
+  #  @param x x position of the cell
+  #  @param y y position of the cell
+  #  @return MapGridObject or None if the cell has no trigger
 
-        while True:
-          if line_number >= len(content):
-            break
+  def get(self, x, y):
+    return self.cells.get((x,y))
 
-          split_line = content[line_number].split()
+  def __init__(self, level):
+    ## the level which is indexed
+    self.level = level
+    ## trigger MapGridObjects indexed by (x,y) tuples
+    self.cells = {}
 
-          if len(split_line) != 3:
-            break
+#-----------------------------------------------------------------------
 
-          self.scores.append((split_line[0],int(split_line[1]),int(split_line[2])))
-          line_number += 1
+## Casts rays through the solid cells of the level map (the cells with
+#  MapGridObject.is_tile) with the DDA grid traversal, which visits the
+#  cells a ray crosses in order without missing any. The solid cells are
+#  kept in a flat bytearray indexed by x * height + y, which is also
+#  shared with NumPy for the batched queries. Outside of the map the
+#  cells are solid if the outside tile is.
 
-        line_number -= 1
+class RaycastGrid:
+  SCALAR_RAYS = 32       # when fewer rays of a batch are left, they are finished one by one
 
-        self._sort_scores()
+  ## Builds the grid from the level map.
 
-      elif content[line_number] == "map:":
-        line_number += 1
-        helper_list = content[line_number].split()  # map size
-        self.width = int(helper_list[0])
-        self.height = int(helper_list[1])
-        self.map_array = [[None] * self.height for item in range(self.width)]
-        pos_y = 0
+  def build(self):
+    self.width = self.level.width
+    self.height = self.level.height
+    self.outside_solid = MapGridObject.is_tile(self.level.outside_tile)
+    self.solid = bytearray(self.width * self.height)
 
-        while True:              # load the map grid
-          line_number += 1
+    for x in range(self.width):
+      for y in range(self.height):
+        self.update_cell(x,y)
 
-          if line_number >= len(content) or len(content[line_number]) == 0:
-            break
+    self.solid_array = numpy.frombuffer(self.solid,numpy.uint8).reshape((self.width,self.height)) if numpy != None else None
 
-          helper_list = content[line_number].split()
+  ## Updates the grid for given cell after the map has changed.
+  #
+  #  @param x x position of the cell
+  #  @param y y position of the cell
 
-          for pos_x in range(len(helper_list)):
+  def update_cell(self, x, y):
+    self.solid[x * self.height + y] = 1 if MapGridObject.is_tile(self.level.map_array[x][y]) else 0
 
-            helper_object = MapGridObject.get_instance_from_string(helper_list[pos_x])
+  ## Checks if a cell is solid.
+  #
+  #  @param x x position of the cell
+  #  @param y y position of the cell
+  #  @return True if the cell is solid
 
-            if helper_object == None:
-              self.map_array[pos_x][pos_y] = helper_object
-            elif helper_object.object_type == MapGridObject.OBJECT_PLAYER:
-              self.player = Player(self)
-              self.player.position_x = pos_x + 0.5
-              self.player.position_y = pos_y + 0.5
-            elif helper_object.object_type == MapGridObject.OBJECT_ENEMY_FLYING:
-              self.enemies.append(Enemy(self,Enemy.ENEMY_FLYING))
-              self.enemies[-1].position_x = pos_x + 0.5
-              self.enemies[-1].position_y = pos_y + 0.5
-            elif helper_object.object_type == MapGridObject.OBJECT_ENEMY_GROUND:
-              self.enemies.append(Enemy(self,Enemy.ENEMY_GROUND))
-              self.enemies[-1].position_x = pos_x + 0.5
-              self.enemies[-1].position_y = pos_y + 0.5
-            else:
-              if helper_object.object_type == MapGridObject.OBJECT_EGG:
-                self.eggs_left += 1
-              elif helper_object.object_type == MapGridObject.OBJECT_COIN:
-                self.coins_total += 1
+  def is_solid(self, x, y):
+    if x < 0 or x >= self.width or y < 0 or y >= self.height:
+      return self.outside_solid
 
-              self.map_array[pos_x][pos_y] = helper_object
+    return self.solid[x * self.height + y] != 0
 
-          pos_y += 1
+  ## Casts a ray and finds the first solid cell it hits. A ray starting
+  #  in a solid cell hits it at the distance 0 with the normal (0,0).
+  #
+  #  @param x x position of the ray origin in tiles
+  #  @param y y position of the ray origin in tiles
+  #  @param dx x part of the ray direction (it needn't be normalized)
+  #  @param dy y part of the ray direction
+  #  @param max_distance maximum ray length in tiles
+  #  @return tuple ((x,y) hit cell, distance in tiles, (x,y) normal of
+  #          the hit cell side) or None if nothing has been hit
+
+  def cast(self, x, y, dx, dy, max_distance):
+    length = math.hypot(dx,dy)
+
+    if length == 0:
+      return None
 
-      line_number += 1
+    dx /= length
+    dy /= length
+    cell_x = int(math.floor(x))
+    cell_y = int(math.floor(y))
+
+    if self.is_solid(cell_x,cell_y):
+      return ((cell_x,cell_y),0.0,(0,0))
+
+    step_x = 1 if dx > 0 else -1
+    step_y = 1 if dy > 0 else -1
+
+    # ray lengths between the cell borders and to the next border:
+    # (an axis aligned ray never crosses the other axis' borders, 0 * inf would give nan)
+    delta_x = abs(1.0 / dx) if dx != 0 else float("inf")
+    delta_y = abs(1.0 / dy) if dy != 0 else float("inf")
+    next_x = ((cell_x + 1 - x) if dx > 0 else (x - cell_x)) * delta_x if dx != 0 else float("inf")
+    next_y = ((cell_y + 1 - y) if dy > 0 else (y - cell_y)) * delta_y if dy != 0 else float("inf")
+
+    # the ray ends when it leaves the map with the empty outside:
+    if not self.outside_solid:
+      max_distance = min(max_distance,self.__get_exit_distance(x,y,dx,dy))
+
+    while True:
+      if next_x < next_y:
+        distance = next_x
+        cell_x += step_x
+        next_x += delta_x
+        normal = (-step_x,0)
+      else:
+        distance = next_y
+        cell_y += step_y
+        next_y += delta_y
+        normal = (0,-step_y)
 
-  ## Saves the scores into a file that's associated with the level
-  #  (the one that's been passed to load_from_file method).
+      if distance > max_distance:
+        return None
 
-  def save_scores(self):
-    if len(self.filename) == 0:
-      return
+      if self.is_solid(cell_x,cell_y):
+        return ((cell_x,cell_y),distance,normal)
 
-    output_lines = []
+  ## Checks if there is no solid cell between two points.
+  #
+  #  @param max_distance the points farther apart don't see each other,
+  #         None for no limit
+  #  @return True if the points see each other
 
-    input_file = open(self.filename)
+  def has_line_of_sight(self, x1, y1, x2, y2, max_distance = None):
+    distance = math.hypot(x2 - x1,y2 - y1)
 
-    for line in input_file:
-      if line.lstrip().rstrip() == "scores:":
-        break
-      else:
-        output_lines.append(line)
+    if max_distance != None and distance > max_distance:
+      return False
 
-    input_file.close()
+    return distance == 0 or self.cast(x1,y1,x2 - x1,y2 - y1,distance) == None
 
-    output_file = open(self.filename,"w")
+  ## Private method, computes the ray length at which a ray leaves the
+  #  map (infinity for a ray that doesn't).
 
-    for line in output_lines:
-      output_file.write(line)
+  def __get_exit_distance(self, x, y, dx, dy):
+    result = float("inf")
 
-    output_file.write("scores:\n")
+    if dx != 0:
+      result = min(result,((self.width if dx > 0 else 0) - x) / dx)
 
-    for score in self.scores:
-      output_file.write(score[0] + " " + str(score[1]) + " " + str(score[2]) + "\n")
+    if dy != 0:
+      result = min(result,((self.height if dy > 0 else 0) - y) / dy)
 
-    output_file.close()
+    return max(result,0.0)
 
-  ## Says to add a new score entry. The entry will be added if it will
-  #  be among the top scores.
+  ## Casts many rays at once, it does the same as cast with NumPy
+  #  arrays: all the rays are advanced by one cell per iteration until
+  #  they hit something or end. The last few long rays are finished by
+  #  cast, as an iteration over a few rays costs more than their steps.
   #
-  #  @param name player name (string)
-  #  @param time time in milliseconds (int)
-  #  @param score player score
+  #  @param x x positions of the ray origins (NumPy array)
+  #  @param y y positions of the ray origins
+  #  @param dx x parts of the ray directions
+  #  @param dy y parts of the ray directions
+  #  @param max_distance maximum ray length, a number or an array
+  #  @return tuple (hit bool array, hit cells x int array, hit cells y,
+  #          distances, normals x int array, normals y), the values of
+  #          the rays without a hit are undefined
+
+  def cast_many(self, x, y, dx, dy, max_distance):
+    if numpy == None:
+      raise ImportError("the batched raycasts need numpy")
+
+    x = numpy.asarray(x,numpy.float64)
+    y = numpy.asarray(y,numpy.float64)
+    length = numpy.hypot(dx,dy)
+    valid = length > 0
+    length[~valid] = 1.0
+    dx = numpy.asarray(dx,numpy.float64) / length
+    dy = numpy.asarray(dy,numpy.float64) / length
+    max_distance = numpy.broadcast_to(numpy.asarray(max_distance,numpy.float64),x.shape).copy()
+    cell_x = numpy.floor(x).astype(numpy.int64)
+    cell_y = numpy.floor(y).astype(numpy.int64)
+    step_x = numpy.where(dx > 0,1,-1)
+    step_y = numpy.where(dy > 0,1,-1)
+
+    with numpy.errstate(divide = "ignore"):
+      delta_x = numpy.abs(1.0 / dx)
+      delta_y = numpy.abs(1.0 / dy)
+
+    with numpy.errstate(invalid = "ignore"):
+      next_x = numpy.where(dx > 0,cell_x + 1 - x,x - cell_x) * delta_x
+      next_y = numpy.where(dy > 0,cell_y + 1 - y,y - cell_y) * delta_y
+
+    next_x[dx == 0] = numpy.inf
+    next_y[dy == 0] = numpy.inf
+
+    if not self.outside_solid:
+      with numpy.errstate(divide = "ignore",invalid = "ignore"):
+        exit_x = numpy.where(dx > 0,self.width - x,-x) / dx
+        exit_y = numpy.where(dy > 0,self.height - y,-y) / dy
+
+      exit_x[dx == 0] = numpy.inf
+      exit_y[dy == 0] = numpy.inf
+      max_distance = numpy.minimum(max_distance,numpy.maximum(numpy.minimum(exit_x,exit_y),0.0))
+
+    distance = numpy.zeros(x.shape)
+    normal_x = numpy.zeros(x.shape,numpy.int64)
+    normal_y = numpy.zeros(x.shape,numpy.int64)
+    hit = self.__are_solid(cell_x,cell_y) & valid
+    active = numpy.flatnonzero(valid & ~hit)
+
+    while len(active) > RaycastGrid.SCALAR_RAYS:
+      along_x = next_x[active] < next_y[active]
+      moved_x = active[along_x]
+      moved_y = active[~along_x]
+      distance[moved_x] = next_x[moved_x]
+      cell_x[moved_x] += step_x[moved_x]
+      next_x[moved_x] += delta_x[moved_x]
+      normal_x[moved_x] = -step_x[moved_x]
+      normal_y[moved_x] = 0
+      distance[moved_y] = next_y[moved_y]
+      cell_y[moved_y] += step_y[moved_y]
+      next_y[moved_y] += delta_y[moved_y]
+      normal_x[moved_y] = 0
+      normal_y[moved_y] = -step_y[moved_y]
+      active = active[distance[active] <= max_distance[active]]
+      solid = self.__are_solid(cell_x[active],cell_y[active])
+      hit[active[solid]] = True
+      active = active[~solid]
+
+    for i in active.tolist():
+      result = self.cast(x[i],y[i],dx[i],dy[i],max_distance[i])
+
+      if result != None:
+        hit[i] = True
+        cell_x[i], cell_y[i] = result[0]
+        distance[i] = result[1]
+        normal_x[i], normal_y[i] = result[2]
+
+    return (hit,cell_x,cell_y,distance,normal_x,normal_y)
+
+  ## Checks the lines of sight between many pairs of points.
+  #
+  #  @param x1 x positions of the first points (NumPy array)
+  #  @param y1 y positions of the first points
+  #  @param x2 x positions of the second points
+  #  @param y2 y positions of the second points
+  #  @param max_distance the points farther apart don't see each other,
+  #         None for no limit, the rays of such pairs aren't cast
+  #  @return bool array, True for the pairs that see each other
+
+  def have_line_of_sight(self, x1, y1, x2, y2, max_distance = None):
+    if numpy == None:
+      raise ImportError("the batched raycasts need numpy")
+
+    x1 = numpy.asarray(x1,numpy.float64)
+    y1 = numpy.asarray(y1,numpy.float64)
+    dx = numpy.asarray(x2,numpy.float64) - x1
+    dy = numpy.asarray(y2,numpy.float64) - y1
+    distance = numpy.hypot(dx,dy)
+
+    if max_distance == None:
+      return ~self.cast_many(x1,y1,dx,dy,distance)[0]
+
+    result = numpy.zeros(distance.shape,numpy.bool_)
+    near = numpy.flatnonzero(distance <= max_distance)
+    result[near] = ~self.cast_many(x1[near],y1[near],dx[near],dy[near],distance[near])[0]
+    return result
 
-  def add_score(self, name, time, score):
-    if len(self.scores) < 20:   # record 20 highest scores
-      self.scores.append((name,score,time))
-    else:
-      minimum_index = 0
-      i = 0
+  ## Private method, looks up the solid cells for arrays of positions.
 
-      while len(self.scores):
-        if self.scores[i][1] < self.scores[minimum_index][1]:
-          minimum_index = i
+  def __are_solid(self, x, y):
+    inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+    result = numpy.full(x.shape,self.outside_solid)
 
-        i += 1
+    if len(self.solid) > 0:
+      result[inside] = self.solid_array[x[inside],y[inside]] != 0
 
-      if self.scores[minimum_index][1] < score:
-        del self.scores[minimum_index]
-        self.scores.append((name,score,time))
-        self._sort_scores()
+    return result
 
-  def _sort_scores(self):
-    self.scores.sort(key = lambda item: item[1],reverse = True)
+  def __init__(self, level):
+    ## the level whose map is indexed
+    self.level = level
+    self.width = 0
+    self.height = 0
+    ## whether the cells outside of the map are solid
+    self.outside_solid = False
+    ## 1 for the solid cells, 0 for the others, indexed by x * height + y
+    self.solid = bytearray()
+    ## NumPy view of solid indexed by [x,y] or None
+    self.solid_array = None
 
-  ## Checks the game state and updates it acoordingly, for example if
-  #  a player is standing on an egg, they will take it.
+#-----------------------------------------------------------------------
 
-  def update(self):
-    player_tile_x = int(self.player.position_x)
-    player_tile_y = int(self.player.position_y)
-
-    self.time = pygame.time.get_ticks() - self._time_start
-
-    object_at_player_tile = self.get_at(player_tile_x,player_tile_y)
-    object_under_player_tile = self.get_at(player_tile_x,player_tile_y + 1)
-
-    if object_at_player_tile != None:
-      if object_at_player_tile.object_type == MapGridObject.OBJECT_COIN:
-        self.sound_player.play_coin()
-        self.map_array[player_tile_x][player_tile_y] = None
-        self.coins_collected += 1
-      elif object_at_player_tile.object_type == MapGridObject.OBJECT_EGG:
-        self.sound_player.play_click()
-        self.map_array[player_tile_x][player_tile_y] = None
-        self.eggs_left -= 1
-      elif object_at_player_tile.object_type == MapGridObject.OBJECT_FINISH:
-        if self.eggs_left <= 0:
-          self.state = Level.STATE_WON
-          self.add_score(self.game.name,pygame.time.get_ticks() - self._time_start,self.score)
-          self.save_scores()
-          self.player.force_computer.velocity_vector[0] = 0
-          self.sound_player.play_win()
-      elif object_at_player_tile.object_type == MapGridObject.OBJECT_SPIKES:
-        self.set_lost()
-        return
+## Tracks one entity (a Movable) over the trigger index. The tracker is a
+#  small state machine which only looks the index up when the entity
+#  moves to a new cell.
 
-    if object_under_player_tile != None and object_under_player_tile.object_type == MapGridObject.OBJECT_TRAMPOLINE and not self.player.is_in_air():
-      self.player.force_computer.velocity_vector[1] = -10
-      self.sound_player.play_trampoline()
+class TriggerTracker:
+  STATE_NONE = 0              # the entity is in a cell with no trigger
+  STATE_ENTERED = 1           # the entity has just entered a trigger cell
+  STATE_INSIDE = 2            # the entity stays in a trigger cell
 
-    # compute the score:
+  ## Updates the state according to the current position of the entity.
+  #  The trampoline below is checked on every update independently of
+  #  the state, as the cell above it can hold a trigger too (e.g. an egg
+  #  which is picked up while the entity stays in the cell).
 
-    self.score = int(20000000.0 / (pygame.time.get_ticks() - self._time_start + 20000)) + self.coins_collected * 200
+  def update(self):
+    cell_x = int(self.entity.position_x)
+    cell_y = int(self.entity.position_y)
 
-    # check colissions of player with enemies:
+    if self.cell != None and cell_x == self.cell[0] and cell_y == self.cell[1]:
+      if self.state == TriggerTracker.STATE_ENTERED:
+        self.state = TriggerTracker.STATE_INSIDE
+    else:
+      self.cell = (cell_x,cell_y)
+      self.trigger = self.index.get(cell_x,cell_y)
+      self.state = TriggerTracker.STATE_ENTERED if self.trigger != None else TriggerTracker.STATE_NONE
+
+    trigger_below = self.index.get(cell_x,cell_y + 1)
+    self.on_trampoline = trigger_below != None and trigger_below.object_type == MapGridObject.OBJECT_TRAMPOLINE
+
+  ## Makes the tracker forget the current cell so that it is evaluated
+  #  again by the next update (used when the map changes).
+
+  def reset(self):
+    self.cell = None
+    self.trigger = None
+    self.state = TriggerTracker.STATE_NONE
+    self.on_trampoline = False
+
+  def __init__(self, index, entity):
+    ## the trigger index (TriggerIndex)
+    self.index = index
+    ## the tracked entity (Movable)
+    self.entity = entity
+    ## current state of the tracker
+    self.state = TriggerTracker.STATE_NONE
+    ## (x,y) cell the entity is in, None means not known yet
+    self.cell = None
+    ## trigger object in the current cell (MapGridObject or None)
+    self.trigger = None
+    ## whether the entity is in the cell above a trampoline
+    self.on_trampoline = False
 
-    for enemy in self.enemies:
-      if self.player.collides(enemy):
-        self.set_lost()
+#-----------------------------------------------------------------------
 
-  ## Sets the game state to lost and takes appropriate actions.
+## Navigation graph of the walkable platform segments of a level. A
+#  segment is a maximal horizontal run of cells in which a ground
+#  entity can stand (a free cell with a tile below it), the segments are
+#  connected by fall and jump links. The graph is built once from the
+#  level map and then updated incrementally when map cells change.
+#
+#  A link is a tuple (exit x, target segment id, target x, cost, kind),
+#  a segment is a tuple (y, x1, x2).
 
-  def set_lost(self):
-    if self.state == Level.STATE_LOST:
-      return
+class NavigationGraph:
+  LINK_FALL = 0
+  LINK_JUMP = 1
+  JUMP_GAP = 1               # how many free cells a jump can go over
+  PROJECT_DOWN = 3           # how far below an entity its segment is searched for
+  UPDATE_RANGE = JUMP_GAP + 1   # how far from a segment end the cells affect its links
+  MAX_CACHED_PATHS = 1024
 
-    self.player.last_quack_time = -99999 # to allow the player to make quack
-    self.player.quack()
+  ## Builds the whole graph from the level map.
 
-    self.state = Level.STATE_LOST
-    self.player.solid = False
-    self.player.force_computer.velocity_vector[0] = -1
-    self.player.force_computer.velocity_vector[1] = -4
-    self.player.force_computer.acceleration_vector[0] = 0
-    self.player.force_computer.ground_friction = 0
+  def build(self):
+    self.segments = {}
+    self.cell_segments = {}
+    self.row_segments = {}
+    self.links = {}
+    self.incoming = {}
 
-  def __init_attributes(self):
-    ## this will contain the name of the file associated with the level
-    self.filename = ""
-    ## game to which the level belongs
-    self.game = None
-    ## the level name
-    self.name = ""
-    ## current score
-    self.score = 0
-    ## holds the level scores, the items of the list are tuples
-    #  (name, score, time in ms)
-    self.scores = []
-    ## state of the game
-    self.state = Level.STATE_PLAYING
-    ## total number of coins in the level, this doesn not decrease as
-    #  the player takes them
-    self.coins_total = 0
-    ## how many coins the player has collected in the level so far
-    self.coins_collected = 0
-    ## how many eggs are there left in the level
-    self.eggs_left = 0
-    ## the level background name
-    self.background_name = ""
-    ## background color (pygame.Color)
-    self.background_color = None
-    ## list of tile types - dicts in format [id (int), name (str), number of variants (int)]
-    self.tiles = []
-    ## map width in tiles
-    self.width = 0
-    ## map height in tiles
-    self.height = 0
-    ## 2D list of map grid objects representing the map, each item can
-    #  be None (representing nothing) or a MapGridObject
-    self.map_array = None
-    ## contains a MapGridObject representing a tile with which the area
-    #  outside of the level is filled
-    self.outside_tile = None
-    ## the player object
-    self.player = None
-    ## contains enemies
-    self.enemies = []
-    ## plays the sounds in the game
-    self.sound_player = None
-    ## gravity force
-    self.gravity = 4.7
-    ## time from the level start in miliseconds
-    self.time = 0
-    ## time at which the level was created
-    self._time_start = pygame.time.get_ticks()
+    for y in range(self.level.height):
+      self.__build_row(y)
 
-  ## Gets the MapGridObject at given position in the map with map
-  #  boundary check.
+    for segment_id in self.segments:
+      self.__build_links(segment_id)
+
+    self.__invalidate_paths()
+
+  ## Updates the graph after a map cell has changed.
   #
-  #  @param x x position
-  #  @param y y position
-  #  @return MapGridObject at given position (can be also None), if the
-  #          position provided is outside the map area, the
-  #          MapGridObject representing the outside tile is returned
+  #  @param x x position of the changed cell
+  #  @param y y position of the changed cell
 
-  def get_at(self, x, y):
-    if x < 0 or x >= self.width or y < 0 or y >= self.height:
-      return self.outside_tile
+  def update_cell(self, x, y):
+    to_relink = set()
 
-    return self.map_array[x][y]
+    for row in (y - 1,y):
+      if row < 0 or row >= self.level.height:
+        continue
 
-  def __init__(self, game):
-    self.__init_attributes()
-    self.sound_player = game.sound_player
-    self.game = game
+      removed, added = self.__build_row(row,x,x)
 
-#-----------------------------------------------------------------------
+      for segment_id in removed:
+        to_relink |= self.incoming.pop(segment_id,set())
+        self.__remove_links(segment_id)
 
-## Represents an object that has a position and a rectangular shape. The
-#  object can be moved with collision detections.
+      to_relink |= set(added)
 
-class Movable(object):
-  def __init_attributes(self):
-    ## x position of the center in tiles (float)
-    self.position_x = 0.0
-    ## y position of the center in tiles (float)
-    self.position_y = 0.0
-    ## object width in tiles (float)
-    self.width = 0.4
-    ## object height in tiles (float)
-    self.height = 0.8
-    ## reference to a level in which the object is placed (for colision
-    #  detection)
-    self.level = None
-    ## says if collisions are applied when moving
-    self.solid = True
+    # links of the segments whose ends are near (falls and jumps from
+    # above the cell) can change too:
+    for row in range(min(y + 2,self.level.height)):
+      for column in range(x - NavigationGraph.UPDATE_RANGE,x + NavigationGraph.UPDATE_RANGE + 1):
+        segment_id = self.cell_segments.get((column,row))
 
-  ## Check if the object collides with another object.
-  #
-  #  @param with_what object to check the collision with (Movable)
-  #  @return True if the objects collide, otherwise False
+        if segment_id != None:
+          segment = self.segments[segment_id]
 
-  def collides(self, with_what):
-    if ((self.position_x < with_what.position_x and
-         self.position_x < with_what.position_x + with_what.width and
-         self.position_x + self.width < with_what.position_x and
-         self.position_x + self.width < with_what.position_x + with_what.width)
-         or
-         (self.position_x > with_what.position_x and
-         self.position_x > with_what.position_x + with_what.width and
-         self.position_x + self.width > with_what.position_x and
-         self.position_x + self.width > with_what.position_x + with_what.width)):
-      return False
+          if x <= segment[1] <= x + NavigationGraph.UPDATE_RANGE or x - NavigationGraph.UPDATE_RANGE <= segment[2] <= x:
+            to_relink.add(segment_id)
 
-    if ((self.position_y < with_what.position_y and
-         self.position_y < with_what.position_y + with_what.height and
-         self.position_y + self.height < with_what.position_y and
-         self.position_y + self.height < with_what.position_y + with_what.height)
-         or
-         (self.position_y > with_what.position_y and
-         self.position_y > with_what.position_y + with_what.height and
-         self.position_y + self.height > with_what.position_y and
-         self.position_y + self.height > with_what.position_y + with_what.height)):
-      return False
+    for segment_id in to_relink:
+      if segment_id in self.segments:
+        self.__build_links(segment_id)
 
-    return True
+    self.__invalidate_paths()
 
-  ## Checks if the object is in the air (i.e. there is no tile right
-  #  below it)
+  ## Gets the id of the segment at given cell or the nearest one below
+  #  it (for entities that are in the air).
   #
-  #  @return True if the object is in the air, False otherwise
-
-  def is_in_air(self):
-    distance_to_ground = 99999
+  #  @param x x position of the cell
+  #  @param y y position of the cell
+  #  @return segment id or None
 
-    lower_border = self.position_y + self.height / 2.0
-    tile_y = int(lower_border) + 1
+  def get_segment_at(self, x, y):
+    for i in range(NavigationGraph.PROJECT_DOWN + 1):
+      segment_id = self.cell_segments.get((x,y + i))
 
-    if MapGridObject.is_tile(self.level.get_at(int(self.position_x),tile_y)):
-      distance_to_ground = tile_y - lower_border
+      if segment_id != None:
+        return segment_id
 
-    return distance_to_ground > 0.1
+    return None
 
-  ## Moves the object by given position difference with colission
-  #  detections.
+  ## Finds a path between two cells with A*. The results are cached
+  #  until the graph changes, the least recently used ones are dropped
+  #  when the cache is full. The cache key includes the x positions, as
+  #  the path depends on where in the segments the search starts and
+  #  ends (e.g. which of the links is nearer).
   #
-  #  @param dx position difference in x, in tiles (float)
-  #  @param dy position difference in y, in tiles (float)
+  #  @param start_cell (x,y) start cell
+  #  @param goal_cell (x,y) goal cell
+  #  @return list of links to be taken (empty if the cells are in the
+  #          same segment) or None if there is no path
 
-  def move_by(self, dx, dy):
-    if not self.solid:
-      self.position_x += dx
-      self.position_y += dy
-      return
+  def find_path(self, start_cell, goal_cell):
+    start = self.get_segment_at(start_cell[0],start_cell[1])
+    goal = self.get_segment_at(goal_cell[0],goal_cell[1])
 
-    half_width = self.width / 2.0
-    half_height = self.height / 2.0
+    if start == None or goal == None:
+      return None
 
-    # occupied cells in format (x1,y1,x2,y2)
-    occupied_cells = (int(self.position_x - half_width),int(self.position_y - half_height),int(self.position_x + half_width),int(self.position_y + half_height))
+    key = (start,start_cell[0],goal,goal_cell[0])
 
-    # distances to nearest obstacles:
-    distance_x = 0
-    distance_y = 0
+    if key in self.path_cache:
+      self.cache_hits += 1
+      self.path_cache.move_to_end(key)
+      return self.path_cache[key]
 
-    if dx > 0:
-      minimum = 65536
+    result = self.__search(start,start_cell[0],goal,goal_cell[0])
+    self.path_cache[key] = result
 
-      for i in range(occupied_cells[1],occupied_cells[3] + 1):
-        value = 65536
+    if len(self.path_cache) > NavigationGraph.MAX_CACHED_PATHS:
+      self.path_cache.popitem(last = False)
 
-        for j in range(occupied_cells[2] + 1,occupied_cells[2] + 3):  # checks the following two cells
-          if MapGridObject.is_tile(self.level.get_at(j,i)):
-            value = j
-            break
+    return result
 
-        if value < minimum:
-          minimum = value
+  ## Private method, the A* search over states (segment id, x).
 
-      distance_x = minimum - (self.position_x + half_width)
-    elif dx < 0:
-      maximum = -2048
+  def __search(self, start, start_x, goal, goal_x):
+    goal_y = self.segments[goal][0]
 
-      for i in range(occupied_cells[1],occupied_cells[3] + 1):
-        value = -2048
+    def heuristic(segment_id, x):
+      return abs(x - goal_x) + abs(self.segments[segment_id][0] - goal_y)
 
-        for j in range(occupied_cells[0] - 1,occupied_cells[0] - 3,-1):
-          if MapGridObject.is_tile(self.level.get_at(j,i)):
-            value = j
-            break
+    start_state = (start,start_x)
+    open_heap = [(heuristic(start,start_x),0,start_state)]
+    costs = {start_state: 0}
+    parents = {start_state: None}
 
-        if value > maximum:
-          maximum = value
+    while len(open_heap) > 0:
+      estimate, cost, state = heapq.heappop(open_heap)
 
-      distance_x = (maximum + 1) - (self.position_x - half_width)
+      if cost > costs[state]:   # outdated heap entry
+        continue
 
-    if dy > 0:
-      minimum = 65536
+      if state[0] == goal:
+        result = []
 
-      for i in range(occupied_cells[0],occupied_cells[2] + 1):
-        value = 65536
+        while parents[state] != None:
+          state, link = parents[state]
+          result.append(link)
 
-        for j in range(occupied_cells[3] + 1,occupied_cells[3] + 3):  # checks the following two cells
-          if MapGridObject.is_tile(self.level.get_at(i,j)):
-            value = j
-            break
+        result.reverse()
+        return result
 
-        if value < minimum:
-          minimum = value
+      for link in self.links.get(state[0],[]):
+        new_cost = cost + abs(link[0] - state[1]) + link[3]
+        new_state = (link[1],link[2])
 
-      distance_y = minimum - (self.position_y + half_height)
-    elif dy < 0:
-      maximum = -2048
+        if new_cost < costs.get(new_state,65536):
+          costs[new_state] = new_cost
+          parents[new_state] = (state,link)
+          heapq.heappush(open_heap,(new_cost + heuristic(link[1],link[2]),new_cost,new_state))
 
-      for i in range(occupied_cells[0],occupied_cells[2] + 1):
-        value = -2048
+    return None
 
-        for j in range(occupied_cells[1] - 1,occupied_cells[1] - 3,-1):
-          if MapGridObject.is_tile(self.level.get_at(i,j)):
-            value = j
-            break
+  def __invalidate_paths(self):
+    self.path_cache.clear()
+    self.version += 1
 
-        if value > maximum:
-          maximum = value
+  def __is_tile(self, x, y):
+    return MapGridObject.is_tile(self.level.get_at(x,y))
 
-      distance_y = (maximum + 1) - (self.position_y - half_height)
+  def __is_standable(self, x, y):
+    return 0 <= x < self.level.width and 0 <= y < self.level.height and not self.__is_tile(x,y) and self.__is_tile(x,y + 1)
 
-    if abs(distance_x) > abs(dx):
-      self.position_x += dx
+  ## Private method, (re)creates the segments of given row in given
+  #  column range (the range is extended to whole segments).
+  #
+  #  @return tuple (list of removed segment ids, list of added segment
+  #          ids)
 
-    if abs(distance_y) > abs(dy):
-      self.position_y += dy
+  def __build_row(self, y, x_from = 0, x_to = None):
+    if x_to == None:
+      x_to = self.level.width - 1
+
+    removed = []
+    kept = []
+
+    for segment_id in self.row_segments.get(y,[]):
+      segment = self.segments[segment_id]
+
+      if segment[2] >= x_from - 1 and segment[1] <= x_to + 1:   # touching segments can be joined
+        removed.append(segment_id)
+        x_from = min(x_from,segment[1])
+        x_to = max(x_to,segment[2])
+      else:
+        kept.append(segment_id)
+
+    for segment_id in removed:
+      segment = self.segments.pop(segment_id)
+
+      for x in range(segment[1],segment[2] + 1):
+        del self.cell_segments[(x,y)]
+
+    added = []
+    x = max(x_from,0)
+    x_to = min(x_to,self.level.width - 1)
+
+    while x <= x_to:
+      if not self.__is_standable(x,y):
+        x += 1
+        continue
+
+      x1 = x
+
+      while x + 1 < self.level.width and self.__is_standable(x + 1,y):
+        x += 1
+
+      segment_id = self.next_segment_id
+      self.next_segment_id += 1
+      self.segments[segment_id] = (y,x1,x)
+
+      for i in range(x1,x + 1):
+        self.cell_segments[(i,y)] = segment_id
+
+      added.append(segment_id)
+      x += 1
+
+    self.row_segments[y] = kept + added
+    return (removed,added)
+
+  def __remove_links(self, segment_id):
+    for link in self.links.pop(segment_id,[]):
+      if link[1] in self.incoming:
+        self.incoming[link[1]].discard(segment_id)
+
+  ## Private method, computes the links going from given segment.
+
+  def __build_links(self, segment_id):
+    self.__remove_links(segment_id)
+
+    y, x1, x2 = self.segments[segment_id]
+    links = []
+
+    for end_x, direction in ((x1,-1),(x2,1)):
+      next_x = end_x + direction
+
+      if self.__is_tile(next_x,y):
+        # a wall, try to jump on it:
+        if self.__is_standable(next_x,y - 1) and not self.__is_tile(end_x,y - 1):
+          links.append((end_x,self.cell_segments[(next_x,y - 1)],next_x,3,NavigationGraph.LINK_JUMP))
+
+        continue
+
+      if next_x < 0 or next_x >= self.level.width:
+        continue
+
+      # fall down from the edge:
+      fall_y = y + 1
+
+      while fall_y < self.level.height and not self.__is_standable(next_x,fall_y):
+        if self.__is_tile(next_x,fall_y):
+          fall_y = self.level.height
+          break
+
+        fall_y += 1
+
+      if fall_y < self.level.height:
+        links.append((end_x,self.cell_segments[(next_x,fall_y)],next_x,1 + (fall_y - y) * 0.5,NavigationGraph.LINK_FALL))
+
+      # jump over the gap:
+      for gap in range(1,NavigationGraph.JUMP_GAP + 1):
+        target_x = end_x + (gap + 1) * direction
+
+        if self.__is_tile(end_x + gap * direction,y) or self.__is_tile(end_x + gap * direction,y - 1):
+          break
+
+        if self.__is_standable(target_x,y):
+          links.append((end_x,self.cell_segments[(target_x,y)],target_x,2 + gap,NavigationGraph.LINK_JUMP))
+          break
+
+    self.links[segment_id] = links
+
+    for link in links:
+      if not link[1] in self.incoming:
+        self.incoming[link[1]] = set()
+
+      self.incoming[link[1]].add(segment_id)
 
   def __init__(self, level):
-    self.__init_attributes()
+    ## the level whose map the graph describes
     self.level = level
-    return
+    ## segments (y,x1,x2) indexed by segment id
+    self.segments = {}
+    ## segment ids indexed by (x,y) cells
+    self.cell_segments = {}
+    ## lists of segment ids indexed by row
+    self.row_segments = {}
+    ## lists of outgoing links indexed by segment id
+    self.links = {}
+    ## sets of segment ids that have links to given segment id
+    self.incoming = {}
+    self.next_segment_id = 0
+    ## cached paths indexed by (start segment id, start x, goal segment
+    #  id, goal x), in the order of use
+    self.path_cache = collections.OrderedDict()
+    ## number of path queries answered from the cache
+    self.cache_hits = 0
+    ## incremented every time the graph changes
+    self.version = 0
 
 #-----------------------------------------------------------------------
 
-class Player(Movable):
-  PLAYER_STATE_STANDING = 0
-  PLAYER_STATE_WALKING = 1
-  PLAYER_STATE_JUMPING_UP = 2
-  PLAYER_STATE_JUMPING_DOWN = 3
-  QUACK_COOLDOWN = 5000       # quack cooldown time in milliseconds
-  QUACK_DURATION = 2500       # for how long the quack immobilises the enemies
+## Flags of the player controls for one simulation step, the controls
+#  are passed around as an int combination of the flags.
 
-  def __init_attributes(self):
-    ## basic player state
-    self.state = Player.PLAYER_STATE_STANDING
-    ## whether the player is facing right or left
-    self.facing_right = True
-    ## whether the player is flapping its wings
-    self.flapping_wings = False
-    self.last_quack_time = -999999
-    ## force computer of the player
-    self.force_computer = ForceComputer(self)
+class Controls:
+  NONE = 0
+  LEFT = 1
+  RIGHT = 2
+  UP = 4
+  FLAP = 8
+  QUACK = 16
 
-  def jump(self):
-    self.force_computer.velocity_vector[1] = -3.7
+  NAMES = ((LEFT,"left"),(RIGHT,"right"),(UP,"up"),(FLAP,"flap"),(QUACK,"quack"))
 
-  ## Makes the player quack and takes appropriate actions (tells the
-  #  level about it etc).
+  ## Converts controls to a string such as "right+up".
+  #
+  #  @param controls combination of the flags
+  #  @return string, "none" for no controls
 
-  def quack(self):
-    if pygame.time.get_ticks() < self.last_quack_time + Player.QUACK_COOLDOWN:
-      return
+  @staticmethod
+  def to_string(controls):
+    result = [item[1] for item in Controls.NAMES if controls & item[0]]
 
-    self.last_quack_time = pygame.time.get_ticks()
-    self.level.sound_player.play_quack()
+    if len(result) == 0:
+      return "none"
+
+    return "+".join(result)
+
+  ## Converts a string made by to_string back to the controls.
+  #
+  #  @param controls_string the string
+  #  @return combination of the flags
+
+  @staticmethod
+  def from_string(controls_string):
+    result = Controls.NONE
+
+    for name in controls_string.split("+"):
+      for item in Controls.NAMES:
+        if item[1] == name:
+          result |= item[0]
+
+    return result
+
+#-----------------------------------------------------------------------
+
+## Decides how often the enemies are simulated according to their
+#  distance from the players. The enemies are kept in buckets of map
+#  cells so that only the buckets around the players have to be looked
+#  at: the enemies near a player run at the full rate, the farther ones
+#  run at a reduced rate with a bounded catch-up and the rest sleep
+#  until a player comes near. The regions are derived from the player
+#  positions rather than from the camera, so the simulation doesn't
+#  depend on the screen resolution.
+
+class ActivityRegions:
+  BUCKET_SIZE = 8             # bucket size in tiles
+  FULL_RANGE = (10,8)         # (x,y) half size of the full rate region around a player in tiles
+  REDUCED_RANGE = (26,18)     # (x,y) half size of the reduced rate region around a player in tiles
+  REDUCED_RATE = 4            # the reduced rate entities are simulated once every n steps
+  MAX_SUBSTEP = 50            # maximum length of one catch-up step in milliseconds
+  MAX_CATCH_UP = 250          # maximum time caught up at once in milliseconds, the rest is dropped
+
+  ## Puts all the level enemies into the buckets.
+
+  def build(self):
+    self.buckets = {}
+
+    for i in range(len(self.level.enemies)):
+      enemy = self.level.enemies[i]
+      enemy.activity_phase = i % ActivityRegions.REDUCED_RATE
+      enemy.activity_bucket = self.__get_bucket_key(enemy.position_x,enemy.position_y)
+      self.buckets.setdefault(enemy.activity_bucket,[]).append(enemy)
+
+  def __get_bucket_key(self, x, y):
+    return (int(math.floor(x / ActivityRegions.BUCKET_SIZE)),int(math.floor(y / ActivityRegions.BUCKET_SIZE)))
+
+  def __update_bucket(self, enemy):
+    key = self.__get_bucket_key(enemy.position_x,enemy.position_y)
+
+    if key != enemy.activity_bucket:
+      self.buckets[enemy.activity_bucket].remove(enemy)
+      self.buckets.setdefault(key,[]).append(enemy)
+      enemy.activity_bucket = key
+
+  ## Private method, gets the keys of the buckets that overlap with the
+  #  regions of given half size around the players.
+
+  def __get_region_keys(self, half_size):
+    result = set()
+
+    for player in self.level.players:
+      key1 = self.__get_bucket_key(player.position_x - half_size[0],player.position_y - half_size[1])
+      key2 = self.__get_bucket_key(player.position_x + half_size[0],player.position_y + half_size[1])
+
+      for x in range(key1[0],key2[0] + 1):
+        for y in range(key1[1],key2[1] + 1):
+          result.add((x,y))
+
+    return result
+
+  ## Gets the enemies in the buckets overlapping given area, i.e. all
+  #  the enemies in the area and possibly some around it.
+  #
+  #  @param x1 area left border in tiles
+  #  @param y1 area top border in tiles
+  #  @param x2 area right border in tiles
+  #  @param y2 area bottom border in tiles
+  #  @return list of enemies
+
+  def get_enemies_in_area(self, x1, y1, x2, y2):
+    key1 = self.__get_bucket_key(x1,y1)
+    key2 = self.__get_bucket_key(x2,y2)
+    result = []
+
+    for x in range(key1[0],key2[0] + 1):
+      for y in range(key1[1],key2[1] + 1):
+        result += self.buckets.get((x,y),[])
+
+    return result
+
+  ## Private method, simulates an enemy for given time, in more steps
+  #  if the time is longer than MAX_SUBSTEP.
+
+  def __simulate(self, enemy, time):
+    enemy.pending_time = 0
+
+    while time > 0:
+      substep = min(time,ActivityRegions.MAX_SUBSTEP)
+      enemy.ai_move(substep)
+      time -= substep
+
+    self.__update_bucket(enemy)
+
+  ## Simulates the enemies for one step.
+  #
+  #  @param step_time step length in milliseconds
+
+  def update(self, step_time):
+    self.step_counter += 1
+    full_keys = self.__get_region_keys(ActivityRegions.FULL_RANGE)
+    reduced_keys = self.__get_region_keys(ActivityRegions.REDUCED_RANGE) - full_keys
+    full_count = 0
+    reduced_count = 0
+
+    for key in full_keys:
+      for enemy in list(self.buckets.get(key,[])):
+        if enemy.activity_step == self.step_counter:   # has already moved here from another bucket
+          continue
+
+        enemy.activity_step = self.step_counter
+        self.__simulate(enemy,enemy.pending_time + step_time)
+        full_count += 1
+
+    for key in reduced_keys:
+      for enemy in list(self.buckets.get(key,[])):
+        if enemy.activity_step == self.step_counter:
+          continue
+
+        enemy.activity_step = self.step_counter
+        enemy.pending_time = min(enemy.pending_time + step_time,ActivityRegions.MAX_CATCH_UP)
+        reduced_count += 1
+
+        if (self.step_counter + enemy.activity_phase) % ActivityRegions.REDUCED_RATE == 0:
+          self.__simulate(enemy,enemy.pending_time)
+
+    stats.set_value("enemies full/reduced/sleeping",str(full_count) + "/" + str(reduced_count) + "/" + str(len(self.level.enemies) - full_count - reduced_count))
 
   def __init__(self, level):
-    super(Player,self).__init__(level)
-    self.__init_attributes()
-    self.force_computer.acceleration_vector[0] = self.level.gravity     # set the gravity
-    self.force_computer.acceleration_vector[1] = 0
+    self.level = level
+    ## lists of enemies indexed by (x,y) bucket keys
+    self.buckets = {}
+    ## counts the simulation steps
+    self.step_counter = 0
+
+#-----------------------------------------------------------------------
+
+## Simulates the particles of the visual effects (coin sparkles, quack
+#  shockwaves, trampoline dust, death bursts). The particle state is
+#  kept in preallocated flat numpy arrays whose free slots are kept in a
+#  free list, all the particles are updated in one vectorized pass per
+#  step. The particles are only visual, they use their own random
+#  generator so that they don't change the level simulation. Without
+#  numpy no particles are emitted.
+
+class ParticleSystem:
+  CAPACITY = 4096
+  FRAMES = 8                   # prerendered sprite frames over the particle lifetime
+
+  SPRITE_SPARKLE = 0
+  SPRITE_SHELL = 1
+  SPRITE_DUST = 2
+  SPRITE_RING = 3
+  SPRITE_FEATHER = 4
+
+  ## sprites in format (color, start radius, end radius, start alpha,
+  #  ring width or 0 for a filled circle), the radius and the alpha are
+  #  interpolated over the lifetime, radius in pixels
+  SPRITES = (((255,220,60),4,1,255,0),((245,245,235),3,2,255,0),((190,170,140),5,10,160,0),((255,255,255),12,70,200,3),((235,235,220),4,3,255,0))
+
+  EFFECT_COIN = 0
+  EFFECT_EGG = 1
+  EFFECT_QUACK = 2
+  EFFECT_TRAMPOLINE = 3
+  EFFECT_DEATH = 4
+
+  ## effects in format (sprite, particle count, min speed, max speed,
+  #  min lifetime, max lifetime, gravity, min angle, max angle), speeds
+  #  in tiles per second, lifetimes in milliseconds, gravity in tiles per
+  #  second squared, angles in radians (pi / 2 points down)
+  EFFECTS = ((SPRITE_SPARKLE,24,1.5,4.0,300,600,4.0,0.0,2 * math.pi),(SPRITE_SHELL,16,1.0,3.0,400,800,8.0,math.pi,2 * math.pi),
+    (SPRITE_RING,1,0.0,0.0,400,400,0.0,0.0,0.0),(SPRITE_DUST,12,0.5,2.0,300,600,-0.5,math.pi,2 * math.pi),
+    (SPRITE_FEATHER,64,1.0,5.0,600,1200,6.0,0.0,2 * math.pi))
+
+  ## Emits the particles of an effect.
+  #
+  #  @param effect one of the EFFECT_ constants
+  #  @param x x position in tiles
+  #  @param y y position in tiles
+
+  def emit(self, effect, x, y):
+    if self.free_count == 0:
+      return
+
+    effect = ParticleSystem.EFFECTS[effect]
+    count = min(effect[1],self.free_count)
+    indices = self.free[self.free_count - count:self.free_count]
+    self.free_count -= count
+
+    angles = self.random.uniform(effect[7],effect[8],count)
+    speeds = self.random.uniform(effect[2],effect[3],count)
+
+    self.x[indices] = x
+    self.y[indices] = y
+    self.velocity_x[indices] = numpy.cos(angles) * speeds
+    self.velocity_y[indices] = numpy.sin(angles) * speeds
+    self.age[indices] = 0
+    self.lifetime[indices] = self.random.uniform(effect[4],effect[5],count)
+    self.gravity[indices] = effect[6]
+    self.sprite[indices] = effect[0]
+    self.alive[indices] = True
+
+  ## Moves all the particles by one step and frees the expired ones.
+  #
+  #  @param step_time step length in milliseconds
+
+  def update(self, step_time):
+    if self.free_count == self.capacity:
+      return
+
+    time_start = get_precise_time()
+    seconds = step_time / 1000.0
+
+    # the dead particles are updated too, it's cheaper than selecting the
+    # live ones
+    self.velocity_y += self.gravity * seconds
+    self.x += self.velocity_x * seconds
+    self.y += self.velocity_y * seconds
+    self.age += step_time
+
+    expired = numpy.flatnonzero(self.alive & (self.age >= self.lifetime))
+    self.alive[expired] = False
+    self.free[self.free_count:self.free_count + len(expired)] = expired
+    self.free_count += len(expired)
+
+    stats.add_sample("particle update [ms]",get_precise_time() - time_start)
+
+  ## Gets the live particles for drawing.
+  #
+  #  @return tuple (x positions, y positions, image indices) of numpy
+  #          arrays, the image index is sprite * FRAMES + frame
+
+  def get_draw_data(self):
+    live = numpy.flatnonzero(self.alive)
+    frames = numpy.minimum((self.age[live] / self.lifetime[live] * ParticleSystem.FRAMES).astype(numpy.int32),ParticleSystem.FRAMES - 1)
+    return (self.x[live],self.y[live],self.sprite[live] * ParticleSystem.FRAMES + frames)
+
+  ## Gets the number of live particles.
+
+  def get_count(self):
+    return self.capacity - self.free_count
+
+  ## Removes all the particles (e.g. when a level starts).
+
+  def clear(self):
+    if self.capacity == 0:
+      return
+
+    self.alive[:] = False
+    self.free[:] = numpy.arange(self.capacity - 1,-1,-1,dtype = numpy.int32)
+    self.free_count = self.capacity
+
+  ## Initialises the particle system.
+  #
+  #  @param capacity maximum number of live particles, 0 turns the
+  #         particles off (e.g. for the headless simulation)
+
+  def __init__(self, capacity = CAPACITY):
+    self.capacity = capacity if numpy != None else 0
+    self.random = numpy.random.default_rng() if self.capacity > 0 else None
+    ## positions in tiles
+    self.x = None
+    self.y = None
+    ## velocities in tiles per second
+    self.velocity_x = None
+    self.velocity_y = None
+    ## ages and lifetimes in milliseconds
+    self.age = None
+    self.lifetime = None
+    self.gravity = None
+    self.sprite = None
+    self.alive = None
+    ## stack of the free particle indices, the top is at free_count - 1
+    self.free = None
+    self.free_count = 0
+
+    if self.capacity > 0:
+      self.x = numpy.zeros(self.capacity,numpy.float32)
+      self.y = numpy.zeros(self.capacity,numpy.float32)
+      self.velocity_x = numpy.zeros(self.capacity,numpy.float32)
+      self.velocity_y = numpy.zeros(self.capacity,numpy.float32)
+      self.age = numpy.zeros(self.capacity,numpy.float32)
+      self.lifetime = numpy.ones(self.capacity,numpy.float32)
+      self.gravity = numpy.zeros(self.capacity,numpy.float32)
+      self.sprite = numpy.zeros(self.capacity,numpy.int32)
+      self.alive = numpy.zeros(self.capacity,numpy.bool_)
+      self.free = numpy.zeros(self.capacity,numpy.int32)
+      self.clear()
+
+#-----------------------------------------------------------------------
+
+## Parsed content of a level file, it isn't changed after parsing and is
+#  shared by all the Level objects made from it. The map columns are
+#  tuples, a Level copies a column when it changes it.
+
+class LevelTemplate:
+  DEFAULT_PARALLAX = 0.2       # parallax factor of the background layers that don't give one
+
+  ## parsed templates in format (file signature, LevelTemplate) indexed
+  #  by the file name
+  cache = {}
+
+  ## Gets the template of a level file from the cache, the file is
+  #  parsed if it isn't cached or has changed since.
+  #
+  #  @param filename level file name
+  #  @return LevelTemplate
+
+  @staticmethod
+  def get(filename):
+    file_stat = os.stat(filename)
+    signature = (file_stat.st_mtime_ns,file_stat.st_size)
+    item = LevelTemplate.cache.get(filename)
+
+    if item == None or item[0] != signature:
+      item = (signature,LevelTemplate(filename))
+      LevelTemplate.cache[filename] = item
+
+    return item[1]
+
+  ## Estimates the memory used by the cached templates.
+  #
+  #  @param seen see MemoryAccounting.get_object_size
+  #  @return size in bytes
+
+  @staticmethod
+  def get_cache_memory_usage(seen):
+    return MemoryAccounting.get_object_size(LevelTemplate.cache,seen)
+
+  ## Parses a background layer line of a level file in format:
+  #  name [parallax factor [y offset]].
+  #
+  #  @param line the line
+  #  @return tuple (name, parallax factor, y offset in pixels)
+
+  @staticmethod
+  def parse_background_layer(line):
+    helper_list = line.split()
+    factor = float(helper_list[1]) if len(helper_list) > 1 else LevelTemplate.DEFAULT_PARALLAX
+    return (helper_list[0],factor,int(helper_list[2]) if len(helper_list) > 2 else 0)
+
+  ## Parses a level file.
+  #
+  #  @param filename file to be parsed
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.name = ""
+    ## name of the farthest background layer
+    self.background_name = ""
+    ## background layers from the farthest in format (name, parallax
+    #  factor, y offset), the factor says how fast the layer moves with
+    #  the camera
+    self.background_layers = ()
+    ## background color (pygame.Color)
+    self.background_color = None
+    tiles = []
+    scores = []
+    ## MapGridObject representing the area outside of the map
+    self.outside_tile = None
+    self.width = 0
+    self.height = 0
+    columns = []
+    source_cells = []
+    ## (x,y) player start cell
+    self.player_position = None
+    ## enemy spawn cells in format (x,y,enemy type)
+    self.enemy_spawns = []
+    ## number of eggs in the map
+    self.eggs = 0
+    ## number of coins in the map
+    self.coins = 0
+
+    with open(filename) as input_file:
+      content = input_file.readlines()
+
+    for i in range(len(content)):    # get rid of newlines and spaces
+      content[i] = ((content[i])[:-1]).rstrip()
+
+    line_number = 0
+
+    while line_number < len(content):
+      if content[line_number] == "name:":
+        line_number += 1
+        self.name = content[line_number]
+      elif content[line_number] == "background:":
+        line_number += 1
+        background_layers = [LevelTemplate.parse_background_layer(content[line_number])]
+        self.background_name = background_layers[0][0]
+        line_number += 1
+        self.background_color = pygame.Color(content[line_number])
+
+        # the nearer layers follow the color
+        while line_number + 1 < len(content) and len(content[line_number + 1]) != 0:
+          line_number += 1
+          background_layers.append(LevelTemplate.parse_background_layer(content[line_number]))
+
+        self.background_layers = tuple(background_layers)
+      elif content[line_number].rstrip() == "tiles:":
+        while True:
+          line_number += 1
+          if line_number >= len(content) or len(content[line_number]) == 0:
+            break
+
+          helper_list = content[line_number].split()
+          tiles.append((int(helper_list[0]),helper_list[1],int(helper_list[2])))
+
+      elif content[line_number] == "outside:":
+        line_number += 1
+        self.outside_tile = MapGridObject()
+        self.outside_tile.object_type = MapGridObject.OBJECT_TILE
+        self.outside_tile.tile_id = int(content[line_number])
+        self.outside_tile.tile_variant = 1
+
+      elif content[line_number] == "scores:":
+        line_number += 1
+
+        while True:
+          if line_number >= len(content):
+            break
+
+          split_line = content[line_number].split()
+
+          if len(split_line) != 3:
+            break
+
+          scores.append((split_line[0],int(split_line[1]),int(split_line[2])))
+          line_number += 1
+
+        line_number -= 1
+        scores.sort(key = lambda item: item[1],reverse = True)
+
+      elif content[line_number] == "map:":
+        line_number += 1
+        helper_list = content[line_number].split()  # map size
+        self.width = int(helper_list[0])
+        self.height = int(helper_list[1])
+        columns = [[None] * self.height for item in range(self.width)]
+        source_cells = [["."] * self.height for item in range(self.width)]
+        pos_y = 0
+
+        while True:              # load the map grid
+          line_number += 1
+
+          if line_number >= len(content) or len(content[line_number]) == 0:
+            break
+
+          helper_list = content[line_number].split()
+
+          for pos_x in range(len(helper_list)):
+
+            helper_object = MapGridObject.get_instance_from_string(helper_list[pos_x])
+            source_cells[pos_x][pos_y] = helper_list[pos_x]
+
+            if helper_object == None:
+              columns[pos_x][pos_y] = helper_object
+            elif helper_object.object_type == MapGridObject.OBJECT_PLAYER:
+              self.player_position = (pos_x,pos_y)
+            elif helper_object.object_type == MapGridObject.OBJECT_ENEMY_FLYING:
+              self.enemy_spawns.append((pos_x,pos_y,Enemy.ENEMY_FLYING))
+            elif helper_object.object_type == MapGridObject.OBJECT_ENEMY_GROUND:
+              self.enemy_spawns.append((pos_x,pos_y,Enemy.ENEMY_GROUND))
+            else:
+              if helper_object.object_type == MapGridObject.OBJECT_EGG:
+                self.eggs += 1
+              elif helper_object.object_type == MapGridObject.OBJECT_COIN:
+                self.coins += 1
+
+              columns[pos_x][pos_y] = helper_object
+
+          pos_y += 1
+
+      line_number += 1
+
+    ## tile types as tuples (id, name, number of variants)
+    self.tiles = tuple(tiles)
+    ## scores as tuples (name, score, time in ms), sorted
+    self.scores = tuple(scores)
+    ## map columns, tuples of MapGridObject or None
+    self.columns = tuple(tuple(column) for column in columns)
+    ## columns of the cell strings as they are in the file
+    self.source_cells = tuple(tuple(column) for column in source_cells)
+    ## see Level.get_content_hash
+    self.content_hash = Level.get_content_hash(filename)
+
+#-----------------------------------------------------------------------
+
+class Level:
+
+  STATE_PLAYING = 0
+  STATE_WON = 1
+  STATE_LOST = 2
+  ANIMATION_FRAME_LENGTH = 64     # in milliseconds
+
+  ## Loads the level from given file, the file is parsed only if it
+  #  isn't in the template cache or has changed (see LevelTemplate.get).
+  #
+  #  @param filename file to be loaded
+  #  @param build_indices whether the trigger index and the navigation
+  #         graph should be built (not needed when the level is only
+  #         parsed)
+
+  def load_from_file(self, filename, build_indices = True):
+    self.load_from_template(LevelTemplate.get(filename),build_indices)
+
+  ## Sets the level up from a parsed level template. The map columns
+  #  are shared with the template until they're written to, so this is
+  #  fast enough to restart a level instantly.
+  #
+  #  @param template LevelTemplate
+  #  @param build_indices see load_from_file
+  #  @param players number of players, they all start at the player
+  #         start position
+
+  def load_from_template(self, template, build_indices = True, players = 1):
+    self.template = template
+    self.filename = template.filename
+    self.name = template.name
+    self.background_name = template.background_name
+    self.background_layers = template.background_layers
+    self.background_color = template.background_color
+    self.tiles = list(template.tiles)
+    self.outside_tile = template.outside_tile
+    self.scores = list(template.scores)
+    self.width = template.width
+    self.height = template.height
+    self.map_array = list(template.columns)
+    self.source_cells = list(template.source_cells)
+    self.eggs_left = template.eggs
+    self.coins_total = template.coins
+
+    if template.player_position != None:
+      for i in range(players):
+        self.add_player(template.player_position[0] + 0.5,template.player_position[1] + 0.5)
+
+    for spawn in template.enemy_spawns:
+      self.__spawn_enemy(spawn[0],spawn[1],spawn[2])
+
+    if build_indices:
+      self.trigger_index.build()
+      self.trigger_trackers = [TriggerTracker(self.trigger_index,player) for player in self.players]
+      self.navigation_graph.build()
+      self.raycast_grid.build()
+      self.activity.build()
+
+  ## Adds a player to the level, the first added player is also
+  #  available as the player attribute. The trigger trackers have to be
+  #  made for the players added after the indices have been built.
+  #
+  #  @param x x position of the player center in tiles
+  #  @param y y position of the player center in tiles
+  #  @return the new Player
+
+  def add_player(self, x, y):
+    player = Player(self)
+    player.position_x = x
+    player.position_y = y
+    self.players.append(player)
+
+    if self.player == None:
+      self.player = player
+
+    return player
+
+  ## Gets the live player nearest to given position (e.g. for the enemies
+  #  to chase), the first player if all of them are dead.
+  #
+  #  @param x x position in tiles
+  #  @param y y position in tiles
+  #  @return Player
+
+  def get_nearest_player(self, x, y):
+    if len(self.players) == 1:
+      return self.player
+
+    result = self.player
+    best_distance = None
+
+    for player in self.players:
+      distance = abs(player.position_x - x) + abs(player.position_y - y)
+
+      if not player.dead and (best_distance == None or distance < best_distance):
+        result = player
+        best_distance = distance
+
+    return result
+
+  ## Gets the time of the last quack of any player, the enemies are
+  #  immobilised after it.
+  #
+  #  @return level clock time in milliseconds
+
+  def get_last_quack_time(self):
+    if len(self.players) == 1:
+      return self.player.last_quack_time
+
+    return max(player.last_quack_time for player in self.players)
+
+  ## Gets the number of the current animation frame, the collisions
+  #  depend on it as well as the drawing.
+
+  def get_animation_frame(self):
+    return int(self.clock / Level.ANIMATION_FRAME_LENGTH)
+
+  ## Estimates the memory used by the level. The map columns shared
+  #  with the template are counted with the template if it has been
+  #  measured before with the same seen set.
+  #
+  #  @param seen see MemoryAccounting.get_object_size
+  #  @return list of (category, size in bytes)
+
+  def get_memory_usage(self, seen):
+    stop_types = (Level,Game)
+    level_map = MemoryAccounting.get_object_size((self.map_array,self.source_cells,self.removed_objects),seen,stop_types)
+    entities = MemoryAccounting.get_object_size((self.players,self.enemies),seen,stop_types)
+    indices = MemoryAccounting.get_object_size((self.trigger_index,self.trigger_trackers,self.navigation_graph,self.activity),seen,stop_types)
+    return [("level map",level_map),("entities",entities),("level indices",indices)]
+
+  ## Private method, gets a map column that can be written to, the
+  #  columns shared with the template are copied first.
+  #
+  #  @param x column x position
+  #  @return list of the column cells
+
+  def __get_writable_column(self, x):
+    if isinstance(self.map_array[x],tuple):
+      self.map_array[x] = list(self.map_array[x])
+
+    return self.map_array[x]
+
+  ## Computes a hash of the level file content that identifies the
+  #  level, the scores are not included as they change when the level is
+  #  played.
+  #
+  #  @param filename level file name
+  #  @return hex digest (string)
+
+  @staticmethod
+  def get_content_hash(filename):
+    with open(filename,"rb") as input_file:
+      return Level.read_content_hash(input_file)
+
+  ## Computes the content hash (see get_content_hash) of an open level
+  #  file, the file is read up to and including the "scores:" line, so
+  #  the scores can be read from it next.
+  #
+  #  @param input_file level file opened in the binary mode
+  #  @return hex digest (string)
+
+  @staticmethod
+  def read_content_hash(input_file):
+    result = hashlib.sha1()
+
+    for line in input_file:
+      if line.strip() == b"scores:":
+        break
+
+      result.update(line)
+
+    return result.hexdigest()
+
+  def __spawn_enemy(self, x, y, enemy_type):
+    self.enemies.append(Enemy(self,enemy_type))
+    self.enemies[-1].position_x = x + 0.5
+    self.enemies[-1].position_y = y + 0.5
+    self.enemies[-1].spawn_cell = (x,y)
+
+  ## Loads the level file again and applies only the differences
+  #  against the currently loaded map to the running level: the changed
+  #  cells are replaced and the enemies of the changed spawn cells are
+  #  removed or added. The cells are compared with the file content, so
+  #  already picked up objects stay picked up unless their cell has been
+  #  edited. The player stays where they are.
+  #
+  #  @return tuple (list of (x,y) changed cells, whether the tile types
+  #          changed, whether the background changed), the list is None
+  #          if the map size has changed (nothing has been applied then)
+  #  @throws ValueError, IndexError or OSError if the file can't be read or
+  #          parsed (e.g. it's just being written), the running level is left
+  #          untouched then
+
+  def reload_from_file(self):
+    new_level = Level()
+    new_level.load_from_file(self.filename,False)
+
+    if new_level.width != self.width or new_level.height != self.height:
+      return (None,False,False)
+
+    tiles_changed = new_level.tiles != self.tiles
+    self.tiles = new_level.tiles
+    background_changed = new_level.background_layers != self.background_layers or new_level.background_color != self.background_color
+    self.background_name = new_level.background_name
+    self.background_layers = new_level.background_layers
+    self.background_color = new_level.background_color
+    self.name = new_level.name
+    changed_cells = []
+
+    for x in range(self.width):
+      for y in range(self.height):
+        if new_level.source_cells[x][y] != self.source_cells[x][y]:
+          self.__apply_cell_change(x,y,new_level.source_cells[x][y])
+          changed_cells.append((x,y))
+
+    if len(changed_cells) > 0:
+      self.activity.build()
+
+    return (changed_cells,tiles_changed,background_changed)
+
+  ## Private method, replaces the content of a map cell with an object
+  #  given by a string from the level file.
+
+  def __apply_cell_change(self, x, y, object_string):
+    old_object = self.map_array[x][y]
+
+    if old_object != None and old_object.object_type == MapGridObject.OBJECT_EGG:
+      self.eggs_left -= 1
+    elif old_object != None and old_object.object_type == MapGridObject.OBJECT_COIN:
+      self.coins_total -= 1
+
+    self.enemies = [enemy for enemy in self.enemies if enemy.spawn_cell != (x,y)]
+    self.removed_objects.pop((x,y),None)
+    new_object = MapGridObject.get_instance_from_string(object_string)
+    self.source_cells[x] = list(self.source_cells[x])    # the columns are shared with the template
+    self.source_cells[x][y] = object_string
+
+    if new_object != None:
+      if new_object.object_type == MapGridObject.OBJECT_ENEMY_FLYING:
+        self.__spawn_enemy(x,y,Enemy.ENEMY_FLYING)
+        new_object = None
+      elif new_object.object_type == MapGridObject.OBJECT_ENEMY_GROUND:
+        self.__spawn_enemy(x,y,Enemy.ENEMY_GROUND)
+        new_object = None
+      elif new_object.object_type == MapGridObject.OBJECT_PLAYER:
+        new_object = None
+      elif new_object.object_type == MapGridObject.OBJECT_EGG:
+        self.eggs_left += 1
+      elif new_object.object_type == MapGridObject.OBJECT_COIN:
+        self.coins_total += 1
+
+    self.set_at(x,y,new_object)
+
+  ## Saves the scores into a file that's associated with the level
+  #  (the one that's been passed to load_from_file method).
+
+  def save_scores(self):
+    if len(self.filename) == 0:
+      return
+
+    output_lines = []
+
+    input_file = open(self.filename)
+
+    for line in input_file:
+      if line.lstrip().rstrip() == "scores:":
+        break
+      else:
+        output_lines.append(line)
+
+    input_file.close()
+
+    output_file = open(self.filename,"w")
+
+    for line in output_lines:
+      output_file.write(line)
+
+    output_file.write("scores:\n")
+
+    for score in self.scores:
+      output_file.write(score[0] + " " + str(score[1]) + " " + str(score[2]) + "\n")
+
+    output_file.close()
+
+  ## Says to add a new score entry. The entry will be added if it will
+  #  be among the top scores.
+  #
+  #  @param name player name (string)
+  #  @param time time in milliseconds (int)
+  #  @param score player score
+
+  def add_score(self, name, time, score):
+    if len(self.scores) < 20:   # record 20 highest scores
+      self.scores.append((name,score,time))
+    else:
+      minimum_index = 0
+      i = 0
+
+      while i < len(self.scores):
+        if self.scores[i][1] < self.scores[minimum_index][1]:
+          minimum_index = i
+
+        i += 1
+
+      if self.scores[minimum_index][1] < score:
+        del self.scores[minimum_index]
+        self.scores.append((name,score,time))
+        self._sort_scores()
+
+  def _sort_scores(self):
+    self.scores.sort(key = lambda item: item[1],reverse = True)
+
+  ## Checks the game state and updates it acoordingly, for example if
+  #  a player is standing on an egg, they will take it.
+
+  def update(self):
+    self.time = int(self.clock)
+
+    for tracker in self.trigger_trackers:
+      if tracker.entity.dead:
+        continue
+
+      tracker.update()
+
+      if tracker.state == TriggerTracker.STATE_ENTERED:
+        if not self.__on_trigger_entered(tracker):
+          return
+
+      if tracker.on_trampoline:
+        if not tracker.entity.is_in_air():
+          tracker.entity.force_computer.velocity_vector[1] = -10
+          self.sound_player.play_trampoline()
+          self.particles.emit(ParticleSystem.EFFECT_TRAMPOLINE,tracker.entity.position_x,tracker.entity.position_y + tracker.entity.height / 2)
+
+    # compute the score (in integers, the time is in whole milliseconds):
+
+    self.score = 20000000 // (self.time + 20000) + self.coins_collected * 200
+
+    # check colissions of players with enemies (only the near ones):
+
+    for player in self.players:
+      if player.dead:
+        continue
+
+      for enemy in self.activity.get_enemies_in_area(player.position_x - 2,player.position_y - 2,player.position_x + 2,player.position_y + 2):
+        if collision_masks.collide(player,enemy):
+          self.kill_player(player)
+
+  ## Private method, takes the actions for an entity that has entered
+  #  a trigger cell (picks up coins and eggs, finishes the level etc.).
+  #
+  #  @param tracker tracker of the entity that has entered the cell
+  #         (TriggerTracker)
+  #  @return False if the level update should stop (the level has been
+  #          lost), True otherwise
+
+  def __on_trigger_entered(self, tracker):
+    cell_x = tracker.cell[0]
+    cell_y = tracker.cell[1]
+    trigger = tracker.trigger
+
+    if trigger.object_type == MapGridObject.OBJECT_COIN:
+      self.sound_player.play_coin()
+      self.particles.emit(ParticleSystem.EFFECT_COIN,cell_x + 0.5,cell_y + 0.5)
+      self.remove_at(cell_x,cell_y)
+      self.coins_collected += 1
+    elif trigger.object_type == MapGridObject.OBJECT_EGG:
+      self.sound_player.play_click()
+      self.particles.emit(ParticleSystem.EFFECT_EGG,cell_x + 0.5,cell_y + 0.5)
+      self.remove_at(cell_x,cell_y)
+      self.eggs_left -= 1
+    elif trigger.object_type == MapGridObject.OBJECT_FINISH:
+      if self.eggs_left <= 0:
+        self.state = Level.STATE_WON
+
+        if self.game != None and len(self.game.verifier) == 0 and len(self.players) == 1:   # otherwise the verification service saves the score, multiplayer runs aren't scored
+          self.add_score(self.game.name,self.time,self.score)
+          self.save_scores()
+
+        tracker.entity.force_computer.velocity_vector[0] = 0
+        self.sound_player.play_win()
+    elif trigger.object_type == MapGridObject.OBJECT_SPIKES:
+      self.kill_player(tracker.entity)
+      return self.state == Level.STATE_PLAYING
+
+    return True
+
+  ## Removes the object at given map position (e.g. a picked up coin).
+  #
+  #  @param x x position
+  #  @param y y position
+
+  def remove_at(self, x, y):
+    self.removed_objects[(x,y)] = self.map_array[x][y]
+    self.__get_writable_column(x)[y] = None
+    self.trigger_index.remove(x,y)
+
+    for tracker in self.trigger_trackers:
+      tracker.reset()
+
+  ## Sets the object at given map position and updates everything that
+  #  depends on the map.
+  #
+  #  @param x x position
+  #  @param y y position
+  #  @param map_grid_object new object (MapGridObject or None)
+
+  def set_at(self, x, y, map_grid_object):
+    self.__get_writable_column(x)[y] = map_grid_object
+    self.trigger_index.update_cell(x,y)
+    self.navigation_graph.update_cell(x,y)
+    self.raycast_grid.update_cell(x,y)
+
+    for tracker in self.trigger_trackers:
+      tracker.reset()
+
+  ## Simulates one step of the level: applies the player controls,
+  #  updates the game state and moves all the entities.
+  #
+  #  @param controls combination of Controls flags for the player, with
+  #         more players a list of the combinations by player
+  #  @param step_time step length in milliseconds
+
+  def step(self, controls, step_time):
+    self.clock += step_time
+
+    if self.state == Level.STATE_PLAYING:
+      if len(self.players) == 1:
+        self.player.apply_controls(controls)
+      else:
+        for i in range(len(self.players)):
+          if not self.players[i].dead:
+            self.players[i].apply_controls(controls[i])
+
+      self.update()
+
+    self.activity.update(step_time)
+
+    for player in self.players:
+      player.force_computer.execute_step(step_time)
+      player.update_state()
+
+  ## Saves the state of everything that changes during the simulation
+  #  (counters, picked up objects, entities, random generator), so that
+  #  it can be restored later.
+  #
+  #  @return state object to be passed to load_state
+
+  def save_state(self):
+    return (self.clock,self.time,self.state,self.score,self.coins_collected,self.eggs_left,
+      dict(self.removed_objects),self.random.getstate(),[player.save_state() for player in self.players],
+      [enemy.save_state() for enemy in self.enemies],
+      [(tracker.state,tracker.cell,tracker.trigger) for tracker in self.trigger_trackers],
+      self.activity.step_counter)
+
+  ## Restores a state saved with save_state.
+  #
+  #  @param state the state object
+
+  def load_state(self, state):
+    self.clock, self.time, self.state, self.score, self.coins_collected, self.eggs_left = state[:6]
+    removed_objects = state[6]
+
+    for position in self.removed_objects:   # put back the objects picked up after the save
+      if not position in removed_objects:
+        self.__get_writable_column(position[0])[position[1]] = self.removed_objects[position]
+        self.trigger_index.update_cell(position[0],position[1])
+
+    for position in removed_objects:
+      if not position in self.removed_objects:
+        self.__get_writable_column(position[0])[position[1]] = None
+        self.trigger_index.remove(position[0],position[1])
+
+    self.removed_objects = dict(removed_objects)
+    self.random.setstate(state[7])
+    for i in range(len(self.players)):
+      self.players[i].load_state(state[8][i])
+
+    for i in range(len(self.enemies)):
+      self.enemies[i].load_state(state[9][i])
+
+    for i in range(len(self.trigger_trackers)):
+      tracker = self.trigger_trackers[i]
+      tracker.state, tracker.cell, tracker.trigger = state[10][i]
+
+    self.activity.step_counter = state[11]
+    self.activity.build()
+
+  ## Sets the game state to lost and takes appropriate actions.
+
+  def set_lost(self):
+    for player in self.players:
+      self.kill_player(player)
+
+  ## Kills a player, the level is lost when all the players are dead.
+  #
+  #  @param player the Player
+
+  def kill_player(self, player):
+    if player.dead:
+      return
+
+    player.dead = True
+    player.last_quack_time = -99999 # to allow the player to make quack
+    player.quack()
+
+    if all(item.dead for item in self.players):
+      self.state = Level.STATE_LOST
+
+    self.particles.emit(ParticleSystem.EFFECT_DEATH,player.position_x,player.position_y)
+    player.solid = False
+    player.force_computer.velocity_vector[0] = -1
+    player.force_computer.velocity_vector[1] = -4
+    player.force_computer.acceleration_vector[0] = 0
+    player.force_computer.ground_friction = 0
+
+  def __init_attributes(self):
+    ## this will contain the name of the file associated with the level
+    self.filename = ""
+    ## the LevelTemplate the level has been made from or None
+    self.template = None
+    ## game to which the level belongs
+    self.game = None
+    ## the level name
+    self.name = ""
+    ## current score
+    self.score = 0
+    ## holds the level scores, the items of the list are tuples
+    #  (name, score, time in ms)
+    self.scores = []
+    ## state of the game
+    self.state = Level.STATE_PLAYING
+    ## total number of coins in the level, this doesn not decrease as
+    #  the player takes them
+    self.coins_total = 0
+    ## how many coins the player has collected in the level so far
+    self.coins_collected = 0
+    ## how many eggs are there left in the level
+    self.eggs_left = 0
+    ## the level background name
+    self.background_name = ""
+    ## background layers (see LevelTemplate.background_layers)
+    self.background_layers = ()
+    ## background color (pygame.Color)
+    self.background_color = None
+    ## list of tile types - dicts in format [id (int), name (str), number of variants (int)]
+    self.tiles = []
+    ## map width in tiles
+    self.width = 0
+    ## map height in tiles
+    self.height = 0
+    ## list of map columns representing the map, each item can be None
+    #  (representing nothing) or a MapGridObject, the columns shared
+    #  with the level template are tuples (see __get_writable_column)
+    self.map_array = None
+    ## list of columns of the cell strings as they were in the level
+    #  file, shared with the template in the same way
+    self.source_cells = None
+    ## contains a MapGridObject representing a tile with which the area
+    #  outside of the level is filled
+    self.outside_tile = None
+    ## the first player (Player)
+    self.player = None
+    ## all the players in the order of their controls
+    self.players = []
+    ## contains enemies
+    self.enemies = []
+    ## plays the sounds in the game
+    self.sound_player = None
+    ## simulates the visual effects (ParticleSystem)
+    self.particles = None
+    ## gravity force
+    self.gravity = 4.7
+    ## playing time from the level start in miliseconds (it stops when
+    #  the level is won or lost)
+    self.time = 0
+    ## simulation time from the level start in milliseconds, all the
+    #  timing in the level is based on it
+    self.clock = 0
+    ## random number generator of the level, seeding it makes the
+    #  simulation deterministic
+    self.random = random.Random()
+    ## objects removed from the map (picked up) indexed by (x,y)
+    self.removed_objects = {}
+    ## index of the interactive cells of the map
+    self.trigger_index = TriggerIndex(self)
+    ## trackers of the entities that interact with the trigger cells
+    #  (TriggerTracker)
+    self.trigger_trackers = []
+    ## navigation graph for the enemy AI
+    self.navigation_graph = NavigationGraph(self)
+    ## decides which enemies are simulated
+    self.activity = ActivityRegions(self)
+    ## solid cells for the ray casts and the line of sight checks
+    self.raycast_grid = RaycastGrid(self)
+
+  ## Gets the MapGridObject at given position in the map with map
+  #  boundary check.
+  #
+  #  @param x x position
+  #  @param y y position
+  #  @return MapGridObject at given position (can be also None), if the
+  #          position provided is outside the map area, the
+  #          MapGridObject representing the outside tile is returned
+
+  def get_at(self, x, y):
+    if x < 0 or x >= self.width or y < 0 or y >= self.height:
+      return self.outside_tile
+
+    return self.map_array[x][y]
+
+  ## Initialises a new level.
+  #
+  #  @param game game to which the level belongs, if None, the level is
+  #         simulated without sounds and without recording the scores
+
+  def __init__(self, game = None):
+    self.__init_attributes()
+    self.game = game
+
+    if game != None:
+      self.sound_player = game.sound_player
+      self.particles = game.particles
+    else:
+      self.sound_player = SoundPlayer(False)
+      self.particles = ParticleSystem(0)
+
+#-----------------------------------------------------------------------
+
+## Represents an object that has a position and a rectangular shape. The
+#  object can be moved with collision detections.
+
+class Movable(object):
+  def __init_attributes(self):
+    ## x position of the center in tiles (float)
+    self.position_x = 0.0
+    ## y position of the center in tiles (float)
+    self.position_y = 0.0
+    ## object width in tiles (float)
+    self.width = 0.4
+    ## object height in tiles (float)
+    self.height = 0.8
+    ## reference to a level in which the object is placed (for colision
+    #  detection)
+    self.level = None
+    ## says if collisions are applied when moving
+    self.solid = True
+
+  ## Check if the object collides with another object.
+  #
+  #  @param with_what object to check the collision with (Movable)
+  #  @return True if the objects collide, otherwise False
+
+  def collides(self, with_what):
+    if ((self.position_x < with_what.position_x and
+         self.position_x < with_what.position_x + with_what.width and
+         self.position_x + self.width < with_what.position_x and
+         self.position_x + self.width < with_what.position_x + with_what.width)
+         or
+         (self.position_x > with_what.position_x and
+         self.position_x > with_what.position_x + with_what.width and
+         self.position_x + self.width > with_what.position_x and
+         self.position_x + self.width > with_what.position_x + with_what.width)):
+      return False
+
+    if ((self.position_y < with_what.position_y and
+         self.position_y < with_what.position_y + with_what.height and
+         self.position_y + self.height < with_what.position_y and
+         self.position_y + self.height < with_what.position_y + with_what.height)
+         or
+         (self.position_y > with_what.position_y and
+         self.position_y > with_what.position_y + with_what.height and
+         self.position_y + self.height > with_what.position_y and
+         self.position_y + self.height > with_what.position_y + with_what.height)):
+      return False
+
+    return True
+
+  ## Checks if the object is in the air (i.e. there is no tile right
+  #  below it)
+  #
+  #  @return True if the object is in the air, False otherwise
+
+  def is_in_air(self):
+    distance_to_ground = 99999
+
+    lower_border = self.position_y + self.height / 2.0
+    tile_y = int(lower_border) + 1
+
+    if MapGridObject.is_tile(self.level.get_at(int(self.position_x),tile_y)):
+      distance_to_ground = tile_y - lower_border
+
+    return distance_to_ground > 0.1
+
+  ## Moves the object by given position difference with colission
+  #  detections.
+  #
+  #  @param dx position difference in x, in tiles (float)
+  #  @param dy position difference in y, in tiles (float)
+
+  def move_by(self, dx, dy):
+    if not self.solid:
+      self.position_x += dx
+      self.position_y += dy
+      return
+
+    half_width = self.width / 2.0
+    half_height = self.height / 2.0
+
+    # occupied cells in format (x1,y1,x2,y2)
+    occupied_cells = (int(self.position_x - half_width),int(self.position_y - half_height),int(self.position_x + half_width),int(self.position_y + half_height))
+
+    # distances to nearest obstacles:
+    distance_x = 0
+    distance_y = 0
+
+    if dx > 0:
+      minimum = 65536
+
+      for i in range(occupied_cells[1],occupied_cells[3] + 1):
+        value = 65536
+
+        for j in range(occupied_cells[2] + 1,occupied_cells[2] + 3):  # checks the following two cells
+          if MapGridObject.is_tile(self.level.get_at(j,i)):
+            value = j
+            break
+
+        if value < minimum:
+          minimum = value
+
+      distance_x = minimum - (self.position_x + half_width)
+    elif dx < 0:
+      maximum = -2048
+
+      for i in range(occupied_cells[1],occupied_cells[3] + 1):
+        value = -2048
+
+        for j in range(occupied_cells[0] - 1,occupied_cells[0] - 3,-1):
+          if MapGridObject.is_tile(self.level.get_at(j,i)):
+            value = j
+            break
+
+        if value > maximum:
+          maximum = value
+
+      distance_x = (maximum + 1) - (self.position_x - half_width)
+
+    if dy > 0:
+      minimum = 65536
+
+      for i in range(occupied_cells[0],occupied_cells[2] + 1):
+        value = 65536
+
+        for j in range(occupied_cells[3] + 1,occupied_cells[3] + 3):  # checks the following two cells
+          if MapGridObject.is_tile(self.level.get_at(i,j)):
+            value = j
+            break
+
+        if value < minimum:
+          minimum = value
+
+      distance_y = minimum - (self.position_y + half_height)
+    elif dy < 0:
+      maximum = -2048
+
+      for i in range(occupied_cells[0],occupied_cells[2] + 1):
+        value = -2048
+
+        for j in range(occupied_cells[1] - 1,occupied_cells[1] - 3,-1):
+          if MapGridObject.is_tile(self.level.get_at(i,j)):
+            value = j
+            break
+
+        if value > maximum:
+          maximum = value
+
+      distance_y = (maximum + 1) - (self.position_y - half_height)
+
+    if abs(distance_x) > abs(dx):
+      self.position_x += dx
+
+    if abs(distance_y) > abs(dy):
+      self.position_y += dy
+
+  ## Saves the state that changes during the simulation.
+  #
+  #  @return state object to be passed to load_state
+
+  def save_state(self):
+    force_computer = self.force_computer
+    return (self.position_x,self.position_y,self.solid,list(force_computer.velocity_vector),list(force_computer.acceleration_vector),force_computer.ground_friction)
+
+  ## Restores a state saved with save_state.
+  #
+  #  @param state the state object
+
+  def load_state(self, state):
+    self.position_x, self.position_y, self.solid = state[:3]
+    self.force_computer.velocity_vector = list(state[3])
+    self.force_computer.acceleration_vector = list(state[4])
+    self.force_computer.ground_friction = state[5]
+
+  def __init__(self, level):
+    self.__init_attributes()
+    self.level = level
+    return
+
+#-----------------------------------------------------------------------
+
+class Player(Movable):
+  PLAYER_STATE_STANDING = 0
+  PLAYER_STATE_WALKING = 1
+  PLAYER_STATE_JUMPING_UP = 2
+  PLAYER_STATE_JUMPING_DOWN = 3
+  QUACK_COOLDOWN = 5000       # quack cooldown time in milliseconds
+  QUACK_DURATION = 2500       # for how long the quack immobilises the enemies
+  QUACK_LENGTH = 350          # for how long the quacking image is shown
+  FLYING_FORCE = 2            # what number is substracted from gravity when flapping the ducks wings
+  UPDATE_STATE_AFTER_STEPS = 7
+
+  def __init_attributes(self):
+    ## basic player state
+    self.state = Player.PLAYER_STATE_STANDING
+    ## whether the player is facing right or left
+    self.facing_right = True
+    ## whether the player is flapping its wings
+    self.flapping_wings = False
+    self.last_quack_time = -999999
+    ## force computer of the player
+    self.force_computer = ForceComputer(self)
+    ## horizontal acceleration when walking
+    self.walk_acceleration = 20.0
+    ## whether the flapping sound has been played for the current flap
+    self.flapping_played = False
+    ## the state is updated once every n steps
+    self.state_update_counter = 0
+    ## whether the player has been killed
+    self.dead = False
+
+  def jump(self):
+    self.force_computer.velocity_vector[1] = -3.7
+
+  ## Picks the image of the player's current animation frame.
+  #
+  #  @param images CharacterImageContainer with the player images (or
+  #         with anything in the same layout, such as the masks)
+  #  @param animation_frame see Level.get_animation_frame
+  #  @return the picked item of images
+
+  def get_image(self, images, animation_frame):
+    if self.flapping_wings:
+      flapping_animation_frame = animation_frame % 2
+    else:
+      flapping_animation_frame = 0
+
+    if self.level.clock < self.last_quack_time + Player.QUACK_LENGTH:
+      return images.special[0 if self.facing_right else 1]
+    elif self.state == Player.PLAYER_STATE_WALKING:
+      if self.facing_right:
+        return images.moving_right[animation_frame % len(images.moving_right)]
+      else:
+        return images.moving_left[animation_frame % len(images.moving_left)]
+    elif self.state == Player.PLAYER_STATE_JUMPING_UP:
+      return images.jumping[(0 if self.facing_right else 4) + flapping_animation_frame]
+    elif self.state == Player.PLAYER_STATE_JUMPING_DOWN:
+      return images.jumping[(3 if self.facing_right else 7) - flapping_animation_frame]
+
+    return images.standing[0 if self.facing_right else 1]
+
+  ## Makes the player quack and takes appropriate actions (tells the
+  #  level about it etc).
+
+  def quack(self):
+    if self.level.clock < self.last_quack_time + Player.QUACK_COOLDOWN:
+      return
+
+    self.last_quack_time = self.level.clock
+    self.level.sound_player.play_quack()
+    self.level.particles.emit(ParticleSystem.EFFECT_QUACK,self.position_x,self.position_y)
+
+  ## Applies the player controls for one simulation step.
+  #
+  #  @param controls combination of Controls flags (int)
+
+  def apply_controls(self, controls):
+    if controls & Controls.UP:
+      if not self.state in [Player.PLAYER_STATE_JUMPING_UP, Player.PLAYER_STATE_JUMPING_DOWN] and not self.is_in_air():
+        self.jump()
+
+    if controls & Controls.RIGHT and not controls & Controls.LEFT:
+      self.force_computer.acceleration_vector[0] = self.walk_acceleration
+    elif controls & Controls.LEFT and not controls & Controls.RIGHT:
+      self.force_computer.acceleration_vector[0] = -self.walk_acceleration
+    else:
+      self.force_computer.acceleration_vector[0] = 0
+
+    if controls & Controls.QUACK:
+      self.quack()
+
+    if controls & Controls.FLAP:
+      if not self.flapping_played:
+        self.level.sound_player.play_flap()
+        self.flapping_played = True
+
+      self.flapping_wings = True
+    else:
+      self.flapping_played = False
+      self.flapping_wings = False
+
+    if self.flapping_wings:
+      self.force_computer.acceleration_vector[1] = self.level.gravity - Player.FLYING_FORCE
+    else:
+      self.force_computer.acceleration_vector[1] = self.level.gravity
+
+  ## Updates the player state (standing, walking, ...) from the
+  #  velocity, this is done only once every few steps to prevent the
+  #  "jerky" sprite changing.
+
+  def update_state(self):
+    self.state_update_counter = (self.state_update_counter + 1) % Player.UPDATE_STATE_AFTER_STEPS
+
+    if self.state_update_counter != 0:
+      return
+
+    if self.force_computer.velocity_vector[1] > 0.1:
+      self.state = Player.PLAYER_STATE_JUMPING_DOWN
+    elif self.force_computer.velocity_vector[1] < -0.1:
+      self.state = Player.PLAYER_STATE_JUMPING_UP
+    else:
+      if self.force_computer.velocity_vector[0] > 0.1 or self.force_computer.velocity_vector[0] < -0.1:
+        self.state = Player.PLAYER_STATE_WALKING
+      else:
+        self.state = Player.PLAYER_STATE_STANDING
+
+    if self.force_computer.acceleration_vector[0] > 0.1:
+      self.facing_right = True
+    elif self.force_computer.acceleration_vector[0] < -0.1:
+      self.facing_right = False
+
+  def save_state(self):
+    return (super(Player,self).save_state(),self.state,self.facing_right,self.flapping_wings,self.last_quack_time,self.flapping_played,self.state_update_counter,self.walk_acceleration,
+      self.dead)
+
+  def load_state(self, state):
+    super(Player,self).load_state(state[0])
+    self.state, self.facing_right, self.flapping_wings, self.last_quack_time, self.flapping_played, self.state_update_counter, self.walk_acceleration, self.dead = state[1:]
+
+  def __init__(self, level):
+    super(Player,self).__init__(level)
+    self.__init_attributes()
+    self.force_computer.acceleration_vector[0] = self.level.gravity     # set the gravity
+    self.force_computer.acceleration_vector[1] = 0
+
+
+#-----------------------------------------------------------------------
+
+class Enemy(Movable):
+  ENEMY_FLYING = 0
+  ENEMY_GROUND = 1
+  CHASE_DISTANCE = 6          # distance in tiles from which the enemies chase the player
+  CHASE_SPEED = 1.2           # speed in tiles per second when chasing the player
+  JUMP_SPEED = -3.7
+  PATH_UPDATE_INTERVAL = 400  # how often the path to the player is recomputed in milliseconds
+
+  ## Picks the image of the enemy's current animation frame.
+  #
+  #  @param ground_images images of the ground enemy (standing, moving
+  #         right, moving left) or anything in the same layout
+  #  @param flying_images animation frames of the flying enemy
+  #  @param animation_frame see Level.get_animation_frame
+  #  @return the picked item of the lists
+
+  def get_image(self, ground_images, flying_images, animation_frame):
+    if self.enemy_type == Enemy.ENEMY_GROUND:
+      if self.force_computer.velocity_vector[0] > 0.5:
+        return ground_images[1]
+      elif self.force_computer.velocity_vector[0] < -0.5:
+        return ground_images[2]
+
+      return ground_images[0]
+
+    return flying_images[animation_frame % len(flying_images)]
+
+  ## Makes the enemy move accoording to its AI.
+  #
+  #  @param step_time step length in milliseconds
+
+  def ai_move(self, step_time):
+    self.force_computer.execute_step(step_time)
+
+    if self.level.clock < self.level.get_last_quack_time() + Player.QUACK_DURATION:  # quack is active => monsters don't move
+      self.force_computer.velocity_vector[0] = 0
+
+      if self.enemy_type == Enemy.ENEMY_FLYING:
+        self.force_computer.velocity_vector[1] = 0
+
+      return
+
+    if self.__is_chasing() and self.__chase_player():
+      return
+
+    if self.level.clock >= self.next_direction_change:
+      self.next_direction_change = self.level.clock + self.level.random.randint(500,2000)
+      self.__recompute_direction()
+
+  ## Private method, recomputes the direction of movement to a new
+  #  direction and remembers it as a velocity vector in force computer.
+
+  def __recompute_direction(self):
+    self.force_computer.velocity_vector[0] = 1.0 - self.level.random.random() * 2.0
+    self.force_computer.velocity_vector[1] = 1.0 - self.level.random.random() * 2.0
+
+  def __is_chasing(self):
+    player = self.level.get_nearest_player(self.position_x,self.position_y)
+
+    return (self.level.state == Level.STATE_PLAYING and
+      abs(player.position_x - self.position_x) + abs(player.position_y - self.position_y) < Enemy.CHASE_DISTANCE)
+
+  ## Private method, steers the enemy towards the player, the ground
+  #  enemies follow a path found in the level navigation graph.
+  #
+  #  @return True if the enemy is steering towards the player, False if
+  #          the player can't be reached
+
+  def __chase_player(self):
+    player = self.level.get_nearest_player(self.position_x,self.position_y)
+    velocity = self.force_computer.velocity_vector
+
+    if self.enemy_type == Enemy.ENEMY_FLYING:
+      dx = player.position_x - self.position_x
+      dy = player.position_y - self.position_y
+      distance = max(math.sqrt(dx * dx + dy * dy),0.001)
+      velocity[0] = dx / distance * Enemy.CHASE_SPEED
+      velocity[1] = dy / distance * Enemy.CHASE_SPEED
+      return True
+
+    graph = self.level.navigation_graph
+    cell = (int(self.position_x),int(self.position_y))
+
+    if self.level.clock >= self.next_path_update or self.path_version != graph.version:
+      self.next_path_update = self.level.clock + Enemy.PATH_UPDATE_INTERVAL
+      self.path_version = graph.version
+      self.path = graph.find_path(cell,(int(player.position_x),int(player.position_y)))
+
+      if self.path != None:
+        self.path = list(self.path)    # the cached path must not be changed
+
+    if self.path == None:
+      return False
+
+    if len(self.path) > 0 and graph.get_segment_at(cell[0],cell[1]) == self.path[0][1]:
+      del self.path[0]       # the link has been taken
+
+    if len(self.path) == 0:
+      target_x = player.position_x
+    else:
+      link = self.path[0]
+      target_x = link[0] + 0.5
+
+      if abs(target_x - self.position_x) < 0.2:    # at the exit, take the link
+        target_x = link[2] + 0.5
+
+        if link[4] == NavigationGraph.LINK_JUMP and not self.is_in_air():
+          velocity[1] = Enemy.JUMP_SPEED
+
+    if target_x > self.position_x + 0.1:
+      velocity[0] = Enemy.CHASE_SPEED
+    elif target_x < self.position_x - 0.1:
+      velocity[0] = -Enemy.CHASE_SPEED
+    else:
+      velocity[0] = 0
+
+    return True
+
+  def save_state(self):
+    return (super(Enemy,self).save_state(),self.next_direction_change,None if self.path == None else list(self.path),self.next_path_update,self.path_version,self.pending_time)
+
+  def load_state(self, state):
+    super(Enemy,self).load_state(state[0])
+    self.next_direction_change, self.path, self.next_path_update, self.path_version, self.pending_time = state[1:]
+
+    if self.path != None:
+      self.path = list(self.path)
+
+  def __init__(self, level, enemy_type = ENEMY_GROUND):
+    super(Enemy,self).__init__(level)
+    self.enemy_type = enemy_type
+
+    self.force_computer = ForceComputer(self)
+
+    if self.enemy_type == Enemy.ENEMY_GROUND:  # apply gravity to the ground robot
+      self.force_computer.acceleration_vector[0] = 0
+      self.force_computer.acceleration_vector[1] = level.gravity
+
+    self.force_computer.ground_friction = 0
+
+    ## time of next direction change
+    self.next_direction_change = 0
+    ## path to the player being followed (list of navigation links)
+    self.path = None
+    ## time of the next path recomputation
+    self.next_path_update = 0
+    ## navigation graph version for which the path has been found
+    self.path_version = -1
+    ## (x,y) map cell from which the enemy has been spawned
+    self.spawn_cell = None
+    ## key of the activity bucket the enemy is in (see ActivityRegions)
+    self.activity_bucket = None
+    ## number of the step in which the enemy has been last processed
+    self.activity_step = -1
+    ## offset of the reduced rate updates, so that they're spread over
+    #  the steps
+    self.activity_phase = 0
+    ## simulation time in milliseconds that the enemy has to catch up
+    self.pending_time = 0
+
+    self.enemy_type = enemy_type
+    return
+
+#-----------------------------------------------------------------------
+
+## Tile top layer image container.
+
+class TileTopImageContainer:
+  def __init__(self):
+    ## full image
+    self.image = None
+    ## subimage - left
+    self.left = None
+    ## subimage - center
+    self.center = None
+    ## subimage - right
+    self.right = None
+
+#-----------------------------------------------------------------------
+
+## Keeps the recently rendered texts so that the texts which don't
+#  change between frames aren't rendered again.
+
+class TextCache:
+  MAX_ITEMS = 256
+
+  ## Renders a text or gets it from the cache.
+  #
+  #  @param font font to render the text with (pygame.font.Font)
+  #  @param text the text (string)
+  #  @param color text color as (r,g,b)
+  #  @return image with the text (pygame.Surface), it mustn't be modified
+
+  def render(self, font, text, color):
+    key = (font,text,color)
+    result = self.images.get(key)
+
+    if result != None:
+      self.images.move_to_end(key)
+      return result
+
+    result = font.render(text,1,color)
+    self.images[key] = result
+
+    if len(self.images) > TextCache.MAX_ITEMS:
+      self.images.popitem(last = False)
+
+    return result
+
+  def __init__(self):
+    ## rendered texts indexed by (font, text, color), in the order of use
+    self.images = collections.OrderedDict()
+
+#-----------------------------------------------------------------------
+
+## Rasterizes the chunks of the static world in a pool of worker
+#  threads (the blits release the GIL, so the workers run in parallel
+#  with the main thread). The chunks nearest to the camera are
+#  rasterized first, the finished ones are kept in a LRU cache. A chunk
+#  whose rasterization fails because the level changes meanwhile is
+#  dropped (the change invalidates it), other errors are reported once
+#  and the failed chunk stays a placeholder.
+
+class ChunkRasterizer:
+  WORKERS = 3
+  MAX_CHUNKS = 48
+
+  ## Gets a rasterized chunk.
+  #
+  #  @param key chunk key (x,y)
+  #  @param default value returned if the chunk isn't ready
+  #  @return the chunk image (pygame.Surface), None if the chunk is
+  #          empty, or default
+
+  def get(self, key, default):
+    with self.condition:
+      if not key in self.chunks:
+        return default
+
+      self.chunks.move_to_end(key)
+      return self.chunks[key]
+
+  ## Stores a chunk rasterized outside of the workers.
+  #
+  #  @param key chunk key (x,y)
+  #  @param chunk the chunk image or None if the chunk is empty
+
+  def put(self, key, chunk):
+    with self.condition:
+      self.chunks[key] = chunk
+
+      while len(self.chunks) > self.max_chunks:
+        self.chunks.popitem(last = False)
+
+  ## Sets the chunks that should be rasterized, replacing the previous
+  #  requests that haven't been started. The chunks that are ready are
+  #  ignored.
+  #
+  #  @param keys list of chunk keys (x,y)
+  #  @param centers list of (x,y) chunk positions (e.g. one per
+  #         viewport), the chunks nearest to any of them go first
+
+  def request(self, keys, centers):
+    with self.condition:
+      distances = {}
+
+      for key in keys:
+        if not key in self.chunks and not key in self.in_progress and not key in self.failed:
+          distances[key] = min(abs(key[0] - center[0]) + abs(key[1] - center[1]) for center in centers)
+
+      self.queue = [(distances[key],key) for key in distances]
+      heapq.heapify(self.queue)
+
+      if len(self.queue) > 0:
+        if len(self.workers) == 0 and not self.closed:
+          self.__start_workers()
+
+        self.condition.notify_all()
+
+  ## Drops given chunks, they will be rasterized again when requested.
+  #
+  #  @param keys iterable of chunk keys
+
+  def invalidate(self, keys):
+    with self.condition:
+      for key in keys:
+        self.chunks.pop(key,None)
+        self.failed.discard(key)
+
+        if key in self.in_progress:
+          self.stale.add(key)
+
+  ## Drops all the chunks (e.g. when the level changes).
+
+  def clear(self):
+    with self.condition:
+      self.chunks.clear()
+      self.queue = []
+      self.failed.clear()
+      self.stale.update(self.in_progress)
+
+  ## Gets the size of the rasterized chunks.
+  #
+  #  @return size in bytes
+
+  def get_memory_usage(self):
+    with self.condition:
+      return MemoryAccounting.get_surfaces_size(list(self.chunks.values()))
+
+  ## Gets the numbers of (ready, queued) chunks.
+
+  def get_counts(self):
+    with self.condition:
+      return (len(self.chunks),len(self.queue) + len(self.in_progress))
+
+  ## Stops the workers, it waits for the chunks being rasterized. The
+  #  rasterizer can't be used after this.
+
+  def close(self):
+    with self.condition:
+      self.closed = True
+      self.queue = []
+      self.condition.notify_all()
+      workers = self.workers
+      self.workers = []
+
+    for worker in workers:
+      worker.join()
+
+  def __work(self):
+    while True:
+      with self.condition:
+        while len(self.queue) == 0 and not self.closed:
+          self.condition.wait()
+
+        if self.closed:
+          return
+
+        key = heapq.heappop(self.queue)[1]
+        self.in_progress.add(key)
+
+      time_start = get_precise_time()
+      error = None
+
+      try:
+        chunk = self.rasterize(key)
+      except Exception as e:
+        chunk = None
+        error = e
+
+      raster_time = get_precise_time() - time_start
+
+      with self.condition:
+        self.in_progress.discard(key)
+
+        if key in self.stale:   # the level has changed during the rasterization, an error is expected then
+          self.stale.discard(key)
+          continue
+
+        if error != None:       # a bug, the chunk isn't requested again so that it doesn't fail over and over
+          self.failed.add(key)
+
+          if not self.error_reported:
+            self.error_reported = True
+            print("chunk " + str(key) + " couldn't be rasterized, it's drawn as a placeholder:")
+            traceback.print_exception(type(error),error,error.__traceback__)
+
+          continue
+
+        stats.add_sample("chunk raster [ms]",raster_time)
+        self.chunks[key] = chunk
+
+        while len(self.chunks) > self.max_chunks:
+          self.chunks.popitem(last = False)
+
+  def __start_workers(self):
+    for i in range(ChunkRasterizer.WORKERS):
+      worker = threading.Thread(target = self.__work)
+      worker.daemon = True
+      worker.start()
+      self.workers.append(worker)
+
+  ## Initialises the rasterizer, the workers are started when the first
+  #  chunks are requested.
+  #
+  #  @param rasterize function that rasterizes a chunk given by its key,
+  #         it returns the chunk image or None if the chunk is empty, it
+  #         is called from the worker threads
+
+  def __init__(self, rasterize):
+    self.rasterize = rasterize
+    self.condition = threading.Condition()
+    ## number of the chunks kept, it grows with the number of viewports
+    self.max_chunks = ChunkRasterizer.MAX_CHUNKS
+    ## rasterized chunks by key, in the order of use
+    self.chunks = collections.OrderedDict()
+    ## heap of the requested chunks in format (distance, key)
+    self.queue = []
+    ## keys of the chunks being rasterized
+    self.in_progress = set()
+    ## keys of the chunks being rasterized whose result will be dropped
+    self.stale = set()
+    ## keys of the chunks whose rasterization has failed, they aren't
+    #  requested again until they're invalidated
+    self.failed = set()
+    ## whether a rasterization error has been printed
+    self.error_reported = False
+    ## worker threads, they're started by the first request
+    self.workers = []
+    ## whether close has been called
+    self.closed = False
+
+#-----------------------------------------------------------------------
+
+## Collects the draw commands of a frame and submits them in one
+#  Surface.blits call, which saves the interpreter overhead of the
+#  individual blit calls. The commands are drawn by layers, inside a
+#  layer they are drawn in the order of adding, or grouped by the source
+#  image if sort_images is set, except for the ORDERED_LAYERS whose
+#  images overlap (the parallax background strips from far to near, the
+#  GUI texts over the score bar).
+
+class RenderQueue:
+  LAYER_BACKGROUND = 0
+  LAYER_WORLD = 1
+  LAYER_OBJECTS = 2
+  LAYER_PLAYER = 3
+  LAYER_ENEMIES = 4
+  LAYER_PARTICLES = 5
+  LAYER_GUI = 6
+  LAYER_OVERLAY = 7
+  LAYERS = 8
+  ORDERED_LAYERS = (LAYER_BACKGROUND,LAYER_GUI,LAYER_OVERLAY)
+  BLIT_COUNT_BOUNDS = (10,20,50,100,200,500,1000)
+
+  ## Adds a draw command.
+  #
+  #  @param layer layer to draw in (one of the LAYER_ constants)
+  #  @param image image to be drawn (pygame.Surface)
+  #  @param position (x,y) destination position
+  #  @param area part of the image to be drawn (pygame.Rect) or None
+  #         for the whole image
+  #  @param flags special flags of the blit
+
+  def add(self, layer, image, position, area = None, flags = 0):
+    self.layers[layer].append((image,position,area,flags))
+
+  ## Adds a list of draw commands.
+  #
+  #  @param layer layer to draw in (one of the LAYER_ constants)
+  #  @param commands list of (image, position, area, flags)
+
+  def extend(self, layer, commands):
+    self.layers[layer] += commands
+
+  ## Draws all the added commands and clears the queue.
+  #
+  #  @param backend renderer backend to draw with (SurfaceBackend or
+  #         TextureBackend)
+  #  @param viewport screen area (pygame.Rect) the commands are drawn
+  #         to and clipped by, their positions are relative to it, None
+  #         means the whole screen
+  #  @return number of the drawn commands
+
+  def submit(self, backend, viewport = None):
+    commands = []
+
+    for i in range(RenderQueue.LAYERS):
+      layer = self.layers[i]
+
+      if self.sorted_layers[i]:
+        layer.sort(key = lambda command: id(command[0]))
+
+      commands += layer
+      del layer[:]
+
+    backend.draw(commands,viewport)
+    return len(commands)
+
+  def __init__(self, sort_images = False):
+    ## whether the commands of each layer are grouped by the image
+    self.sorted_layers = [sort_images and not layer in RenderQueue.ORDERED_LAYERS for layer in range(RenderQueue.LAYERS)]
+    ## lists of commands (image, position, area, flags) by layer
+    self.layers = [[] for i in range(RenderQueue.LAYERS)]
+
+#-----------------------------------------------------------------------
+
+## Renderer backend drawing with the CPU: the frame is composed in a
+#  pygame.Surface. By default it is the display surface itself, so
+#  showing the frame needs no copy, another target surface (see
+#  set_target) is copied to the display surface when presented. The
+#  copied amount is recorded in the "frame copy [kB]" statistic.
+
+class SurfaceBackend:
+  NAME = "surface"
+
+  ## Starts a new frame.
+  #
+  #  @param color background color the frame is cleared with
+
+  def begin_frame(self, color):
+    self.frame.fill(color)
+
+  ## Draws a list of commands (see RenderQueue).
+  #
+  #  @param commands list of (image, position, area, flags)
+  #  @param viewport see RenderQueue.submit
+
+  def draw(self, commands, viewport = None):
+    if viewport == None:
+      self.frame.blits(commands,False)
+    else:
+      self.frame.subsurface(viewport).blits(commands,False)
+
+  ## Shows the frame on the screen.
+
+  def present(self):
+    if self.screen == None:     # offscreen
+      return
+
+    self.bytes_copied = 0
+
+    if self.frame != self.screen:
+      self.screen.blit(self.frame,(0,0))
+      self.bytes_copied = self.frame.get_width() * self.frame.get_height() * self.screen.get_bytesize()
+
+    stats.add_sample("frame copy [kB]",self.bytes_copied / 1024.0)
+    pygame.display.flip()
+
+  ## Sets the surface the frames are composed in.
+  #
+  #  @param target pygame.Surface of the frame size supplied by the
+  #         caller (it is drawn to until the target is changed), or None
+  #         for the display surface, or a buffer of the backend when
+  #         drawing offscreen
+
+  def set_target(self, target):
+    if target != None:
+      self.frame = target
+    elif self.screen != None:
+      self.frame = self.screen
+    else:
+      if self.buffer == None:
+        self.buffer = pygame.Surface(self.size)
+
+      self.frame = self.buffer
+
+  ## Gets the last drawn frame.
+  #
+  #  @return pygame.Surface, it mustn't be modified
+
+  def get_frame(self):
+    return self.frame
+
+  ## Gets the memory used by the backend.
+  #
+  #  @return list of (category, size in bytes)
+
+  def get_memory_usage(self):
+    return [("frame",MemoryAccounting.get_surface_size(self.frame) if self.frame != self.screen else 0)]
+
+  ## Initialises the backend.
+  #
+  #  @param screen display surface (pygame.Surface) or None for
+  #         drawing offscreen only
+  #  @param size (width,height) of the frames if screen is None
+  #  @param target see set_target
+
+  def __init__(self, screen, size = None, target = None):
+    self.screen = screen
+    self.size = screen.get_size() if screen != None else size
+    ## the backend's own offscreen frame or None
+    self.buffer = None
+    ## number of bytes copied to the display surface by the last present
+    self.bytes_copied = 0
+    ## the image the frames are composed in, it is reused by all the
+    #  frames
+    self.frame = None
+    self.set_target(target)
+
+#-----------------------------------------------------------------------
+
+## Renderer backend drawing with the SDL2 renderer API: the images are
+#  uploaded as textures when they're drawn for the first time and the
+#  drawing is done by copying the textures. Either a hardware
+#  accelerated or the SDL software renderer can be used, so the backend
+#  works on machines without a GPU as well.
+
+class TextureBackend:
+  NAME = "texture"
+  MAX_TEXTURES = 512     # most recently drawn images whose textures are kept
+
+  def begin_frame(self, color):
+    self.uploads = 0
+    self.renderer.draw_color = (color[0],color[1],color[2],255)
+    self.renderer.clear()
+
+  def draw(self, commands, viewport = None):
+    if viewport != None:
+      self.renderer.set_viewport(viewport)
+
+    for command in commands:
+      texture = self.__get_texture(command[0])
+
+      if command[2] == None:
+        texture.draw(None,command[1])
+      else:
+        texture.draw(command[2],pygame.Rect(command[1][0],command[1][1],command[2].width,command[2].height))
+
+    if viewport != None:
+      self.renderer.set_viewport(None)
+
+  def present(self):
+    self.renderer.present()
+    stats.set_value("texture uploads (last frame)",self.uploads)
+
+  ## Gets the last drawn frame, it has to be read back from the renderer
+  #  so it's slow.
+  #
+  #  @return pygame.Surface
+
+  def get_frame(self):
+    return self.renderer.to_surface()
+
+  ## Gets the estimated memory used by the textures (4 bytes per pixel).
+  #
+  #  @return list of (category, size in bytes)
+
+  def get_memory_usage(self):
+    return [("textures",sum(item[0].get_width() * item[0].get_height() * 4 for item in list(self.textures.values())))]
+
+  ## Private method, gets the texture of an image, the texture is made
+  #  if the image hasn't been drawn recently.
+
+  def __get_texture(self, image):
+    key = id(image)
+    item = self.textures.get(key)
+
+    if item != None and item[0] is image:   # the id of a freed image can be reused
+      self.textures.move_to_end(key)
+      return item[1]
+
+    texture = sdl2_video.Texture.from_surface(self.renderer,image)
+    self.textures[key] = (image,texture)     # the image reference keeps the id valid
+    self.textures.move_to_end(key)
+    self.uploads += 1
+
+    if len(self.textures) > TextureBackend.MAX_TEXTURES:
+      self.textures.popitem(last = False)
+
+    return texture
+
+  ## Initialises the backend, opens a new window.
+  #
+  #  @param size (width,height) window size
+  #  @param title window title
+  #  @param fullscreen whether the window is fullscreen
+  #  @param software whether the SDL software renderer is used instead
+  #         of the hardware accelerated one, the software renderer is
+  #         also used if there's no accelerated one
+
+  def __init__(self, size, title, fullscreen, software = False):
+    self.window = sdl2_video.Window(title,size = size,fullscreen = fullscreen)
+    self.renderer = None
+
+    if not software:
+      try:
+        self.renderer = sdl2_video.Renderer(self.window,accelerated = 1)
+      except sdl2_video.error:
+        print("no accelerated renderer available, using the software one")
+
+    if self.renderer == None:
+      self.renderer = sdl2_video.Renderer(self.window,accelerated = 0)
+
+    ## textures of the drawn images in format (image, texture) indexed
+    #  by the image id, in the order of use
+    self.textures = collections.OrderedDict()
+    ## number of textures made in the current frame
+    self.uploads = 0
+
+#-----------------------------------------------------------------------
+
+## Character (player, enemy, ...) image container.
+
+class CharacterImageContainer:
+  def __init__(self):
+    self.standing = []
+    self.moving_right = []
+    self.moving_left = []
+    self.jumping = []
+    self.special = []
+
+#-----------------------------------------------------------------------
+
+## Pixel masks of the player and enemy animation frames for the precise
+#  collisions, in the same layout as the images of the Renderer, so that
+#  Player.get_image and Enemy.get_image pick them the same way. The masks
+#  are made once from the _mask.bmp files of the frames, a collision is
+#  only tested with them when the bounding boxes of the masks overlap.
+
+class CollisionMasks:
+  THRESHOLD = 128       # mask file values from which the pixels are solid
+
+  ## Makes the collision mask of an animation frame.
+  #
+  #  @param mask_image the _mask.bmp image of the frame
+  #  @param flip whether to flip the mask horizontally
+  #  @return tuple (pygame.mask.Mask, bounding box of the solid pixels
+  #          as pygame.Rect relative to the frame center)
+
+  @staticmethod
+  def make_mask(mask_image, flip = False):
+    if flip:
+      mask_image = pygame.transform.flip(mask_image,True,False)
+
+    level = 256 - CollisionMasks.THRESHOLD
+    mask = pygame.mask.from_threshold(mask_image,(255,255,255,255),(level,level,level,255))
+    bounding_rects = mask.get_bounding_rects()
+
+    if len(bounding_rects) == 0:
+      bounding_rect = pygame.Rect(0,0,0,0)
+    else:
+      bounding_rect = bounding_rects[0].unionall(bounding_rects[1:])
+
+    bounding_rect.move_ip(-(mask_image.get_width() // 2),-(mask_image.get_height() // 2))
+    return (mask,bounding_rect)
+
+  ## Loads the masks if they aren't loaded yet, it is safe to call from
+  #  more threads.
+  #
+  #  @return True if the masks are available, False if they couldn't be
+  #          loaded
+
+  def load(self):
+    with self.lock:
+      if self.loaded != None:
+        return self.loaded
+
+      try:
+        player = CharacterImageContainer()
+        standing = resource_loader.load_image("duck_right_stand_mask.bmp")
+        player.standing = [CollisionMasks.make_mask(standing),CollisionMasks.make_mask(standing,True)]
+
+        for i in range(1,7):
+          walk = resource_loader.load_image("duck_right_walk_" + str(i) + "_mask.bmp")
+          player.moving_right.append(CollisionMasks.make_mask(walk))
+          player.moving_left.append(CollisionMasks.make_mask(walk,True))
+
+        for flip in (False,True):
+          for name in ("jump_up_1","jump_up_2","jump_down_1","jump_down_2"):
+            player.jumping.append(CollisionMasks.make_mask(resource_loader.load_image("duck_right_" + name + "_mask.bmp"),flip))
+
+        quack = resource_loader.load_image("duck_right_quack_mask.bmp")
+        player.special = [CollisionMasks.make_mask(quack),CollisionMasks.make_mask(quack,True)]
+
+        self.enemy_ground = [CollisionMasks.make_mask(resource_loader.load_image("robot_ground_" + name + "_mask.bmp"))
+          for name in ("stand","right","left")]
+        self.enemy_flying = [CollisionMasks.make_mask(resource_loader.load_image("robot_flying_" + str(i) + "_mask.bmp"))
+          for i in range(1,4)]
+        self.player = player
+        self.loaded = True
+      except (pygame.error,IOError,OSError):
+        self.loaded = False
+
+      return self.loaded
+
+  ## Checks if a player collides with an enemy. The bounding boxes of
+  #  the current frames are compared first and the masks only if they
+  #  overlap. If the masks can't be loaded, Movable.collides is used.
+  #
+  #  @param player the Player
+  #  @param enemy the Enemy
+  #  @return True if the solid pixels of the frames overlap
+
+  def collide(self, player, enemy):
+    if not self.loaded and not self.load():
+      return player.collides(enemy)
+
+    self.tests += 1
+    animation_frame = player.level.get_animation_frame()
+    player_mask, player_box = player.get_image(self.player,animation_frame)
+    enemy_mask, enemy_box = enemy.get_image(self.enemy_ground,self.enemy_flying,animation_frame)
+
+    # frame centers in pixels:
+    player_x = int(player.position_x * Renderer.TILE_WIDTH)
+    player_y = int(player.position_y * Renderer.TILE_HEIGHT)
+    enemy_x = int(enemy.position_x * Renderer.TILE_WIDTH)
+    enemy_y = int(enemy.position_y * Renderer.TILE_HEIGHT)
+
+    if (player_x + player_box.right <= enemy_x + enemy_box.left or enemy_x + enemy_box.right <= player_x + player_box.left or
+      player_y + player_box.bottom <= enemy_y + enemy_box.top or enemy_y + enemy_box.bottom <= player_y + player_box.top):
+      return False
+
+    self.mask_tests += 1
+    offset = ((enemy_x - enemy_mask.get_size()[0] // 2) - (player_x - player_mask.get_size()[0] // 2),
+      (enemy_y - enemy_mask.get_size()[1] // 2) - (player_y - player_mask.get_size()[1] // 2))
+    return player_mask.overlap(enemy_mask,offset) != None
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    ## None until the loading is tried, then whether it has succeeded
+    self.loaded = None
+    ## player masks (CharacterImageContainer of the load results)
+    self.player = None
+    ## ground enemy masks (standing, moving right, moving left)
+    self.enemy_ground = []
+    ## flying enemy masks by the animation frame
+    self.enemy_flying = []
+    ## number of the collision tests
+    self.tests = 0
+    ## number of the tests that have got past the bounding boxes
+    self.mask_tests = 0
+
+## masks for the precise collisions of the players with the enemies
+collision_masks = CollisionMasks()
+
+#-----------------------------------------------------------------------
+
+class SoundPlayer:
+
+  ## Initialises the mixer and loads the sounds, it can be called from
+  #  a background thread. Until the sounds are loaded, nothing is played.
+
+  def load(self):
+    with self.lock:
+      if self.loaded or not self.allowed:
+        return
+
+      pygame.mixer.init()
+
+      if not pygame.mixer.get_init:
+        return
+
+      self.sound_quack = resource_loader.load_sound("quack.wav")
+      self.sound_trampoline = resource_loader.load_sound("trampoline.wav")
+      self.sound_coin = resource_loader.load_sound("coin.wav")
+      self.sound_click = resource_loader.load_sound("click.wav")
+      self.sound_flap = resource_loader.load_sound("flapping.wav")
+      self.sound_win = resource_loader.load_sound("win.wav")
+      self.loaded = True
+
+      pygame.mixer.music.load(resource_loader.open("blue_dot_session.wav"))
+      pygame.mixer.music.set_volume(0.5)
+      pygame.mixer.music.play()
+
+  def play_quack(self):
+    if self.loaded:
+      self.sound_quack.play()
+
+  def play_trampoline(self):
+    if self.loaded:
+      self.sound_trampoline.play()
+
+  def play_coin(self):
+    if self.loaded:
+      self.sound_coin.play()
+
+  def play_click(self):
+    if self.loaded:
+      self.sound_click.play()
+
+  def play_flap(self):
+    if self.loaded:
+      self.sound_flap.play()
+
+  def play_win(self):
+    if self.loaded:
+      self.sound_win.play()
+
+  ## Initialises the sound player, the sounds are loaded later by the
+  #  load method.
+  #
+  #  @param allow whether the sound is allowed or not (boolean)
+
+  def __init__(self, allow):
+    self.allowed = allow
+    ## whether the sounds have been loaded
+    self.loaded = False
+    self.lock = threading.Lock()
+
+#-----------------------------------------------------------------------
+
+## A part of the screen showing the surroundings of one player in the
+#  split-screen multiplayer. Each viewport has its own camera and render
+#  queue, the image caches of the renderer are shared by all of them.
+
+class Viewport:
+  def __init__(self, rect, player_index):
+    ## screen area of the viewport (pygame.Rect)
+    self.rect = rect
+    ## index of the followed player in Level.players
+    self.player_index = player_index
+    ## commands drawn into the viewport area, grouped like the ones of
+    #  the renderer's queue
+    self.render_queue = RenderQueue(True)
+    ## camera state in format (x, y, visible tile area), it is kept while
+    #  the player is dead
+    self.camera = (0,0,(0,0,0,0))
+
+#-----------------------------------------------------------------------
+
+class Renderer:
+  TILE_WIDTH = 200
+  TILE_HEIGHT = 200
+  TOP_LAYER_OFFSET = 10
+  TOP_LAYER_LEFT_WIDTH = 23
+  CHUNK_TILES = 2      # chunk size in tiles
+  CHUNK_MARGIN = 24    # chunk image margin for the top layer overlapping the neighbour cells
+  BACKGROUND_TRANSPARENT_COLOR = (255,0,255)   # color of the transparent pixels of the background layers
+  CAMERA_OFFSET_Y = 8  # vertical offset of the camera center from the followed player in pixels
+  VIEWPORT_GAP = 4     # space between the split-screen viewports in pixels
+
+  def __init_attributes(self):
+    ## normal sized font
+    self.font_normal = resource_loader.load_font("Folktale.ttf",28)
+    ## the text color
+    self.font_color = (100,50,0)
+    ## recently rendered texts
+    self.text_cache = TextCache()
+    ## reference to a level being rendered
+    self._level = None
+    ## screen width in pixel
+    self.screen_width = 640
+    ## screen height in pixel
+    self.screen_height = 480
+    ## size of the viewport being drawn (the whole screen without the
+    #  split-screen) in pixels
+    self._view_width = 640
+    self._view_height = 480
+    ## split-screen viewports, empty if the whole screen shows the level
+    self.viewports = []
+    ## whether the viewport queues have commands for the next frame
+    self.viewports_queued = False
+    ## chunks wanted by the viewports drawn in this frame
+    self.wanted_chunks = []
+    ## (x,y) chunk positions of the centers of the viewports drawn in
+    #  this frame
+    self.chunk_centers = []
+    ## number of the chunks drawn as placeholders in this frame
+    self.placeholder_count = 0
+    ## camera top left corner x offset from the origin in pixels
+    self._camera_x = 0
+    ## camera top left corner y offset from the origin in pixels
+    self._camera_y = 0
+    ## contains images of tiles indexed by tile id, each item is a list
+    #  where each item contains an image of one tile variant starting
+    #  from 1, index 0 contains a TileTopImageContainer
+    self.tile_images = {}
+    ## placeholder images of the tiles that haven't been rasterized yet
+    #  indexed by tile id
+    self.tile_placeholder_images = {}
+    ## collects the draw commands of a frame
+    self.render_queue = RenderQueue(True)
+    ## rasterizes the static world (the tiles) in chunks
+    self.chunks = ChunkRasterizer(self.rasterize_chunk)
+    ## whether the missing chunks are rasterized right away instead of
+    #  drawn as placeholders (for the offscreen rendering)
+    self.synchronous_chunks = False
+    ## background layers in format (strip image, parallax factor, y
+    #  position), the strip is the layer image repeated to the screen
+    #  width and clipped to the screen height
+    self.background_strips = []
+    ## background layers of the level in background_strips
+    self.loaded_background_layers = None
+    ## tile types whose images are in tile_images, the items are the
+    #  tuples from Level.tiles indexed by tile id
+    self.loaded_tiles = {}
+    ## contains prerendered image of high score text
+    self.scores_image = None
+    ## the scores rendered in scores_image
+    self.scores_image_content = None
+    arrow_mask = resource_loader.load_image("arrow_mask.bmp")
+    self.arrow_image = prepare_image(resource_loader.load_image("arrow.bmp"),transparency_mask = arrow_mask)
+    self.logo_image = prepare_image(resource_loader.load_image("logo.bmp"))
+    ## contains flying enemy images
+    self.enemy_flying_images = []
+    ## contains ground enemy images
+    self.enemy_ground_images = []
+    ## contains teleport images
+    self.teleport_inactive_image = None
+    self.teleport_active_image = None
+    ## contains coin animation images
+    self.coin_images = []
+    self.score_bar_image = None
+    ## contains egg image
+    self.egg_image = None
+    ## contains the spikes image
+    self.spikes_image = None
+    ## contains the trampoline image
+    self.trampoline_image = None
+    ## contains images of the player (the duck)
+    self.player_images = CharacterImageContainer()
+    ## prerendered particle sprite frames indexed by sprite * FRAMES +
+    #  frame (see ParticleSystem)
+    self.particle_images = []
+    ## distances of the particle image centers from their corners
+    self.particle_offsets = None
+    ## small sized font
+    self.font_small = None
+    ## whether the assets loaded by load_game_assets are loaded
+    self.game_assets_loaded = False
+    self.assets_lock = threading.Lock()
+    ## Says which part of the map array is visible in format
+    #  (x1,y1,x2,y2)
+    self.visible_tile_area = (0,0,0,0)
+
+  ## Loads the assets that are not needed by the main menu. It can be
+  #  called from a background thread, calling it again waits for the
+  #  loading to finish and does nothing more.
+
+  def load_game_assets(self):
+    with self.assets_lock:
+      if self.game_assets_loaded:
+        return
+
+      self.__load_game_assets()
+      self.game_assets_loaded = True
+
+    self.__load_font_small()
+
+  ## Private method, loads the small font if it isn't loaded yet, it is
+  #  loaded separately as the menu texts and the statistics need it.
+
+  def __load_font_small(self):
+    with self.assets_lock:
+      if self.font_small == None:
+        self.font_small = resource_loader.load_font("larabiefont.ttf",20)
+
+  def __load_game_assets(self):
+    enemy_flying_mask = resource_loader.load_image("robot_flying_1_mask.bmp")
+    self.enemy_flying_images.append(prepare_image(resource_loader.load_image("robot_flying_1.bmp"),transparency_mask = enemy_flying_mask))
+    enemy_flying_mask = resource_loader.load_image("robot_flying_2_mask.bmp")
+    self.enemy_flying_images.append(prepare_image(resource_loader.load_image("robot_flying_2.bmp"),transparency_mask = enemy_flying_mask))
+    enemy_flying_mask = resource_loader.load_image("robot_flying_3_mask.bmp")
+    self.enemy_flying_images.append(prepare_image(resource_loader.load_image("robot_flying_3.bmp"),transparency_mask = enemy_flying_mask))
+    enemy_ground_mask = resource_loader.load_image("robot_ground_stand_mask.bmp")
+    self.enemy_ground_images.append(prepare_image(resource_loader.load_image("robot_ground_stand.bmp"),transparency_mask = enemy_ground_mask))
+    enemy_ground_mask = resource_loader.load_image("robot_ground_right_mask.bmp")
+    self.enemy_ground_images.append(prepare_image(resource_loader.load_image("robot_ground_right.bmp"),transparency_mask = enemy_ground_mask))
+    enemy_ground_mask = resource_loader.load_image("robot_ground_left_mask.bmp")
+    self.enemy_ground_images.append(prepare_image(resource_loader.load_image("robot_ground_left.bmp"),transparency_mask = enemy_ground_mask))
+    teleport_mask = resource_loader.load_image("teleport_mask.bmp")
+    self.teleport_inactive_image = prepare_image(resource_loader.load_image("teleport_1.bmp"),transparency_mask = teleport_mask)
+    self.teleport_active_image = prepare_image(resource_loader.load_image("teleport_2.bmp"),transparency_mask = teleport_mask)
+
+    score_bar_mask = resource_loader.load_image("score_bar_mask.bmp")
+    self.score_bar_image = prepare_image(resource_loader.load_image("score_bar.bmp"),transparency_mask = score_bar_mask)
+
+    for i in range(1,7):
+      coin_mask = resource_loader.load_image("coin_" + str(i) + "_mask.bmp")
+      self.coin_images.append(prepare_image(resource_loader.load_image("coin_" + str(i) + ".bmp"),transparency_mask = coin_mask))
+
+    egg_mask = resource_loader.load_image("egg_mask.bmp")
+    self.egg_image = prepare_image(resource_loader.load_image("egg.bmp"),transparency_mask = egg_mask)
+
+    spikes_mask = resource_loader.load_image("spikes_mask.bmp")
+    self.spikes_image = prepare_image(resource_loader.load_image("spikes.bmp"),transparency_mask = spikes_mask)
+    self.trampoline_image = prepare_image(resource_loader.load_image("trampoline.bmp"))
+
+    self.player_images.standing.append(prepare_image(resource_loader.load_image("duck_right_stand.bmp"),transparency_mask = resource_loader.load_image("duck_right_stand_mask.bmp")))
+    self.player_images.standing.append(pygame.transform.flip(self.player_images.standing[0],True,False))
+
+    for i in range(1,7):
+      self.player_images.moving_right.append(prepare_image(resource_loader.load_image("duck_right_walk_" + str(i) + ".bmp"),transparency_mask = resource_loader.load_image("duck_right_walk_" + str(i) + "_mask.bmp")))
+      self.player_images.moving_left.append(pygame.transform.flip(self.player_images.moving_right[-1],True,False))
+
+    self.player_images.jumping.append(prepare_image(resource_loader.load_image("duck_right_jump_up_1.bmp"),transparency_mask = resource_loader.load_image("duck_right_jump_up_1_mask.bmp")))
+    self.player_images.jumping.append(prepare_image(resource_loader.load_image("duck_right_jump_up_2.bmp"),transparency_mask = resource_loader.load_image("duck_right_jump_up_2_mask.bmp")))
+    self.player_images.jumping.append(prepare_image(resource_loader.load_image("duck_right_jump_down_1.bmp"),transparency_mask = resource_loader.load_image("duck_right_jump_down_1_mask.bmp")))
+    self.player_images.jumping.append(prepare_image(resource_loader.load_image("duck_right_jump_down_2.bmp"),transparency_mask = resource_loader.load_image("duck_right_jump_down_2_mask.bmp")))
+    self.player_images.jumping.append(pygame.transform.flip(self.player_images.jumping[0],True,False))
+    self.player_images.jumping.append(pygame.transform.flip(self.player_images.jumping[1],True,False))
+    self.player_images.jumping.append(pygame.transform.flip(self.player_images.jumping[2],True,False))
+    self.player_images.jumping.append(pygame.transform.flip(self.player_images.jumping[3],True,False))
+
+    self.player_images.special.append(prepare_image(resource_loader.load_image("duck_right_quack.bmp"),transparency_mask = resource_loader.load_image("duck_right_quack_mask.bmp")))
+    self.player_images.special.append(pygame.transform.flip(self.player_images.special[0],True,False))
+
+    self.__make_particle_images()
+
+  ## Private method, prerenders the frames of the particle sprites (see
+  #  ParticleSystem.SPRITES).
+
+  def __make_particle_images(self):
+    offsets = []
+
+    for sprite in ParticleSystem.SPRITES:
+      for frame in range(ParticleSystem.FRAMES):
+        progress = frame / float(ParticleSystem.FRAMES)
+        radius = max(1,int(round(sprite[1] + (sprite[2] - sprite[1]) * progress)))
+        image = pygame.Surface((2 * radius + 1,2 * radius + 1),pygame.SRCALPHA)
+        pygame.draw.circle(image,sprite[0] + (int(sprite[3] * (1.0 - progress)),),(radius,radius),radius,sprite[4])
+        self.particle_images.append(convert_alpha(image))
+        offsets.append(radius)
+
+    if numpy != None:
+      self.particle_offsets = numpy.array(offsets,numpy.float32)
+
+  ## Converts number of milliseconds to a string in format:
+  #  ss:m.
+  #
+  #  @param value number of milliseconds
+  #  @return string in format described above
+
+  def __milliseconds_to_time(self, value):
+    seconds = int(value / 1000)
+    tenths = int((value % 1000) / 100)
+
+    return str(seconds) + ":" + str(tenths)
+
+  ## Sets the level to be rendered.
+  #
+  #  @param level Level object
+
+  def set_level(self, level):
+    self.load_game_assets()
+    map_changed = self._level == None or level.template == None or self._level.template is not level.template
+    self._level = level
+    self.__load_background()
+    self.__load_tiles()
+    self.__make_scores_image()
+
+    if map_changed:           # a restarted level keeps the chunks, its map is the same
+      self.chunks.clear()     # after the level is set, so the chunks being rasterized from the old one are dropped
+
+  ## Updates the renderer after the level has been changed while
+  #  running (see Level.reload_from_file), only the caches affected by
+  #  the change are reloaded.
+  #
+  #  @param changed_cells list of (x,y) changed map cells
+  #  @param tiles_changed whether the tile types have changed
+  #  @param background_changed whether the background has changed
+
+  def update_level(self, changed_cells, tiles_changed, background_changed):
+    if background_changed:
+      self.__load_background()
+
+    if tiles_changed:
+      self.__load_tiles()
+      self.chunks.clear()
+      return
+
+    # a cell change affects the top layer of the tiles next to it and below it
+    keys = set()
+
+    for cell in changed_cells:
+      for x in range(cell[0] - 1,cell[0] + 2):
+        for y in range(cell[1],cell[1] + 2):
+          keys.add(self.__get_chunk_key(x,y))
+
+    self.chunks.invalidate(keys)
+
+  def __load_background(self):
+    if self.loaded_background_layers == self._level.background_layers:
+      return
+
+    self.background_strips = []
+
+    for layer in self._level.background_layers:
+      image = prepare_image(resource_loader.load_image("background_" + layer[0] + ".bmp"))
+
+      # only the rows visible on the screen are kept
+      top = max(0,-layer[2])
+      height = min(image.get_height() - top,self.screen_height - max(0,layer[2]))
+
+      if height <= 0:
+        continue
+
+      # the strip width is a multiple of the image width so that the
+      # strip wraps around seamlessly
+      repeat_times = int(math.ceil(self.screen_width / float(image.get_width())))
+      strip = pygame.Surface((repeat_times * image.get_width(),height),0,image)
+      transparent = pygame.mask.from_threshold(image,Renderer.BACKGROUND_TRANSPARENT_COLOR,(1,1,1,255)).count() > 0
+
+      if transparent:
+        strip.fill(Renderer.BACKGROUND_TRANSPARENT_COLOR)
+
+      for i in range(repeat_times):
+        strip.blit(image,(i * image.get_width(),0),pygame.Rect(0,top,image.get_width(),height))
+
+      if transparent:
+        strip.set_colorkey(Renderer.BACKGROUND_TRANSPARENT_COLOR,pygame.RLEACCEL)
+
+      self.background_strips.append((strip,layer[1],max(0,layer[2])))
+
+    self.loaded_background_layers = self._level.background_layers
+
+  ## Private method, loads the tile images of the level, the tile types
+  #  that are already loaded are kept.
+
+  def __load_tiles(self):
+    for tile in self._level.tiles:
+      if self.loaded_tiles.get(tile[0]) == tile:
+        continue
+
+      self.tile_images[tile[0]] = []
+
+      # tile top:
+      top_mask = resource_loader.load_image(("tile_" + tile[1] + "_top_mask.bmp"))
+      top_image = prepare_image(resource_loader.load_image(("tile_" + tile[1] + "_top.bmp")),transparency_mask = top_mask)
+
+      self.tile_images[tile[0]].append(TileTopImageContainer())
+
+      self.tile_images[tile[0]][0].image = top_image
+      self.tile_images[tile[0]][0].left = top_image.subsurface(pygame.Rect(0,0,23,56)) # left
+      self.tile_images[tile[0]][0].center = top_image.subsurface(pygame.Rect(24,0,201,56)) # center
+      self.tile_images[tile[0]][0].right = top_image.subsurface(pygame.Rect(225,0,21,56)) # right
+
+      # tile variants:
+      for variant_number in range(tile[2]):
+        self.tile_images[tile[0]].append(prepare_image(resource_loader.load_image("tile_" + tile[1] + "_" + str(variant_number + 1) + ".bmp")))
+
+      self.tile_placeholder_images[tile[0]] = pygame.Surface((Renderer.TILE_WIDTH,Renderer.TILE_HEIGHT))
+      self.tile_placeholder_images[tile[0]].fill(pygame.transform.average_color(self.tile_images[tile[0]][1]))
+      self.loaded_tiles[tile[0]] = tile
+
+  def __make_scores_image(self):
+    if self.scores_image != None and self.scores_image_content == self._level.scores[:3]:
+      return
+
+    self.scores_image_content = self._level.scores[:3]
+    self.scores_image = prepare_image(pygame.Surface((250,200)),pygame.Color(0,0,0))
+    text_image = self.font_normal.render("top scores:",1,self.font_color)
+    self.scores_image.blit(text_image,(0,0))
+
+    for i in range(min(3,len(self._level.scores))):
+      text_image = self.font_small.render(text_to_fixed_width(self._level.scores[i][0],10) + " " + text_to_fixed_width(str(self._level.scores[i][1]),6) + " " + text_to_fixed_width(self.__milliseconds_to_time(self._level.scores[i][2]),6),1,self.font_color)
+      self.scores_image.blit(text_image,(0,30 + (i + 1) * 20))
+
+  ## Private method, checks if the tile at given position in the level
+  #  has a top layer (i.e. there is no other tile above it) and what
+  #  type.
+  #
+  #  @param x x position of the tile
+  #  @param y y position of the tile
+  #  @return a tree item tuple with boolean values (left, center, right)
+
+  def __get_top_layer(self, x, y):
+    center = not MapGridObject.is_tile(self._level.get_at(x, y - 1))
+    left = not MapGridObject.is_tile(self._level.get_at(x, y - 1)) and not MapGridObject.is_tile(self._level.get_at(x - 1, y)) and not MapGridObject.is_tile(self._level.get_at(x - 1, y - 1))
+    right = not MapGridObject.is_tile(self._level.get_at(x, y - 1)) and not MapGridObject.is_tile(self._level.get_at(x + 1, y)) and not MapGridObject.is_tile(self._level.get_at(x + 1, y - 1))
+
+    return (left,center,right)
+
+  ## Private method, gets the key of the chunk containing given map
+  #  cell.
+  #
+  #  @return (x,y) chunk key
+
+  def __get_chunk_key(self, x, y):
+    return (x // Renderer.CHUNK_TILES,y // Renderer.CHUNK_TILES)
+
+  ## Rasterizes the tiles of a chunk including their top layer, called
+  #  from the ChunkRasterizer worker threads.
+  #
+  #  @param key (x,y) chunk key
+  #  @return chunk image with CHUNK_MARGIN pixels of transparent margin
+  #          on each side (pygame.Surface) or None if the chunk has no
+  #          tiles
+
+  def rasterize_chunk(self, key):
+    result = None
+    margin = Renderer.CHUNK_MARGIN
+
+    for j in range(key[1] * Renderer.CHUNK_TILES,(key[1] + 1) * Renderer.CHUNK_TILES):
+      for i in range(key[0] * Renderer.CHUNK_TILES,(key[0] + 1) * Renderer.CHUNK_TILES):
+        map_grid_object = self._level.get_at(i,j)
+
+        if map_grid_object == None or map_grid_object.object_type != MapGridObject.OBJECT_TILE:
+          continue
+
+        if result == None:
+          result = pygame.Surface((Renderer.CHUNK_TILES * Renderer.TILE_WIDTH + 2 * margin,Renderer.CHUNK_TILES * Renderer.TILE_HEIGHT + 2 * margin),pygame.SRCALPHA)
+
+        x = (i - key[0] * Renderer.CHUNK_TILES) * Renderer.TILE_WIDTH + margin
+        y = (j - key[1] * Renderer.CHUNK_TILES) * Renderer.TILE_HEIGHT + margin
+        images = self.tile_images[map_grid_object.tile_id]
+        result.blit(images[map_grid_object.tile_variant],(x,y))
+
+        top_layer = self.__get_top_layer(i,j)
+
+        if top_layer[0]:   # left
+          result.blit(images[0].left,(x - Renderer.TOP_LAYER_LEFT_WIDTH,y - Renderer.TOP_LAYER_OFFSET))
+
+        if top_layer[1]:   # center
+          result.blit(images[0].center,(x,y - Renderer.TOP_LAYER_OFFSET))
+
+        if top_layer[2]:   # right
+          result.blit(images[0].right,(x + Renderer.TILE_WIDTH,y - Renderer.TOP_LAYER_OFFSET))
+
+    return result
+
+  ## Private method, draws the static world chunks visible by the
+  #  camera, the chunks that aren't rasterized yet are requested and
+  #  their tiles are drawn as flat placeholders.
+  #
+  #  @param queue render queue to draw to (RenderQueue)
+
+  def __draw_chunks(self, queue):
+    chunk_width = Renderer.CHUNK_TILES * Renderer.TILE_WIDTH
+    chunk_height = Renderer.CHUNK_TILES * Renderer.TILE_HEIGHT
+    margin = Renderer.CHUNK_MARGIN
+    x1 = int(math.floor((self._camera_x - margin) / chunk_width))
+    y1 = int(math.floor((self._camera_y - margin) / chunk_height))
+    x2 = int(math.floor((self._camera_x + self._view_width + margin) / chunk_width))
+    y2 = int(math.floor((self._camera_y + self._view_height + margin) / chunk_height))
+    missing = []
+
+    for chunk_y in range(y1,y2 + 1):
+      for chunk_x in range(x1,x2 + 1):
+        chunk = self.chunks.get((chunk_x,chunk_y),False)
+
+        if chunk == False and self.synchronous_chunks:
+          chunk = self.rasterize_chunk((chunk_x,chunk_y))
+          self.chunks.put((chunk_x,chunk_y),chunk)
+
+        if chunk == False:
+          missing.append((chunk_x,chunk_y))
+          self.__draw_placeholder(queue,chunk_x,chunk_y)
+        elif chunk != None:
+          queue.add(RenderQueue.LAYER_WORLD,chunk,(chunk_x * chunk_width - margin - self._camera_x,chunk_y * chunk_height - margin - self._camera_y))
+
+    # the chunks around the visible ones are prepared in advance, they're
+    # requested once for all the viewports
+    self.wanted_chunks += missing + [(chunk_x,chunk_y) for chunk_y in range(y1 - 1,y2 + 2) for chunk_x in range(x1 - 1,x2 + 2)
+      if chunk_x < x1 or chunk_x > x2 or chunk_y < y1 or chunk_y > y2]
+
+    self.chunk_centers.append(((x1 + x2) / 2.0,(y1 + y2) / 2.0))
+    self.placeholder_count += len(missing)
+
+  def __draw_placeholder(self, queue, chunk_x, chunk_y):
+    for j in range(chunk_y * Renderer.CHUNK_TILES,(chunk_y + 1) * Renderer.CHUNK_TILES):
+      for i in range(chunk_x * Renderer.CHUNK_TILES,(chunk_x + 1) * Renderer.CHUNK_TILES):
+        map_grid_object = self._level.get_at(i,j)
+
+        if map_grid_object != None and map_grid_object.object_type == MapGridObject.OBJECT_TILE:
+          queue.add(RenderQueue.LAYER_WORLD,self.tile_placeholder_images[map_grid_object.tile_id],(i * Renderer.TILE_WIDTH - self._camera_x,j * Renderer.TILE_HEIGHT - self._camera_y))
+
+  ## Private method, draws a player.
+  #
+  #  @param queue render queue to draw to (RenderQueue)
+  #  @param player the Player
+  #  @param animation_frame number of the current animation frame
+
+  def __draw_player(self, queue, player, animation_frame):
+    player_position = self.__map_position_to_screen_position(player.position_x,player.position_y)
+
+    player_image = player.get_image(self.player_images,animation_frame)
+    queue.add(RenderQueue.LAYER_PLAYER,player_image,(player_position[0] - player_image.get_width() / 2,player_position[1] - player_image.get_height() / 2))
+
+  ## Private method, draws the live particles of the level.
+  #
+  #  @param queue render queue to draw to (RenderQueue)
+
+  def __draw_particles(self, queue):
+    particles = self._level.particles
+
+    if particles.get_count() == 0:
+      return
+
+    x, y, indices = particles.get_draw_data()
+    offsets = self.particle_offsets[indices]
+    x = x * Renderer.TILE_WIDTH - (offsets + self._camera_x)
+    y = y * Renderer.TILE_HEIGHT - (offsets + self._camera_y)
+    visible = numpy.flatnonzero((x > -2 * offsets) & (x < self._view_width) & (y > -2 * offsets) & (y < self._view_height))
+    images = self.particle_images
+    queue.extend(RenderQueue.LAYER_PARTICLES,[(images[index],(position_x,position_y),None,0) for position_x, position_y, index in
+      zip(x[visible].tolist(),y[visible].tolist(),indices[visible].tolist())])
+
+  ## Private method, computes the screen pixel coordinates out of given
+  #  map square coordinates (float) taking camera position into account.
+  #
+  #  @param x x map position in tiles (double)
+  #  @param y y map position in tiles (double)
+  #  @return (x,y) tuple of pixel screen coordinates
+
+  def __map_position_to_screen_position(self, x, y):
+    return (x * Renderer.TILE_WIDTH - self._camera_x,y * Renderer.TILE_HEIGHT - self._camera_y)
+
+  ## Renders given menu, the frame is shown by present.
+  #
+  #  @param menu menu screen to be rendered (Menu)
+
+  def render_menu(self, menu):
+    self.clear_color = (255,255,255)
+    queue = self.render_queue
+
+    queue.add(RenderQueue.LAYER_BACKGROUND,self.logo_image,(self.screen_width / 2 - self.logo_image.get_width() / 2,self.screen_height / 2 - self.logo_image.get_height() / 2))
+
+    first, end = menu.get_shown_range()
+    i = first
+
+    while i < end:
+      text_image = self.text_cache.render(self.font_normal,menu.items[i],(0,0,0))
+      queue.add(RenderQueue.LAYER_GUI,text_image,(100,100 + (i - first) * 40))
+
+      if i == menu.selected_item:
+        queue.add(RenderQueue.LAYER_GUI,self.arrow_image,(50,95 + (i - first) * 40))
+
+      i += 1
+
+    if first > 0:
+      queue.add(RenderQueue.LAYER_GUI,self.text_cache.render(self.font_normal,"...",(0,0,0)),(100,60))
+
+    if end < len(menu.items):
+      queue.add(RenderQueue.LAYER_GUI,self.text_cache.render(self.font_normal,"...",(0,0,0)),(100,100 + (end - first) * 40))
+
+    image_x = self.screen_width - ThumbnailCache.MAX_SIZE[0] - 60
+    text_y = 100
+
+    if menu.image != None:
+      queue.add(RenderQueue.LAYER_GUI,menu.image,(image_x,100))
+      text_y += menu.image.get_height() + 10
+
+    if len(menu.image_lines) > 0:
+      self.__load_font_small()
+
+    for line in menu.image_lines:
+      queue.add(RenderQueue.LAYER_GUI,self.text_cache.render(self.font_small,line,(0,0,0)),(image_x,text_y))
+      text_y += 30
+
+    i = 0
+
+    if len(menu.text_lines) > 0:
+      self.__load_font_small()
+
+    while i < len(menu.text_lines):
+      text_image = self.text_cache.render(self.font_small,menu.text_lines[i],(0,0,0))
+      queue.add(RenderQueue.LAYER_GUI,text_image,(100,self.screen_height / 2 + i * 30))
+      i += 1
+
+  ## Renders the level, the frame is shown by present.
+
+  def render_level(self):
+    self.clear_color = self._level.background_color
+    self.wanted_chunks = []
+    self.chunk_centers = []
+    self.placeholder_count = 0
+
+    if len(self.viewports) == 0:
+      self.__render_world(self.render_queue)
+    else:
+      for viewport in self.viewports:
+        self._view_width = viewport.rect.width
+        self._view_height = viewport.rect.height
+        player = self._level.players[viewport.player_index % len(self._level.players)]
+
+        if not player.dead:
+          self.set_camera_to_player(player)
+          viewport.camera = (self._camera_x,self._camera_y,self.visible_tile_area)
+        else:
+          self._camera_x, self._camera_y, self.visible_tile_area = viewport.camera
+
+        self.__render_world(viewport.render_queue)
+
+      self._view_width = self.screen_width
+      self._view_height = self.screen_height
+      self.viewports_queued = True
+
+    self.chunks.request(self.wanted_chunks,self.chunk_centers)
+    counts = self.chunks.get_counts()
+    stats.set_value("chunks ready/queued/placeholders",str(counts[0]) + "/" + str(counts[1]) + "/" + str(self.placeholder_count))
+
+    self.__render_gui(self.render_queue)
+
+  ## Private method, renders the level seen by the current camera, i.e.
+  #  everything except the GUI.
+  #
+  #  @param queue render queue to draw to (RenderQueue)
+
+  def __render_world(self, queue):
+    animation_frame = self._level.get_animation_frame()
+
+    # draw the background image:
+
+    for strip in self.background_strips:
+      width = strip[0].get_width()
+      offset = int(self._camera_x * strip[1]) % width
+      queue.add(RenderQueue.LAYER_BACKGROUND,strip[0],(0,strip[2]),pygame.Rect(offset,0,min(width - offset,self._view_width),strip[0].get_height()))
+
+      if width - offset < self._view_width:    # wrap around
+        queue.add(RenderQueue.LAYER_BACKGROUND,strip[0],(width - offset,strip[2]),pygame.Rect(0,0,self._view_width - width + offset,strip[0].get_height()))
+
+    # draw the tiles:
+    self.__draw_chunks(queue)
+
+    # draw the map objects:
+    for j in range(self.visible_tile_area[1],self.visible_tile_area[3]):  # render only visible area
+      for i in range(self.visible_tile_area[0],self.visible_tile_area[2]):
+        map_grid_object = self._level.get_at(i,j)
+
+        if map_grid_object == None or map_grid_object.object_type == MapGridObject.OBJECT_TILE:
+          continue
+        else:
+          x = i * Renderer.TILE_WIDTH - self._camera_x
+          y = j * Renderer.TILE_HEIGHT - self._camera_y
+
+          if map_grid_object.object_type == MapGridObject.OBJECT_SPIKES:
+            queue.add(RenderQueue.LAYER_OBJECTS,self.spikes_image,(x,y))
+          elif map_grid_object.object_type == MapGridObject.OBJECT_EGG:
+            queue.add(RenderQueue.LAYER_OBJECTS,self.egg_image,(x + 50,y + 50))
+          elif map_grid_object.object_type == MapGridObject.OBJECT_COIN:
+            queue.add(RenderQueue.LAYER_OBJECTS,self.coin_images[animation_frame % len(self.coin_images)],(x + 20,y))
+          elif map_grid_object.object_type == MapGridObject.OBJECT_TRAMPOLINE:
+            queue.add(RenderQueue.LAYER_OBJECTS,self.trampoline_image,(x,y))
+          elif map_grid_object.object_type == MapGridObject.OBJECT_FINISH:
+            if self._level.eggs_left > 0:
+              queue.add(RenderQueue.LAYER_OBJECTS,self.teleport_inactive_image,(x,y))
+            else:
+              queue.add(RenderQueue.LAYER_OBJECTS,self.teleport_active_image,(x,y))
+
+    # draw the players:
+
+    for player in self._level.players:
+      self.__draw_player(queue,player,animation_frame)
+
+    # draw the enemies (only the ones on the screen):
+
+    area = self.visible_tile_area
+
+    for enemy in self._level.activity.get_enemies_in_area(area[0] - 1,area[1] - 1,area[2] + 1,area[3] + 1):
+      enemy_position = self.__map_position_to_screen_position(enemy.position_x,enemy.position_y)
+
+      if (enemy_position[0] < -Renderer.TILE_WIDTH or enemy_position[0] > self._view_width + Renderer.TILE_WIDTH or
+        enemy_position[1] < -Renderer.TILE_HEIGHT or enemy_position[1] > self._view_height + Renderer.TILE_HEIGHT):
+        continue
+
+      enemy_image = enemy.get_image(self.enemy_ground_images,self.enemy_flying_images,animation_frame)
+      queue.add(RenderQueue.LAYER_ENEMIES,enemy_image,(enemy_position[0] - enemy_image.get_width() / 2,enemy_position[1] - enemy_image.get_height() / 2))
+
+    self.__draw_particles(queue)
+
+  ## Private method, renders the level GUI (time, score, messages) over
+  #  the whole screen.
+  #
+  #  @param queue render queue to draw to (RenderQueue)
+
+  def __render_gui(self, queue):
+    line_height = 30
+
+   # result.blit(self.score_bar_image,(22,20))
+    text_image = self.text_cache.render(self.font_normal,"time: " + self.__milliseconds_to_time(self._level.time),self.font_color)
+    queue.add(RenderQueue.LAYER_GUI,text_image,(50,50))
+    text_image = self.text_cache.render(self.font_normal,"score: " + str(self._level.score),self.font_color)
+    queue.add(RenderQueue.LAYER_GUI,text_image,(50,50 + line_height))
+    queue.add(RenderQueue.LAYER_GUI,self.scores_image,(self.screen_width - 300,50))
+
+    if self._level.state == Level.STATE_LOST:
+      text_image = self.text_cache.render(self.font_normal,"you lost",(255,0,0))
+      queue.add(RenderQueue.LAYER_GUI,text_image,(self.screen_width / 2 - text_image.get_width() / 2,self.screen_height / 2 - text_image.get_height() / 2))
+      text_image = self.text_cache.render(self.font_small,"press R to retry",self.font_color)
+      queue.add(RenderQueue.LAYER_GUI,text_image,(self.screen_width / 2 - text_image.get_width() / 2,self.screen_height / 2 + 30))
+    elif self._level.state == Level.STATE_WON:
+      text_image = self.text_cache.render(self.font_normal,"you won",(0,255,0))
+      queue.add(RenderQueue.LAYER_GUI,text_image,(self.screen_width / 2 - text_image.get_width() / 2,self.screen_height / 2 - text_image.get_height() / 2))
+
+  ## Gets the memory used by the images of the renderer.
+  #
+  #  @return list of (category, size in bytes)
+
+  def get_memory_usage(self):
+    size = MemoryAccounting.get_surfaces_size
+    sprites = size([self.particle_images,self.arrow_image,self.logo_image,self.enemy_flying_images,self.enemy_ground_images,self.teleport_inactive_image,
+      self.teleport_active_image,self.coin_images,self.score_bar_image,self.egg_image,self.spikes_image,self.trampoline_image])
+    player_frames = size([self.player_images.standing,self.player_images.moving_right,self.player_images.moving_left,
+      self.player_images.jumping,self.player_images.special])
+    tiles = size(self.tile_placeholder_images)
+
+    for images in self.tile_images.values():
+      tiles += size(images[0].image) + size(images[1:])
+
+    text_cache = size(list(self.text_cache.images.values())) + size(self.scores_image)
+    return ([("backgrounds",size([strip[0] for strip in self.background_strips])),("sprites",sprites),("player frames",player_frames),("tiles",tiles),
+      ("chunks",self.chunks.get_memory_usage()),("text cache",text_cache)] + self.backend.get_memory_usage())
+
+  ## Renders given statistics lines over the rendered frame.
+  #
+  #  @param lines list of strings to be rendered
+
+  def render_stats(self, lines):
+    self.__load_font_small()
+
+    for i in range(len(lines)):
+      text_image = self.text_cache.render(self.font_small,lines[i],(0,0,0))
+      self.render_queue.add(RenderQueue.LAYER_OVERLAY,text_image,(10,self.screen_height - (len(lines) - i) * 22 - 10))
+
+  ## Draws the rendered frame with the backend without showing it, the
+  #  frame can be then read with the backend's get_frame.
+
+  def draw(self):
+    time_start = get_precise_time()
+    self.backend.begin_frame(self.clear_color)
+    count = 0
+
+    if self.viewports_queued:
+      for viewport in self.viewports:
+        count += viewport.render_queue.submit(self.backend,viewport.rect)
+
+      self.viewports_queued = False
+
+    count += self.render_queue.submit(self.backend)
+    stats.add_sample("blit submit [ms]",get_precise_time() - time_start)
+    stats.add_sample("blits per frame",count,RenderQueue.BLIT_COUNT_BOUNDS)
+
+  ## Draws the rendered frame with the backend and shows it on the
+  #  screen.
+
+  def present(self):
+    self.draw()
+    self.backend.present()
+
+  ## Sets the camera center position.
+  #
+  #  @param camera_x x coordinate in pixels
+  #  @param camera_y y coordinate in pixels
+
+  def set_camera_position(self, camera_x, camera_y):
+    self._camera_x = camera_x - self._view_width / 2
+    self._camera_y = camera_y - self._view_height / 2
+
+    helper_x = int(self._camera_x / Renderer.TILE_WIDTH)
+    helper_y = int(self._camera_y / Renderer.TILE_HEIGHT)
+    width_tiles = int(math.ceil(self._view_width / Renderer.TILE_WIDTH)) + 2
+    height_tiles = int(math.ceil(self._view_height / Renderer.TILE_HEIGHT)) + 2
+
+    self.visible_tile_area = (helper_x,helper_y,helper_x + width_tiles,helper_y + height_tiles)
+
+  ## Sets the camera so that it follows a player of the level.
+  #
+  #  @param player the Player, None means the first player
+
+  def set_camera_to_player(self, player = None):
+    if player == None:
+      player = self._level.player
+
+    self.set_camera_position(int(player.position_x * Renderer.TILE_WIDTH),int(player.position_y * Renderer.TILE_HEIGHT) + Renderer.CAMERA_OFFSET_Y)
+
+  ## Stops the chunk rasterization workers, the renderer can't be used
+  #  after this.
+
+  def close(self):
+    self.chunks.close()
+
+  ## Splits the screen into viewports side by side, one for each player.
+  #
+  #  @param count number of the viewports, 1 shows the level on the
+  #         whole screen
+
+  def set_viewports(self, count):
+    self.viewports = []
+    self.chunks.max_chunks = ChunkRasterizer.MAX_CHUNKS * count
+
+    if count <= 1:
+      return
+
+    width = self.screen_width // count
+
+    for i in range(count):
+      viewport_width = width - Renderer.VIEWPORT_GAP if i < count - 1 else self.screen_width - i * width
+      self.viewports.append(Viewport(pygame.Rect(i * width,0,viewport_width,self.screen_height),i))
+
+  ## Initialises the renderer.
+  #
+  #  @param screen_width screen width in pixels
+  #  @param screen_height screen height in pixels
+  #  @param backend backend that does the drawing (SurfaceBackend or
+  #         TextureBackend)
+
+  def __init__(self, screen_width, screen_height, backend):
+    self.__init_attributes()
+    self.backend = backend
+    ## color the next frame is cleared with
+    self.clear_color = (255,255,255)
+    self.screen_width = screen_width
+    self.screen_height = screen_height
+    self._view_width = screen_width
+    self._view_height = screen_height
+    return
+
+#-----------------------------------------------------------------------
+
+## A decorator that moves given movable object acoording to forces it
+#  computes.
+
+class ForceComputer:
+  def __init_attributes(self):
+    ## reference to decorated object (Movable)
+    self.decorated_object = None
+
+    ## velocity in tiles per second
+    self.velocity_vector = [0,0]
+
+    ## acceleration in tiles per second squared
+    self.acceleration_vector = [0,0]
+
+    ## maximum speed that will be assigned int horizontal direction
+    self.maximum_horizontal_speed = 3
+
+
+    ## says how much of the horizontal speed will be converted to
+    #  acceleration in opposite direction
+    self.ground_friction = 5
+
+  ## Applies the forces to the decorated object and computes new forces.
+  #
+  #  @param step_time step length in milliseconds
+
+  def execute_step(self, step_time):
+    if step_time == 0:    # we don't want to be diving by zero
+      return
+
+    seconds = step_time / 1000.0
+
+    object_position = (self.decorated_object.position_x,self.decorated_object.position_y)
+    self.decorated_object.move_by(self.velocity_vector[0] * seconds,self.velocity_vector[1] * seconds)
+    object_position2 = (self.decorated_object.position_x,self.decorated_object.position_y)
+
+    # the list is updated in place, a new one would be allocated for every entity in every step
+    self.velocity_vector[0] = (object_position2[0] - object_position[0]) / seconds
+    self.velocity_vector[1] = (object_position2[1] - object_position[1]) / seconds
+
+    self.velocity_vector[0] += (self.acceleration_vector[0] - self.velocity_vector[0] * self.ground_friction) * seconds
+    self.velocity_vector[1] += self.acceleration_vector[1] * seconds
+
+  def __init__(self, decorated_object):
+    self.__init_attributes()
+    self.decorated_object = decorated_object
+
+#-----------------------------------------------------------------------
+
+## Represents a menu screen.
+
+class Menu:
+  def __init__(self):
+    ## list of menu items
+    self.items = []
+    ## index of the selected item
+    self.selected_item = 0
+    ## optional text to be displayed in the menu
+    self.text_lines = []
+    ## optional image shown next to the items (e.g. preview of the
+    #  selected level) or None
+    self.image = None
+    ## optional text shown under the image
+    self.image_lines = []
+    ## number of the items shown at once, 0 shows all of them
+    self.page_size = 0
+    ## index of the first shown item
+    self.first_item = 0
+
+  ## Scrolls the shown items so that the selected one is among them.
+
+  def __scroll(self):
+    if self.page_size <= 0:
+      return
+
+    if self.selected_item < self.first_item:
+      self.first_item = self.selected_item
+    elif self.selected_item >= self.first_item + self.page_size:
+      self.first_item = self.selected_item - self.page_size + 1
+
+    self.first_item = max(0,min(self.first_item,len(self.items) - self.page_size))
+
+  ## Gets the index range of the shown items.
+  #
+  #  @return tuple (first, one past last)
+
+  def get_shown_range(self):
+    if self.page_size <= 0:
+      return (0,len(self.items))
+
+    return (self.first_item,min(self.first_item + self.page_size,len(self.items)))
+
+  ## Selects an item.
+  #
+  #  @param index index of the item, it is clamped to the item range
+
+  def select(self, index):
+    self.selected_item = max(0,min(index,len(self.items) - 1))
+    self.__scroll()
+
+  def cursor_up(self):
+    self.select(self.selected_item - 1)
+
+  def cursor_down(self):
+    self.select(self.selected_item + 1)
+
+  def page_up(self):
+    self.select(self.selected_item - max(1,self.page_size))
+
+  def page_down(self):
+    self.select(self.selected_item + max(1,self.page_size))
+
+#-----------------------------------------------------------------------
+
+## Makes the level preview images for the level menu. The previews are
+#  rendered from the parsed maps on a worker thread and cached on disk
+#  by the level content hash, so the menu never waits for them: get
+#  returns None until a preview is ready.
+
+class ThumbnailCache:
+  DIRECTORY = "thumbnails"
+  VERSION = 1                  # increase when the look of the previews changes to drop the old files
+  TILE_SIZE = 16               # size of one map cell in the preview in pixels
+  MAX_SIZE = (400,400)         # bigger previews are scaled down to fit
+  OBJECT_COLORS = {
+    MapGridObject.OBJECT_FINISH: (0,0,255),
+    MapGridObject.OBJECT_COIN: (255,200,0),
+    MapGridObject.OBJECT_EGG: (255,255,255),
+    MapGridObject.OBJECT_SPIKES: (100,100,100),
+    MapGridObject.OBJECT_PLAYER: (255,130,0),
+    MapGridObject.OBJECT_ENEMY_FLYING: (200,0,0),
+    MapGridObject.OBJECT_ENEMY_GROUND: (200,0,0)
+    }
+  TRAMPOLINE_COLOR = (255,0,0)
+
+  ## Requests the previews of given level files, the previous requests
+  #  that haven't been processed yet are dropped. The files are checked
+  #  for changes, so requesting an already made preview is cheap.
+  #
+  #  @param filenames list of level file names, in the order of
+  #         priority
+
+  def request(self, filenames):
+    with self.condition:
+      self.queue = collections.deque(filenames)
+      self.condition.notify()
+
+  ## Gets the preview of a level file.
+  #
+  #  @param filename level file name
+  #  @return pygame.Surface or None if the preview isn't ready (or the
+  #          level couldn't be loaded)
+
+  def get(self, filename):
+    with self.condition:
+      item = self.thumbnails.get(filename)
+
+    return item[1] if item != None else None
+
+  ## Gets the size of the loaded previews.
+  #
+  #  @return size in bytes
+
+  def get_memory_usage(self):
+    with self.condition:
+      return MemoryAccounting.get_surfaces_size([item[1] for item in self.thumbnails.values() if item[1] != None])
+
+  ## Gets a tile image scaled to the preview size, the images are cached.
+
+  def __get_tile_image(self, name):
+    if name not in self.tile_images:
+      try:
+        image = resource_loader.load_image("tile_" + name + "_1.bmp")
+
+        if image.get_bitsize() < 24:
+          helper_image = pygame.Surface(image.get_size(),0,32)
+          helper_image.blit(image,(0,0))
+          image = helper_image
+
+        self.tile_images[name] = pygame.transform.smoothscale(image,(ThumbnailCache.TILE_SIZE,ThumbnailCache.TILE_SIZE))
+      except (pygame.error,IOError,OSError):
+        self.tile_images[name] = None
+
+    return self.tile_images[name]
+
+  ## Renders the preview of a level.
+  #
+  #  @param template LevelTemplate of the level
+  #  @return pygame.Surface
+
+  def render(self, template):
+    size = ThumbnailCache.TILE_SIZE
+    result = pygame.Surface((template.width * size,template.height * size),0,32)
+    result.fill(template.background_color)
+    tile_names = {tile[0]: tile[1] for tile in template.tiles}
+    markers = []
+
+    for i in range(len(template.columns)):
+      for j in range(len(template.columns[i])):
+        map_grid_object = template.columns[i][j]
+
+        if map_grid_object == None:
+          continue
+
+        if map_grid_object.object_type == MapGridObject.OBJECT_TILE:
+          image = self.__get_tile_image(tile_names.get(map_grid_object.tile_id,""))
+
+          if image != None:
+            result.blit(image,(i * size,j * size))
+          else:
+            result.fill((0,0,0),(i * size,j * size,size,size))
+        elif map_grid_object.object_type == MapGridObject.OBJECT_TRAMPOLINE:
+          result.fill(ThumbnailCache.TRAMPOLINE_COLOR,(i * size,j * size,size,size))
+        else:
+          markers.append((i,j,map_grid_object.object_type))
+
+    if template.player_position != None:
+      markers.append((template.player_position[0],template.player_position[1],MapGridObject.OBJECT_PLAYER))
+
+    for spawn in template.enemy_spawns:
+      markers.append((spawn[0],spawn[1],MapGridObject.OBJECT_ENEMY_FLYING))
+
+    for marker in markers:
+      color = ThumbnailCache.OBJECT_COLORS.get(marker[2])
+
+      if color != None:
+        pygame.draw.circle(result,color,(marker[0] * size + size // 2,marker[1] * size + size // 2),size // 3)
+
+    scale = min(1.0,ThumbnailCache.MAX_SIZE[0] / float(result.get_width()),ThumbnailCache.MAX_SIZE[1] / float(result.get_height()))
+
+    if scale < 1.0:
+      result = pygame.transform.smoothscale(result,(max(1,int(result.get_width() * scale)),max(1,int(result.get_height() * scale))))
+
+    return result
+
+  ## Makes the preview of one level file, from the disk cache if it is
+  #  there.
+
+  def __make(self, filename):
+    time_start = get_precise_time()
+    path = os.path.join(self.directory,Level.get_content_hash(filename) + "_" + str(ThumbnailCache.VERSION) + ".png")
+
+    if os.path.isfile(path):
+      try:
+        return pygame.image.load(path)
+      except pygame.error:    # corrupted file, make it again
+        pass
+
+    result = self.render(LevelTemplate(filename))   # not LevelTemplate.get, the previewed levels aren't kept in its cache
+
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+
+      pygame.image.save(result,path)
+    except (pygame.error,IOError,OSError):
+      pass                    # the preview just won't be cached
+
+    stats.add_sample("thumbnail render [ms]",get_precise_time() - time_start)
+    return result
+
+  def __work(self):
+    while True:
+      with self.condition:
+        while len(self.queue) == 0:
+          self.condition.wait()
+
+        filename = self.queue.popleft()
+        item = self.thumbnails.get(filename)
+
+      try:
+        file_stat = os.stat(filename)
+        signature = (file_stat.st_mtime_ns,file_stat.st_size)
+      except OSError:
+        continue
+
+      if item != None and item[0] == signature:
+        continue
+
+      try:
+        thumbnail = self.__make(filename)
+      except Exception:       # broken level file, not retried until it changes
+        thumbnail = None
+
+      with self.condition:
+        self.thumbnails[filename] = (signature,thumbnail)
+
+  ## Initialises the cache and starts the worker.
+  #
+  #  @param directory directory of the cached preview files
+
+  def __init__(self, directory = DIRECTORY):
+    self.directory = directory
+    self.condition = threading.Condition()
+    ## previews in format (file signature, pygame.Surface or None)
+    #  indexed by the level file name
+    self.thumbnails = {}
+    ## level file names waiting for the worker
+    self.queue = collections.deque()
+    ## tile images scaled to the preview size by tile name, only used by
+    #  the worker
+    self.tile_images = {}
+
+    worker = threading.Thread(target = self.__work)
+    worker.daemon = True
+    worker.start()
+
+#-----------------------------------------------------------------------
+
+## Index of the level files found in the level directories, with the
+#  metadata the level menu shows. The index is kept in a file, so the
+#  level list is available right away, and it is updated incrementally:
+#  the files whose modification time and size haven't changed aren't
+#  read at all, and the files whose content hash (see
+#  Level.get_content_hash) is already known only have their scores read,
+#  only new maps are parsed.
+
+class LevelCatalog:
+  INDEX_FILENAME = "level_index.json"
+  INDEX_VERSION = 1
+  EXTENSION = ".lvl"
+
+  ## Makes a sort key that orders the numbers in the file names by
+  #  value (level2 before level10).
+
+  @staticmethod
+  def get_sort_key(filename):
+    return [(0,int(part),"") if part.isdigit() else (1,0,part) for part in re.split(r"(\d+)",filename)]
+
+  ## Reads a level file without parsing the map.
+  #
+  #  @param filename level file name
+  #  @return tuple (content hash, best score as [name, score, time in ms]
+  #          or None)
+
+  @staticmethod
+  def read_file(filename):
+    best_score = None
+
+    with open(filename,"rb") as input_file:
+      content_hash = Level.read_content_hash(input_file)
+
+      for line in input_file:
+        split_line = line.decode("utf-8","replace").split()
+
+        if len(split_line) != 3:
+          break
+
+        if best_score == None or int(split_line[1]) > best_score[1]:
+          best_score = [split_line[0],int(split_line[1]),int(split_line[2])]
+
+    return (content_hash,best_score)
+
+  ## Makes the metadata of a level by parsing it.
+  #
+  #  @param filename level file name
+  #  @return dict with the metadata
+
+  @staticmethod
+  def parse_file(filename):
+    template = LevelTemplate(filename)
+
+    return {
+      "name": template.name,
+      "background": template.background_name,
+      "width": template.width,
+      "height": template.height,
+      "coins": template.coins,
+      "eggs": template.eggs
+      }
+
+  ## Scans the level directories and updates the index, the index file
+  #  is saved if anything has changed. It can be called from another
+  #  thread, get_entries then keeps returning the previous entries until
+  #  the update is done. Only one update runs at a time, the call does
+  #  nothing if another thread is already updating.
+  #
+  #  @return True if the entries have changed, False otherwise
+
+  def update(self):
+    if not self.update_lock.acquire(False):
+      return False
+
+    try:
+      return self.__update()
+    finally:
+      self.update_lock.release()
+
+  def __update(self):
+    time_start = get_precise_time()
+
+    with self.lock:
+      old_entries = self.entries
+
+    entries_by_hash = {entry["hash"]: entry for entry in old_entries.values()}
+    entries = {}
+    parsed = 0
+
+    for directory in self.directories:
+      try:
+        directory_entries = list(os.scandir(directory))
+      except OSError:
+        continue
+
+      for directory_entry in directory_entries:
+        if not directory_entry.name.endswith(LevelCatalog.EXTENSION):
+          continue
+
+        filename = os.path.join(directory,directory_entry.name)
+
+        try:
+          file_stat = directory_entry.stat()
+          signature = [file_stat.st_mtime_ns,file_stat.st_size]
+          entry = old_entries.get(filename)
+
+          if entry == None or entry["signature"] != signature:
+            content_hash, best_score = LevelCatalog.read_file(filename)
+            known_entry = entries_by_hash.get(content_hash)
+
+            if known_entry != None:
+              entry = dict(known_entry)
+            else:
+              entry = LevelCatalog.parse_file(filename)
+              parsed += 1
+
+            entry["signature"] = signature
+            entry["hash"] = content_hash
+            entry["best score"] = best_score
+        except Exception:     # unreadable or broken file, it's left out
+          continue
+
+        entries[filename] = entry
+
+    changed = entries != old_entries
+
+    if changed:
+      with self.lock:
+        self.entries = entries
+        self.filenames = self.__sort(entries)
+        self.version += 1
+
+      self.save()
+
+    stats.add_sample("level catalog update [ms]",get_precise_time() - time_start)
+    stats.set_value("levels parsed by the catalog",parsed)
+    return changed
+
+  ## Sorts level file names by the directory order and then by name.
+
+  def __sort(self, filenames):
+    return sorted(filenames,key = lambda filename: (self.directories.index(os.path.dirname(filename)),LevelCatalog.get_sort_key(filename)))
+
+  ## Gets the catalog entries.
+  #
+  #  @return list of (file name, metadata dict), in the file name order
+
+  def get_entries(self):
+    with self.lock:
+      return [(filename,self.entries[filename]) for filename in self.filenames]
+
+  ## Saves the index file, called by update.
+
+  def save(self):
+    with self.lock:
+      content = {"version": LevelCatalog.INDEX_VERSION,"levels": self.entries}
+
+    try:
+      with open(self.index_filename + ".tmp","w") as output_file:
+        json.dump(content,output_file)
+
+      os.replace(self.index_filename + ".tmp",self.index_filename)
+    except (IOError,OSError):
+      pass            # the catalog will just be scanned again next time
+
+  def __load(self):
+    try:
+      with open(self.index_filename) as input_file:
+        content = json.load(input_file)
+
+      if content.get("version") == LevelCatalog.INDEX_VERSION:
+        self.entries = {filename: entry for filename, entry in content["levels"].items()
+          if os.path.dirname(filename) in self.directories}
+    except (IOError,OSError,ValueError,KeyError,AttributeError):
+      self.entries = {}
+
+    self.filenames = self.__sort(self.entries)
+
+  ## Initialises the catalog from the index file, call update to scan
+  #  the directories.
+  #
+  #  @param directories list of directories with the level files
+  #  @param index_filename file in which the index is kept
+
+  def __init__(self, directories, index_filename = INDEX_FILENAME):
+    self.directories = [os.path.normpath(directory) for directory in directories]
+    self.index_filename = index_filename
+    self.lock = threading.Lock()
+    ## held by the running update, it also keeps the index file from
+    #  being written by two threads at once
+    self.update_lock = threading.Lock()
+    ## metadata dicts indexed by the level file name
+    self.entries = {}
+    ## sorted level file names
+    self.filenames = []
+    ## increased whenever the entries change
+    self.version = 0
+    self.__load()
+
+#-----------------------------------------------------------------------
+
+class Config:
+  def __init__(self, filename):
+    self.sound = True
+    self.fullscreen = False
+    self.name = "player"
+    self.stats = False
+    self.developer = False
+    self.verifier = ""
+    self.gc_control = False
+    self.allocations = False
+    self.renderer = "surface"
+    ## memory budgets in MB by category, see MemoryAccounting
+    self.memory_budgets = {}
+    self.players = 1
+    ## directories with the level files, more can be added with the
+    #  "level directory" key
+    self.level_directories = ["resources"]
+
+    try:
+      lines = [line.strip() for line in open(filename)]
+
+      for line in lines:
+        line_split = line.split(":",1)
+        line_split[0] = line_split[0].lstrip().rstrip()
+        line_split[1] = line_split[1].lstrip().rstrip()
+
+        if line_split[0] == "sound":
+          self.sound = line_split[1] == "yes"
+        elif line_split[0] == "fullscreen":
+          self.fullscreen = line_split[1] == "yes"
+        elif line_split[0] == "name":
+          self.sound = line_split[1]
+        elif line_split[0] == "stats":
+          self.stats = line_split[1] == "yes"
+        elif line_split[0] == "developer":
+          self.developer = line_split[1] == "yes"
+        elif line_split[0] == "verifier":
+          self.verifier = line_split[1]
+        elif line_split[0] == "gc control":
+          self.gc_control = line_split[1] == "yes"
+        elif line_split[0] == "allocations":
+          self.allocations = line_split[1] == "yes"
+        elif line_split[0] == "renderer":
+          self.renderer = line_split[1]
+        elif line_split[0] == "players":
+          try:
+            self.players = max(1,min(2,int(line_split[1])))
+          except ValueError:   # a typo mustn't make the whole config be rewritten
+            print("bad config value, ignored: " + line)
+        elif line_split[0] == "level directory":
+          self.level_directories.append(line_split[1])
+        elif line_split[0].startswith("memory budget "):
+          try:
+            self.memory_budgets[line_split[0][len("memory budget "):]] = float(line_split[1])
+          except ValueError:
+            print("bad config value, ignored: " + line)
+
+    except Exception:    # make a new config file
+      output_file = open(filename,'w')
+      output_file.write("name: player\nfullscreen: no\nsound: yes\n")
+      output_file.close()
+
+#-----------------------------------------------------------------------
+
+## Watches a file for changes by polling its modification time and size.
+
+class FileWatcher:
+  POLL_INTERVAL = 250    # in milliseconds
+
+  ## Checks whether the file has changed since the last check, the file
+  #  is actually checked at most once per POLL_INTERVAL.
+  #
+  #  @return True if the file has changed, False otherwise
+
+  def has_changed(self):
+    time_now = get_precise_time()
+
+    if time_now < self.next_poll:
+      return False
+
+    self.next_poll = time_now + FileWatcher.POLL_INTERVAL
+    signature = self.__get_signature()
+
+    if signature == self.signature:
+      return False
+
+    self.signature = signature
+    return True
+
+  def __get_signature(self):
+    try:
+      file_stat = os.stat(self.filename)
+      return (file_stat.st_mtime,file_stat.st_size)
+    except OSError:
+      return None
+
+  def __init__(self, filename):
+    self.filename = filename
+    ## (modification time, size) from the last check
+    self.signature = self.__get_signature()
+    ## time of the next poll in milliseconds
+    self.next_poll = 0
+
+#-----------------------------------------------------------------------
+
+## The main game class handling the inpu management, calling renderer,
+#  the main game loop etc.
+
+class Game:
+  STATE_MENU_MAIN = 0
+  STATE_MENU_ABOUT = 1
+  STATE_MENU_PLAY = 2
+  STATE_IN_GAME = 3
+  VERSION = "1.1"
+  ASSET_PACK_FILENAME = "resources.pack"
+  MEMORY_REFRESH_INTERVAL = 500    # in milliseconds
+  ## controls of the second player by key
+  SECOND_PLAYER_KEYS = {pygame.K_a: Controls.LEFT,pygame.K_d: Controls.RIGHT,pygame.K_w: Controls.UP,pygame.K_TAB: Controls.FLAP,pygame.K_q: Controls.QUACK}
+  LAST_RUN_FILENAME = "last_run.json"
+
+  ## Initialises a new game.
+  #
+  #  @param name player name (string)
+  #  @param fullscreen whether the game will be in fullscreen or not (boolean)
+  #  @param sounds whether sounds and music will be played
+  #  @param stats whether runtime statistics will be collected and
+  #         shown
+  #  @param developer whether the developer mode is on (the level
+  #         files are reloaded when they change)
+  #  @param verifier URL of the replay verification service the won
+  #         runs are submitted to, if empty, the scores are saved
+  #         directly
+  #  @param gc_control whether the garbage collection is deferred to
+  #         the menus and level transitions
+  #  @param allocations whether the allocations of each frame are
+  #         recorded into the statistics (slow)
+  #  @param renderer renderer backend: "surface" (CPU blits), "texture"
+  #         (SDL2 textures) or "software" (SDL2 textures with the
+  #         software renderer)
+  #  @param memory_budgets dict of memory budgets in MB by category
+  #         overriding the default ones (see MemoryAccounting)
+  #  @param players number of players, 2 splits the screen (the second
+  #         player uses W, A, D, tab and Q)
+
+  def __init__(self, name, fullscreen, sound, stats = False, developer = False, verifier = "", gc_control = False, allocations = False,
+    renderer = SurfaceBackend.NAME, memory_budgets = {}, players = 1, level_directories = ("resources",)):
+    ## the player's name
+    self.name = name
+    self.fullscreen = fullscreen
+    self.sound = sound
+    ## whether the statistics overlay is shown (toggled with F3) and
+    #  the report is printed when the game ends
+    self.show_stats = stats
+    ## measures the latency from key presses to their display
+    self.latency_meter = InputLatencyMeter("input latency [ms]")
+    self.developer = developer
+    ## watches the current level file in the developer mode
+    self.level_watcher = None
+    self.verifier = verifier
+    ## records the inputs of the current level run (ReplayRecorder)
+    self.recorder = None
+    ## frame time in milliseconds not yet simulated because it's shorter
+    #  than ReplayRecorder.MIN_STEP_TIME
+    self.step_time_left = 0.0
+    ## GarbageCollectorControl or None
+    self.gc_control = GarbageCollectorControl() if gc_control else None
+    ## AllocationTracker or None
+    self.allocation_tracker = AllocationTracker() if allocations else None
+    self.memory_accounting = MemoryAccounting(memory_budgets)
+    ## whether the memory debug screen is shown (toggled with F4)
+    self.show_memory = False
+    ## lines of the memory debug screen, they are measured again after
+    #  MEMORY_REFRESH_INTERVAL
+    self.memory_lines = []
+    self.memory_lines_time = None
+    self.players = players
+    ## combination of Controls flags pressed by the second player
+    self.second_player_controls = Controls.NONE
+
+    if not developer:     # loose files are used in the developer mode
+      resource_loader.use_pack(Game.ASSET_PACK_FILENAME)
+    self.state = Game.STATE_MENU_MAIN
+    screen_width = 1024
+    screen_height = 640
+
+    if sound:
+      pygame.mixer.pre_init(22050,-16,2,512)   # smaller size of the buffer (512) prevents the audio from lagging
+
+    # Only the modules needed for the main menu are initialised here, the
+    # mixer is initialised by the sound player in the background.
+    pygame.display.init()
+    pygame.font.init()
+
+    os.environ['SDL_VIDEO_WINDOW_POS'] = "%d,%d" % (100,50)  # set the screen position
+
+    if self.fullscreen:
+      fullscreen_size = (pygame.display.list_modes())[0]
+
+      if fullscreen_size != -1:
+        screen_width = fullscreen_size[0]
+        screen_height = fullscreen_size[1]
+
+    if renderer in (TextureBackend.NAME,"software"):
+      backend = TextureBackend((screen_width,screen_height),"steamer duck",self.fullscreen,renderer == "software")
+    else:
+      if self.fullscreen:
+        screen = pygame.display.set_mode((screen_width,screen_height),pygame.FULLSCREEN)
+      else:
+        screen = pygame.display.set_mode((screen_width,screen_height))
+
+      pygame.display.set_caption("steamer duck")
+      backend = SurfaceBackend(screen)
+
+    pygame.mouse.set_visible(False)
+    startup_timeline.mark("display created")
+    self.sound_player = SoundPlayer(sound)
+    self.particles = ParticleSystem()
+    self.level = None
+    self.renderer = Renderer(screen_width,screen_height,backend)
+    self.renderer.set_viewports(players)
+    startup_timeline.mark("menu assets loaded")
+    ## loads the assets not needed by the menu after the first frame
+    self.asset_loader = None
+    self.key_up = False
+    self.key_down = False
+    self.key_left = False
+    self.key_right = False
+    self.key_space = False
+    self.key_ctrl = False
+    self.key_return = False
+    self.key_escape = False
+    self.key_retry = False
+    self.key_page_up = False
+    self.key_page_down = False
+    self.menu_main = Menu()
+    self.menu_main.items.append("new game")
+    self.menu_main.items.append("about")
+    self.menu_main.items.append("exit")
+
+    self.menu_about = Menu()
+    self.menu_about.items.append("back")
+    self.menu_about.text_lines.append("Miloslav Ciz, 2015")
+    self.menu_about.text_lines.append("version " + Game.VERSION)
+    self.menu_about.text_lines.append("powered by Python + Pygame")
+    self.menu_about.text_lines.append("your name is set to: " + self.name)
+
+    self.menu_about.text_lines.append("")
+    self.menu_about.text_lines.append("arrows = move")
+    self.menu_about.text_lines.append("R = restart the level")
+    self.menu_about.text_lines.append("ctrl = quack")
+    self.menu_about.text_lines.append("space = flap wings")
+    self.menu_about.text_lines.append("get all eggs and get to the teleport")
+
+    self.menu_play = Menu()
+    self.menu_play.page_size = max(1,(screen_height - 160) // 40)
+    self.catalog = LevelCatalog(level_directories)
+    ## LevelCatalog.version the play menu has been made for
+    self.catalog_version = None
+    ## level files of the play menu items
+    self.level_filenames = []
+    ## metadata of the play menu items, see LevelCatalog
+    self.level_entries = []
+    ## range of the play menu items whose previews have been requested
+    self.thumbnails_range = None
+    self.__update_menu_play()
+    self.thumbnails = ThumbnailCache()
+
+  ## Private method, makes the play menu items from the level catalog
+  #  if it has changed, the selected level stays selected.
+
+  def __update_menu_play(self):
+    if self.catalog_version == self.catalog.version:
+      return
+
+    self.catalog_version = self.catalog.version
+    selected_filename = None
+
+    if self.menu_play.selected_item < len(self.level_filenames):
+      selected_filename = self.level_filenames[self.menu_play.selected_item]
+
+    entries = self.catalog.get_entries()
+    self.level_filenames = [entry[0] for entry in entries]
+    self.level_entries = [entry[1] for entry in entries]
+    self.menu_play.items = [entry[1]["name"] for entry in entries] + ["back"]
+    self.menu_play.select(self.level_filenames.index(selected_filename) if selected_filename in self.level_filenames else 0)
+    self.thumbnails_range = None
+
+  ## Private method, requests the previews of the shown play menu items
+  #  when the shown items change.
+
+  def __request_thumbnails(self):
+    shown_range = self.menu_play.get_shown_range()
+
+    if shown_range != self.thumbnails_range:
+      self.thumbnails_range = shown_range
+      self.thumbnails.request(self.level_filenames[shown_range[0]:shown_range[1]])
+
+  ## Private method, gets the player controls from the pressed keys.
+  #
+  #  @return combination of Controls flags
+
+  def __get_controls(self):
+    result = Controls.NONE
+
+    if self.key_up:
+      result |= Controls.UP
+
+    if self.key_left:
+      result |= Controls.LEFT
+
+    if self.key_right:
+      result |= Controls.RIGHT
+
+    if self.key_space:
+      result |= Controls.FLAP
+
+    if self.key_ctrl:
+      result |= Controls.QUACK
+
+    return result
+
+  ## Private method, splits the frame time into the level simulation
+  #  steps, all of them within the step time limits of ReplayRecorder
+  #  so that the recorded run is accepted by the verifier. A too long
+  #  frame (e.g. the first one of a level) is split into equal steps, a
+  #  too short one is added to the next frame.
+  #
+  #  @param frame_time frame time in milliseconds
+  #  @return list of step times in milliseconds, may be empty
+
+  def __get_step_times(self, frame_time):
+    step_time = frame_time + self.step_time_left
+
+    if step_time < ReplayRecorder.MIN_STEP_TIME:
+      self.step_time_left = step_time
+      return []
+
+    self.step_time_left = 0.0
+    steps = int(math.ceil(step_time / ReplayRecorder.MAX_STEP_TIME))
+    return [min(step_time / steps,ReplayRecorder.MAX_STEP_TIME)] * steps   # min against rounding errors
+
+  ## Private method, starts a level from its template. If the same level
+  #  is being played, its scores are kept (they may have changed since
+  #  the template was parsed).
+  #
+  #  @param template LevelTemplate
+
+  def __start_level(self, template):
+    previous_level = self.level
+    self.particles.clear()
+    self.level = Level(self)
+    self.level.load_from_template(template,players = self.players)
+    self.second_player_controls = Controls.NONE
+    self.step_time_left = 0.0
+
+    if previous_level != None and previous_level.template is template:
+      self.level.scores = list(previous_level.scores)
+
+    seed = random.randrange(1 << 30)
+    self.level.random.seed(seed)
+    self.recorder = ReplayRecorder(template.content_hash,seed) if self.players == 1 else None   # the multiplayer runs aren't recorded
+    self.renderer.set_level(self.level)
+    self.state = Game.STATE_IN_GAME
+
+  ## Private method, measures the memory usage and prints a warning for
+  #  each newly exceeded budget.
+  #
+  #  @return result of MemoryAccounting.measure
+
+  def __check_memory_budgets(self):
+    usage = self.memory_accounting.measure(self.renderer,self.level)
+    context = self.level.name if self.level != None else "menu"
+
+    for warning in self.memory_accounting.check(usage,context):
+      print(warning)
+
+    stats.set_value("memory budgets exceeded",len(self.memory_accounting.exceeded))
+    return usage
+
+  ## Private method, gets the lines of the memory debug screen, the
+  #  memory is measured again at most once per MEMORY_REFRESH_INTERVAL.
+  #
+  #  @return list of strings
+
+  def __get_memory_lines(self):
+    now = get_precise_time()
+
+    if self.memory_lines_time == None or now - self.memory_lines_time >= Game.MEMORY_REFRESH_INTERVAL:
+      time_start = get_precise_time()
+      self.memory_lines = self.memory_accounting.get_report_lines(self.__check_memory_budgets())
+      self.memory_lines_time = now
+      stats.add_sample("memory measurement [ms]",get_precise_time() - time_start)
+
+    return self.memory_lines
+
+  ## Private method, restarts the current level without reading any
+  #  files. In the developer mode the template is taken from the cache,
+  #  so that the edits of the level file are applied.
+
+  def __retry_level(self):
+    time_start = get_precise_time()
+    self.__start_level(LevelTemplate.get(self.level.filename) if self.developer else self.level.template)
+
+    if self.gc_control != None:
+      self.gc_control.level_restarted()
+
+    stats.add_sample("level restart [ms]",get_precise_time() - time_start)
+
+  ## Private method, applies the changes of the level file to the
+  #  running level.
+
+  def __reload_level(self):
+    time_start = get_precise_time()
+
+    try:
+      changed_cells, tiles_changed, background_changed = self.level.reload_from_file()
+    except (ValueError,IndexError,OSError) as e:   # e.g. the file is being written, it's tried again on the next change
+      print("the level file couldn't be loaded, the running level is kept: " + str(e))
+      return
+
+    if changed_cells == None:
+      print("level size has changed, the level has to be restarted")
+      return
+
+    self.renderer.update_level(changed_cells,tiles_changed,background_changed)
+    reload_time = get_precise_time() - time_start
+    stats.add_sample("level reload [ms]",reload_time)
+    print("level reloaded in %.1f ms, %d cells changed" % (reload_time,len(changed_cells)))
+
+  ## Private method, submits a won run to the verification service and
+  #  prints the result, run in a background thread.
+  #
+  #  @param submission the run (see ReplayRecorder.make_submission)
+
+  def __submit_run(self, submission):
+    try:
+      request = urllib.request.Request(self.verifier.rstrip("/") + "/submit",data = json.dumps(submission).encode("utf-8"),
+        headers = {"Content-Type": "application/json"})
+      response = json.loads(urllib.request.urlopen(request,timeout = 60).read().decode("utf-8"))
+      print("run " + ("accepted" if response.get("accepted") else "rejected") + " by the verifier: " + response.get("reason",""))
+    except Exception as e:
+      print("the run couldn't be submitted: " + str(e))
+
+  ## Private method, loads the game assets and the sounds, run in a
+  #  background thread.
+
+  def __load_assets(self):
+    self.renderer.load_game_assets()
+    self.sound_player.load()
+    startup_timeline.mark("game assets loaded")
+
+  ## Runs the game.
+
+  def run(self):
+    global frame_time
+    done = False
+    wait = False     # whether the waiting is going on when the game is over
+    wait_until = 0
+    cheat = False
+    cheat_buffer = [0,0]
+
+    last_sample_time = get_precise_time()
+
+    while not done:
+      if self.allocation_tracker != None:
+        self.allocation_tracker.frame_started()
+
+      # The input is sampled right before the simulation step and the
+      # step length is measured up to this moment, so that the step
+      # which applies the input isn't sized by the previous frame.
+
+      for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+          done = True
+
+        if event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
+          self.latency_meter.input_received(get_precise_time())
+
+        if event.type == pygame.KEYDOWN:
+          if event.key == pygame.K_F3:
+            self.show_stats = not self.show_stats
+          elif event.key == pygame.K_F4:
+            self.show_memory = not self.show_memory
+            self.memory_lines_time = None
+          elif event.key == pygame.K_RIGHT:
+            self.key_right = True
+          elif event.key == pygame.K_UP:
+            self.key_up = True
+          elif event.key == pygame.K_LEFT:
+            self.key_left = True
+          elif event.key == pygame.K_DOWN:
+            self.key_down = True
+          elif event.key == pygame.K_SPACE:
+            self.key_space = True
+          elif event.key == pygame.K_RCTRL or event.key == pygame.K_LCTRL:
+            self.key_ctrl = True
+          elif event.key == pygame.K_RETURN:
+            self.key_return = True
+          elif event.key == pygame.K_ESCAPE:
+            self.key_escape = True
+          elif event.key == pygame.K_r:
+            self.key_retry = True
+          elif event.key == pygame.K_PAGEUP:
+            self.key_page_up = True
+          elif event.key == pygame.K_PAGEDOWN:
+            self.key_page_down = True
+          elif event.key in Game.SECOND_PLAYER_KEYS:
+            self.second_player_controls |= Game.SECOND_PLAYER_KEYS[event.key]
+          elif event.key == pygame.K_KP4:
+            cheat_buffer[0] = cheat_buffer[1]
+            cheat_buffer[1] = 4
+          elif event.key == pygame.K_KP2:
+            cheat_buffer[0] = cheat_buffer[1]
+            cheat_buffer[1] = 2
+            if cheat_buffer[0] == 4 and cheat_buffer[1] == 2:
+              self.sound_player.play_win()
+              cheat = True
+        elif event.type == pygame.KEYUP:
+          if event.key in Game.SECOND_PLAYER_KEYS:
+            self.second_player_controls &= ~Game.SECOND_PLAYER_KEYS[event.key]
+          elif event.key == pygame.K_RIGHT:
+            self.key_right = False
+          elif event.key == pygame.K_LEFT:
+            self.key_left = False
+          elif event.key == pygame.K_UP:
+            self.key_up = False
+          elif event.key == pygame.K_DOWN:
+            self.key_down = False
+          elif event.key == pygame.K_SPACE:
+            self.key_space = False
+          elif event.key == pygame.K_RCTRL or event.key == pygame.K_LCTRL:
+            self.key_ctrl = False
+          elif event.key == pygame.K_RETURN:
+            self.key_return = False
+          elif event.key == pygame.K_ESCAPE:
+            self.key_escape = False
+
+      sample_time = get_precise_time()
+      frame_time = sample_time - last_sample_time
+      last_sample_time = sample_time
+
+      if self.state == Game.STATE_IN_GAME:
+        if self.key_escape:
+          self.state = Game.STATE_MENU_MAIN
+
+        if self.level_watcher != None and self.level_watcher.has_changed():
+          self.__reload_level()
+
+        if self.key_retry:
+          self.key_retry = False
+          wait = False
+          self.__retry_level()
+
+        if self.level.state != Level.STATE_PLAYING:
+          if not wait:
+            wait_until = get_precise_time() + 3000 # wait 2 seconds
+            wait = True
+          elif get_precise_time() >= wait_until:
+            wait = False
+            self.state = Game.STATE_MENU_MAIN
+
+        self.level.player.walk_acceleration = 40.0 if cheat else 20.0
+        controls = self.__get_controls()
+
+        if self.players > 1:
+          controls = [controls,self.second_player_controls]
+
+        for step_time in self.__get_step_times(frame_time):
+          if self.level.state == Level.STATE_PLAYING and self.recorder != None:
+            self.recorder.record(controls,step_time)
+            self.level.step(controls,step_time)
+
+            if self.level.state != Level.STATE_PLAYING:
+              self.recorder.save(Game.LAST_RUN_FILENAME,self.level,self.name)
+
+            if self.level.state == Level.STATE_WON and len(self.verifier) != 0:
+              submitter = threading.Thread(target = self.__submit_run,args = (self.recorder.make_submission(self.level,self.name),))
+              submitter.daemon = True
+              submitter.start()
+          else:
+            self.level.step(controls,step_time)
+
+        self.particles.update(frame_time)
+        stats.set_value("particles",self.particles.get_count())
+
+        if self.level.state != Level.STATE_LOST:     # follow the player only if he's not lost
+          self.renderer.set_camera_to_player()
+
+        self.renderer.render_level()
+      elif self.state == Game.STATE_MENU_MAIN:
+        if self.key_up:
+          self.menu_main.cursor_up()
+          self.key_up = False
+
+        if self.key_down:
+          self.menu_main.cursor_down()
+          self.key_down = False
+
+        if self.key_return:
+          if self.menu_main.selected_item == 0:
+            self.state = Game.STATE_MENU_PLAY
+            self.thumbnails_range = None
+            catalog_updater = threading.Thread(target = self.catalog.update)
+            catalog_updater.daemon = True
+            catalog_updater.start()
+          elif self.menu_main.selected_item == 1:
+            self.state = Game.STATE_MENU_ABOUT
+          elif self.menu_main.selected_item == 2:
+            done = True
+
+          self.key_return = False
+
+        self.renderer.render_menu(self.menu_main)
+      elif self.state == Game.STATE_MENU_ABOUT:
+        if self.key_return:
+          self.state = Game.STATE_MENU_MAIN
+          self.key_return = False
+
+        self.renderer.render_menu(self.menu_about)
+      elif self.state == Game.STATE_MENU_PLAY:
+        if self.key_up:
+          self.menu_play.cursor_up()
+          self.key_up = False
+
+        if self.key_down:
+          self.menu_play.cursor_down()
+          self.key_down = False
+
+        if self.key_page_up:
+          self.menu_play.page_up()
+          self.key_page_up = False
+
+        if self.key_page_down:
+          self.menu_play.page_down()
+          self.key_page_down = False
+
+        self.__update_menu_play()
+
+        if self.key_return:
+          if self.menu_play.selected_item >= len(self.level_filenames):
+            self.state = Game.STATE_MENU_MAIN
+          else:
+            self.level = None
+            self.__start_level(LevelTemplate.get(self.level_filenames[self.menu_play.selected_item]))
+            self.memory_accounting.reset()
+            self.__check_memory_budgets()
+
+            if self.gc_control != None:
+              self.gc_control.level_started()
+
+            if self.developer:
+              self.level_watcher = FileWatcher(self.level.filename)
+
+          self.key_return = False
+
+        self.__request_thumbnails()
+
+        if self.menu_play.selected_item < len(self.level_filenames):
+          entry = self.level_entries[self.menu_play.selected_item]
+          self.menu_play.image = self.thumbnails.get(self.level_filenames[self.menu_play.selected_item])
+          self.menu_play.image_lines = [
+            "size: " + str(entry["width"]) + " x " + str(entry["height"]),
+            "eggs: " + str(entry["eggs"]) + ", coins: " + str(entry["coins"])]
+
+          if entry["best score"] != None:
+            self.menu_play.image_lines.append("best: " + str(entry["best score"][1]) + " (" + entry["best score"][0] + ")")
+        else:
+          self.menu_play.image = None
+          self.menu_play.image_lines = []
+
+        self.renderer.render_menu(self.menu_play)
+
+      if self.gc_control != None:
+        if self.state == Game.STATE_IN_GAME:
+          self.gc_control.frame_finished()
+        else:
+          self.gc_control.safe_point()
+
+      if self.show_memory:
+        self.renderer.render_stats(self.__get_memory_lines())
+      elif self.show_stats:
+        self.renderer.render_stats(stats.get_overlay_lines())
 
+      self.renderer.present()
 
-#-----------------------------------------------------------------------
+      self.latency_meter.frame_presented(get_precise_time())
+      stats.add_sample("frame time [ms]",frame_time)
 
-class Enemy(Movable):
-  ENEMY_FLYING = 0
-  ENEMY_GROUND = 1
+      if self.asset_loader == None:
+        startup_timeline.mark("first frame")
+        self.asset_loader = threading.Thread(target = self.__load_assets)
+        self.asset_loader.daemon = True
+        self.asset_loader.start()
+      elif not self.asset_loader.is_alive():
+        startup_timeline.mark("interactive")
 
-  ## Makes the enemy move accoording to its AI. The step length is
-  #  computed out of a global
-  #  variable frame_time.
+      if self.allocation_tracker != None:
+        self.allocation_tracker.frame_finished()
 
-  def ai_move(self):
-    self.force_computer.execute_step()
+    self.renderer.close()
 
-    if pygame.time.get_ticks() < self.level.player.last_quack_time + Player.QUACK_DURATION:  # quack is active => monsters don't move
-      self.force_computer.velocity_vector[0] = 0
+    if self.show_stats:
+      for line in stats.get_report_lines():
+        print(line)
 
-      if self.enemy_type == Enemy.ENEMY_FLYING:
-        self.force_computer.velocity_vector[1] = 0
+    if self.allocation_tracker != None:
+      for line in self.allocation_tracker.get_report_lines():
+        print(line)
 
-      return
+#-----------------------------------------------------------------------
 
-    if pygame.time.get_ticks() >= self.next_direction_change:
-      self.next_direction_change = pygame.time.get_ticks() + random.randint(500,2000)
-      self.__recompute_direction()
+## Searches for the inputs that complete a level (all eggs collected and
+#  the teleport reached) as fast as possible. The search is a weighted
+#  best-first search over headless simulation states with discretised
+#  input choices, each held for a fixed number of simulation steps. A
+#  transposition table keyed by the quantised player position, velocity
+#  and the set of collected objects prunes the states that have already
+#  been reached sooner.
+
+class LevelSolver:
+  STEP_TIME = 1000.0 / 60.0     # simulation step length in milliseconds
+  STEPS_PER_ACTION = 6          # for how many steps one input choice is held
+  ACTIONS = (Controls.RIGHT,Controls.LEFT,Controls.RIGHT | Controls.UP,Controls.LEFT | Controls.UP,
+    Controls.UP,Controls.RIGHT | Controls.FLAP,Controls.LEFT | Controls.FLAP,
+    Controls.RIGHT | Controls.UP | Controls.FLAP,Controls.LEFT | Controls.UP | Controls.FLAP,
+    Controls.NONE,Controls.RIGHT | Controls.QUACK,Controls.LEFT | Controls.QUACK)
+  QUANTA = ((0.5,2.0),(0.25,1.0),(0.125,0.5))   # (position, velocity) quanta of the search passes, coarse to fine
+  SPEED_ESTIMATE = 3.0          # tiles per second, for the time estimate
+  EGG_TIME_ESTIMATE = 2000      # estimated time of getting one egg in milliseconds
+  HEURISTIC_WEIGHT = 1.5
+  MAX_LEVEL_TIME = 300000       # states with a longer time are not expanded
+
+  ## Private method, computes the distances (in cells, through the
+  #  cells without tiles) from given cell to all the other cells.
+  #
+  #  @return dict of distances indexed by (x,y)
 
-  ## Private method, recomputes the direction of movement to a new
-  #  direction and remembers it as a velocity vector in force computer.
+  def __compute_distances(self, x, y):
+    result = {(x,y): 0}
+    queue = collections.deque([(x,y)])
 
-  def __recompute_direction(self):
-    self.force_computer.velocity_vector[0] = 1.0 - random.random() * 2.0
-    self.force_computer.velocity_vector[1] = 1.0 - random.random() * 2.0
+    while len(queue) > 0:
+      cell = queue.popleft()
 
-  def __init__(self, level, enemy_type = ENEMY_GROUND):
-    super(Enemy,self).__init__(level)
-    self.enemy_type = enemy_type
+      for neighbour in ((cell[0] - 1,cell[1]),(cell[0] + 1,cell[1]),(cell[0],cell[1] - 1),(cell[0],cell[1] + 1)):
+        if (not neighbour in result and 0 <= neighbour[0] < self.level.width and 0 <= neighbour[1] < self.level.height and
+          not MapGridObject.is_tile(self.level.map_array[neighbour[0]][neighbour[1]])):
+          result[neighbour] = result[cell] + 1
+          queue.append(neighbour)
 
-    self.force_computer = ForceComputer(self)
+    return result
 
-    if self.enemy_type == Enemy.ENEMY_GROUND:  # apply gravity to the ground robot
-      self.force_computer.acceleration_vector[0] = 0
-      self.force_computer.acceleration_vector[1] = level.gravity
+  ## Private method, estimates the time needed to finish the level from
+  #  the current level state.
 
-    self.force_computer.ground_friction = 0
+  def __estimate(self):
+    player = self.level.player
+    cell = (int(player.position_x),int(player.position_y))
+    target_type = MapGridObject.OBJECT_EGG if self.level.eggs_left > 0 else MapGridObject.OBJECT_FINISH
+    distance = 65536
 
-    ## time of next direction change
-    self.next_direction_change = 0
+    for position in self.distances:
+      if self.level.trigger_index.cells.get(position) != None and self.level.trigger_index.cells[position].object_type == target_type:
+        distance = min(distance,self.distances[position].get(cell,65536))
 
-    self.enemy_type = enemy_type
-    return
+    return distance / LevelSolver.SPEED_ESTIMATE * 1000.0 + self.level.eggs_left * LevelSolver.EGG_TIME_ESTIMATE
 
-#-----------------------------------------------------------------------
+  def __get_key(self, position_quantum, velocity_quantum):
+    player = self.level.player
+    velocity = player.force_computer.velocity_vector
 
-## Tile top layer image container.
+    return (int(player.position_x / position_quantum),int(player.position_y / position_quantum),
+      int(round(velocity[0] / velocity_quantum)),int(round(velocity[1] / velocity_quantum)),
+      frozenset(self.level.removed_objects))
 
-class TileTopImageContainer:
-  def __init__(self):
-    ## full image
-    self.image = None
-    ## subimage - left
-    self.left = None
-    ## subimage - center
-    self.center = None
-    ## subimage - right
-    self.right = None
+  ## Private method, makes the input script leading to given search node.
 
-#-----------------------------------------------------------------------
+  def __make_script(self, node_index):
+    actions = []
 
-## Character (player, enemy, ...) image container.
+    while node_index != 0:
+      node_index, action = self.nodes[node_index]
+      actions.append(action)
 
-class CharacterImageContainer:
-  def __init__(self):
-    self.standing = []
-    self.moving_right = []
-    self.moving_left = []
-    self.jumping = []
-    self.special = []
+    actions.reverse()
+    result = []
 
-#-----------------------------------------------------------------------
+    for action in actions:
+      if len(result) > 0 and result[-1][0] == action:
+        result[-1] = (action,result[-1][1] + LevelSolver.STEPS_PER_ACTION)
+      else:
+        result.append((action,LevelSolver.STEPS_PER_ACTION))
 
-class SoundPlayer:
+    return result
 
-  ## Initialises the sound player.
+  ## Searches for the solution. The search is done in passes from
+  #  coarse to fine state quantisation: a coarse pass is fast but can
+  #  prune away the only way through, the following passes look for
+  #  a (better) solution with finer quantisation while there is time.
   #
-  #  @param allow whether the sound is allowed or not (boolean)
+  #  @param time_budget maximum search time in seconds
+  #  @return True if a solution has been found, False otherwise
 
-  def __init__(self, allow):
-    self.allowed = allow
+  def solve(self, time_budget):
+    deadline = get_precise_time() + time_budget * 1000.0
+    start_state = self.level.save_state()
+    self.nodes = [(None,None)]
 
-    if not self.allowed:
-      return
+    for quanta in LevelSolver.QUANTA:
+      if get_precise_time() >= deadline:
+        break
 
-    pygame.mixer.init()
+      self.__search(start_state,quanta[0],quanta[1],deadline)
 
-    if not pygame.mixer.get_init:
-      return
+    self.level.load_state(start_state)
+    return self.best_time != None
 
-    self.sound_quack = pygame.mixer.Sound("resources/quack.wav")
-    self.sound_trampoline = pygame.mixer.Sound("resources/trampoline.wav")
-    self.sound_coin = pygame.mixer.Sound("resources/coin.wav")
-    self.sound_click = pygame.mixer.Sound("resources/click.wav")
-    self.sound_flap = pygame.mixer.Sound("resources/flapping.wav")
-    self.sound_win = pygame.mixer.Sound("resources/win.wav")
+  ## Private method, one search pass.
 
-    pygame.mixer.music.load("resources/blue_dot_session.wav")
-    pygame.mixer.music.set_volume(0.5)
-    pygame.mixer.music.play()
+  def __search(self, start_state, position_quantum, velocity_quantum, deadline):
+    level = self.level
+    transpositions = {}
+    open_heap = [(0,0,start_state)]
 
-  def play_quack(self):
-    if self.allowed:
-      self.sound_quack.play()
+    while len(open_heap) > 0 and get_precise_time() < deadline:
+      estimate, node_index, state = heapq.heappop(open_heap)
+      self.expanded += 1
 
-  def play_trampoline(self):
-    if self.allowed:
-      self.sound_trampoline.play()
+      for action in LevelSolver.ACTIONS:
+        level.load_state(state)
 
-  def play_coin(self):
-    if self.allowed:
-      self.sound_coin.play()
+        for i in range(LevelSolver.STEPS_PER_ACTION):
+          level.step(action,LevelSolver.STEP_TIME)
 
-  def play_click(self):
-    if self.allowed:
-      self.sound_click.play()
+          if level.state != Level.STATE_PLAYING:
+            break
 
-  def play_flap(self):
-    if self.allowed:
-      self.sound_flap.play()
+        if level.state == Level.STATE_LOST:
+          continue
 
-  def play_win(self):
-    if self.allowed:
-      self.sound_win.play()
+        self.nodes.append((node_index,action))
 
-#-----------------------------------------------------------------------
+        if level.state == Level.STATE_WON:
+          if self.best_time == None or level.time < self.best_time:
+            self.best_time = level.time
+            self.best_score = level.score
+            self.best_script = self.__make_script(len(self.nodes) - 1)
 
-class Renderer:
-  TILE_WIDTH = 200
-  TILE_HEIGHT = 200
-  TOP_LAYER_OFFSET = 10
-  TOP_LAYER_LEFT_WIDTH = 23
-  QUACK_LENGTH = 350
+          continue
 
-  def __init_attributes(self):
-    ## normal sized font
-    self.font_normal = pygame.font.Font("resources/Folktale.ttf",28)
-    ## small sized font
-    self.font_small = pygame.font.Font("resources/larabiefont.ttf",20)
-    ## the text color
-    self.font_color = (100,50,0)
-    ## reference to a level being rendered
-    self._level = None
-    ## screen width in pixel
-    self.screen_width = 640
-    ## screen height in pixel
-    self.screen_height = 480
-    ## screen width in tiles (rounded up)
-    self.screen_width_tiles = 1
-    ## screen height in tiles (rounded up)
-    self.screen_height_tiles = 1
-    ## camera top left corner x offset from the origin in pixels
-    self._camera_x = 0
-    ## camera top left corner y offset from the origin in pixels
-    self._camera_y = 0
-    ## contains images of tiles indexed by tile id, each item is a list
-    #  where each item contains an image of one tile variant starting
-    #  from 1, index 0 contains a TileTopImageContainer
-    self.tile_images = {}
-    ## contains the level background image
-    self.background_image = None
-    ## contains prerendered image of high score text
-    self.scores_image = None
-    arrow_mask = pygame.image.load("resources/arrow_mask.bmp")
-    self.arrow_image = prepare_image(pygame.image.load("resources/arrow.bmp"),transparency_mask = arrow_mask)
-    ## contains flying enemy images
-    self.enemy_flying_images = []
-    enemy_flying_mask = pygame.image.load("resources/robot_flying_1_mask.bmp")
-    self.enemy_flying_images.append(prepare_image(pygame.image.load("resources/robot_flying_1.bmp"),transparency_mask = enemy_flying_mask))
-    enemy_flying_mask = pygame.image.load("resources/robot_flying_2_mask.bmp")
-    self.enemy_flying_images.append(prepare_image(pygame.image.load("resources/robot_flying_2.bmp"),transparency_mask = enemy_flying_mask))
-    enemy_flying_mask = pygame.image.load("resources/robot_flying_3_mask.bmp")
-    self.enemy_flying_images.append(prepare_image(pygame.image.load("resources/robot_flying_3.bmp"),transparency_mask = enemy_flying_mask))
-    ## contains ground enemy images
-    self.enemy_ground_images = []
-    enemy_ground_mask = pygame.image.load("resources/robot_ground_stand_mask.bmp")
-    self.enemy_ground_images.append(prepare_image(pygame.image.load("resources/robot_ground_stand.bmp"),transparency_mask = enemy_ground_mask))
-    enemy_ground_mask = pygame.image.load("resources/robot_ground_right_mask.bmp")
-    self.enemy_ground_images.append(prepare_image(pygame.image.load("resources/robot_ground_right.bmp"),transparency_mask = enemy_ground_mask))
-    enemy_ground_mask = pygame.image.load("resources/robot_ground_left_mask.bmp")
-    self.enemy_ground_images.append(prepare_image(pygame.image.load("resources/robot_ground_left.bmp"),transparency_mask = enemy_ground_mask))
-    ## contains teleport image
-    teleport_mask = pygame.image.load("resources/teleport_mask.bmp")
-    self.teleport_inactive_image = prepare_image(pygame.image.load("resources/teleport_1.bmp"),transparency_mask = teleport_mask)
-    self.teleport_active_image = prepare_image(pygame.image.load("resources/teleport_2.bmp"),transparency_mask = teleport_mask)
-    self.logo_image = prepare_image(pygame.image.load("resources/logo.bmp"))
-    ## contains coin animation images
-    self.coin_images = []
+        if level.clock > LevelSolver.MAX_LEVEL_TIME or (self.best_time != None and level.clock >= self.best_time):
+          continue
 
-    score_bar_mask = pygame.image.load("resources/score_bar_mask.bmp")
-    self.score_bar_image = prepare_image(pygame.image.load("resources/score_bar.bmp"),transparency_mask = score_bar_mask)
+        key = self.__get_key(position_quantum,velocity_quantum)
 
-    for i in range(1,7):
-      coin_mask = pygame.image.load("resources/coin_" + str(i) + "_mask.bmp")
-      self.coin_images.append(prepare_image(pygame.image.load("resources/coin_" + str(i) + ".bmp"),transparency_mask = coin_mask))
+        if transpositions.get(key,LevelSolver.MAX_LEVEL_TIME) <= level.clock:
+          continue           # the same state has already been reached sooner
 
-    egg_mask = pygame.image.load("resources/egg_mask.bmp")
-    ## contains egg image
-    self.egg_image = prepare_image(pygame.image.load("resources/egg.bmp"),transparency_mask = egg_mask)
+        transpositions[key] = level.clock
+        heapq.heappush(open_heap,(level.clock + LevelSolver.HEURISTIC_WEIGHT * self.__estimate(),len(self.nodes) - 1,level.save_state()))
 
-    ## how many times the background should be repeated in x direction
-    self.background_repeat_times = 1
-    ## Says which part of the map array is visible in format
-    #  (x1,y1,x2,y2)
-    self.visible_tile_area = (0,0,0,0)
+    self.states += len(transpositions)
 
-    spikes_mask = pygame.image.load("resources/spikes_mask.bmp")
-    ## contains the spikes image
-    self.spikes_image = prepare_image(pygame.image.load("resources/spikes.bmp"),transparency_mask = spikes_mask)
-    ## contains the trampoline image
-    self.trampoline_image = prepare_image(pygame.image.load("resources/trampoline.bmp"))
+  ## Writes the best script found to a file.
+  #
+  #  @param filename file name
 
-    ## contains images of the player (the duck)
-    self.player_images = CharacterImageContainer()
+  def save_script(self, filename):
+    output_file = open(filename,"w")
+    output_file.write("level:\n" + os.path.basename(self.level.filename) + "\n")
+    output_file.write("step:\n" + repr(LevelSolver.STEP_TIME) + "\n")
+    output_file.write("time:\n" + str(self.best_time) + "\n")
+    output_file.write("script:\n")
 
-    self.player_images.standing.append(prepare_image(pygame.image.load("resources/duck_right_stand.bmp"),transparency_mask = pygame.image.load("resources/duck_right_stand_mask.bmp")))
-    self.player_images.standing.append(pygame.transform.flip(self.player_images.standing[0],True,False))
+    for item in self.best_script:
+      output_file.write(str(item[1]) + " " + Controls.to_string(item[0]) + "\n")
 
-    for i in range(1,7):
-      self.player_images.moving_right.append(prepare_image(pygame.image.load("resources/duck_right_walk_" + str(i) + ".bmp"),transparency_mask = pygame.image.load("resources/duck_right_walk_" + str(i) + "_mask.bmp")))
-      self.player_images.moving_left.append(pygame.transform.flip(self.player_images.moving_right[-1],True,False))
+    output_file.close()
 
-    self.player_images.jumping.append(prepare_image(pygame.image.load("resources/duck_right_jump_up_1.bmp"),transparency_mask = pygame.image.load("resources/duck_right_jump_up_1_mask.bmp")))
-    self.player_images.jumping.append(prepare_image(pygame.image.load("resources/duck_right_jump_up_2.bmp"),transparency_mask = pygame.image.load("resources/duck_right_jump_up_2_mask.bmp")))
-    self.player_images.jumping.append(prepare_image(pygame.image.load("resources/duck_right_jump_down_1.bmp"),transparency_mask = pygame.image.load("resources/duck_right_jump_down_1_mask.bmp")))
-    self.player_images.jumping.append(prepare_image(pygame.image.load("resources/duck_right_jump_down_2.bmp"),transparency_mask = pygame.image.load("resources/duck_right_jump_down_2_mask.bmp")))
-    self.player_images.jumping.append(pygame.transform.flip(self.player_images.jumping[0],True,False))
-    self.player_images.jumping.append(pygame.transform.flip(self.player_images.jumping[1],True,False))
-    self.player_images.jumping.append(pygame.transform.flip(self.player_images.jumping[2],True,False))
-    self.player_images.jumping.append(pygame.transform.flip(self.player_images.jumping[3],True,False))
+  ## Initialises the solver.
+  #
+  #  @param level level to be solved, it should be freshly loaded, its
+  #         state is used as the start of the search (Level)
+  #  @param seed random seed of the level simulation
 
-    self.player_images.special.append(prepare_image(pygame.image.load("resources/duck_right_quack.bmp"),transparency_mask = pygame.image.load("resources/duck_right_quack_mask.bmp")))
-    self.player_images.special.append(pygame.transform.flip(self.player_images.special[0],True,False))
+  def __init__(self, level, seed = 0):
+    self.level = level
+    level.random.seed(seed)
+    ## distance maps (see __compute_distances) of the eggs and the
+    #  finish indexed by their (x,y) positions
+    self.distances = {}
+
+    for position in level.trigger_index.cells:
+      if level.trigger_index.cells[position].object_type in (MapGridObject.OBJECT_EGG,MapGridObject.OBJECT_FINISH):
+        self.distances[position] = self.__compute_distances(position[0],position[1])
+
+    ## search nodes in format (parent index, action)
+    self.nodes = []
+    ## number of expanded search states
+    self.expanded = 0
+    ## number of distinct states in the transposition tables
+    self.states = 0
+    ## time of the best solution in milliseconds or None
+    self.best_time = None
+    ## score of the best solution
+    self.best_score = 0
+    ## the best solution as a list of (controls, number of steps)
+    self.best_script = None
 
-  ## Converts number of milliseconds to a string in format:
-  #  ss:m.
+#-----------------------------------------------------------------------
+
+## Reinforcement learning environment over a level in the style of gym:
+#  reset starts an episode, step applies one of the discrete ACTIONS and
+#  returns the observation, the reward and whether the episode has ended.
+#  The observation is a dict of NumPy arrays: "map" is a window of cell
+#  codes around the player (see CELL_ constants) and "state" holds the
+#  player and level counters (see STATE_ constants). The arrays are
+#  written in place each step, copy them to keep them.
+
+class LevelEnvironment:
+  ACTIONS = LevelSolver.ACTIONS
+  STEP_TIME = LevelSolver.STEP_TIME
+  VIEW_WIDTH = 16              # observed map window size in cells
+  VIEW_HEIGHT = 12
+  MAX_TIME = LevelSolver.MAX_LEVEL_TIME   # episodes are truncated after this level time in milliseconds
+  EGG_REWARD = 500
+  LOSS_REWARD = -1000
+
+  CELL_EMPTY = 0               # the other cells have MapGridObject.object_type + 1
+  CELL_OUTSIDE = MapGridObject.OBJECT_TILE + 1
+
+  STATE_X = 0
+  STATE_Y = 1
+  STATE_VELOCITY_X = 2
+  STATE_VELOCITY_Y = 3
+  STATE_PLAYER_STATE = 4
+  STATE_FACING_RIGHT = 5
+  STATE_EGGS_LEFT = 6
+  STATE_COINS = 7
+  STATE_TIME = 8               # in seconds
+  STATE_QUACK_READY = 9
+  STATE_SIZE = 10
+
+  ## Makes the observation buffers.
   #
-  #  @param value number of milliseconds
-  #  @return string in format described above
+  #  @param count number of environments, 0 for unbatched arrays
+  #  @return dict of zeroed NumPy arrays
 
-  def __milliseconds_to_time(self, value):
-    seconds = int(value / 1000)
-    tenths = int((value % 1000) / 100)
+  @staticmethod
+  def make_observation(count = 0):
+    batch = (count,) if count > 0 else ()
+    return {
+      "map": numpy.zeros(batch + (LevelEnvironment.VIEW_HEIGHT,LevelEnvironment.VIEW_WIDTH),numpy.uint8),
+      "state": numpy.zeros(batch + (LevelEnvironment.STATE_SIZE,),numpy.float32)
+      }
+
+  ## Starts a new episode.
+  #
+  #  @param seed random seed of the level simulation, None continues
+  #         with the next seed after the previous episode's one
+  #  @return observation
+
+  def reset(self, seed = None):
+    if seed != None:
+      self.seed = seed
+
+    self.level.load_state(self.start_state)
+    self.level.random.seed(self.seed)
+    self.seed += 1
+    numpy.copyto(self.grid,self.start_grid)
+    self.removed_count = 0
+    self.last_score = self.level.score
+    self.last_eggs = self.level.eggs_left
+    self.__observe()
+    return self.observation
+
+  ## Applies an action for action_repeat simulation steps.
+  #
+  #  @param action index to ACTIONS
+  #  @return tuple (observation, reward, terminated, truncated, info
+  #          dict), terminated says the level has been won or lost,
+  #          truncated that MAX_TIME has been reached
 
-    return str(seconds) + ":" + str(tenths)
+  def step(self, action):
+    level = self.level
+    controls = LevelEnvironment.ACTIONS[action]
 
-  ## Sets the level to be rendered.
-  #
-  #  @param level Level object
+    for i in range(self.action_repeat):
+      level.step(controls,self.step_time)
 
-  def set_level(self, level):
-    self._level = level
+      if level.state != Level.STATE_PLAYING:
+        break
 
-    # load the level background image:
-    self.background_image = prepare_image(pygame.image.load("resources/background_" + self._level.background_name + ".bmp"))
+    reward = level.score - self.last_score + (self.last_eggs - level.eggs_left) * LevelEnvironment.EGG_REWARD
+    self.last_score = level.score
+    self.last_eggs = level.eggs_left
 
-    self.background_repeat_times = int(math.ceil(self.screen_width / float(self.background_image.get_width())))
+    if level.state == Level.STATE_LOST:
+      reward += LevelEnvironment.LOSS_REWARD
 
-    # load the tile images:
-    for tile in level.tiles:
-      self.tile_images[tile[0]] = []
+    if len(level.removed_objects) != self.removed_count:
+      self.removed_count = len(level.removed_objects)
 
-      # tile top:
-      top_mask = pygame.image.load(("resources/tile_" + tile[1] + "_top_mask.bmp"))
-      top_image = prepare_image(pygame.image.load(("resources/tile_" + tile[1] + "_top.bmp")),transparency_mask = top_mask)
+      for position in level.removed_objects:
+        self.grid[position[1] + self.margin_y,position[0] + self.margin_x] = LevelEnvironment.CELL_EMPTY
 
-      self.tile_images[tile[0]].append(TileTopImageContainer())
+    self.__observe()
+    return (self.observation,reward,level.state != Level.STATE_PLAYING,level.clock >= self.max_time,{"score": level.score,"state": level.state})
 
-      self.tile_images[tile[0]][0].image = top_image
-      self.tile_images[tile[0]][0].left = top_image.subsurface(pygame.Rect(0,0,23,56)) # left
-      self.tile_images[tile[0]][0].center = top_image.subsurface(pygame.Rect(24,0,201,56)) # center
-      self.tile_images[tile[0]][0].right = top_image.subsurface(pygame.Rect(225,0,21,56)) # right
+  ## Private method, writes the observation of the current state to the
+  #  observation buffers.
 
-      # tile variants:
-      for variant_number in range(tile[2]):
-        self.tile_images[tile[0]].append(prepare_image(pygame.image.load("resources/tile_" + tile[1] + "_" + str(variant_number + 1) + ".bmp")))
+  def __observe(self):
+    level = self.level
+    player = level.player
+    view = self.observation["map"]
+    x = int(player.position_x) - LevelEnvironment.VIEW_WIDTH // 2
+    y = int(player.position_y) - LevelEnvironment.VIEW_HEIGHT // 2
 
-    # make the score image:
+    # the grid has margins of the view size, so the window is clamped only far away from the map:
+    grid_x = min(max(x + self.margin_x,0),self.grid.shape[1] - LevelEnvironment.VIEW_WIDTH)
+    grid_y = min(max(y + self.margin_y,0),self.grid.shape[0] - LevelEnvironment.VIEW_HEIGHT)
+    view[:] = self.grid[grid_y:grid_y + LevelEnvironment.VIEW_HEIGHT,grid_x:grid_x + LevelEnvironment.VIEW_WIDTH]
+    x = grid_x - self.margin_x
+    y = grid_y - self.margin_y
 
-    self.scores_image = prepare_image(pygame.Surface((250,200)),pygame.Color(0,0,0))
-    text_image = self.font_normal.render("top scores:",1,self.font_color)
-    self.scores_image.blit(text_image,(0,0))
+    for enemy in level.activity.get_enemies_in_area(x,y,x + LevelEnvironment.VIEW_WIDTH,y + LevelEnvironment.VIEW_HEIGHT):
+      cell_x = int(enemy.position_x) - x
+      cell_y = int(enemy.position_y) - y
 
-    for i in range(min(3,len(self._level.scores))):
-      text_image = self.font_small.render(text_to_fixed_width(self._level.scores[i][0],10) + " " + text_to_fixed_width(str(self._level.scores[i][1]),6) + " " + text_to_fixed_width(self.__milliseconds_to_time(self._level.scores[i][2]),6),1,self.font_color)
-      self.scores_image.blit(text_image,(0,30 + (i + 1) * 20))
+      if 0 <= cell_x < LevelEnvironment.VIEW_WIDTH and 0 <= cell_y < LevelEnvironment.VIEW_HEIGHT:
+        view[cell_y,cell_x] = (MapGridObject.OBJECT_ENEMY_FLYING if enemy.enemy_type == Enemy.ENEMY_FLYING else MapGridObject.OBJECT_ENEMY_GROUND) + 1
 
-  ## Private method, checks if the tile at given position in the level
-  #  has a top layer (i.e. there is no other tile above it) and what
-  #  type.
-  #
-  #  @param x x position of the tile
-  #  @param y y position of the tile
-  #  @return a tree item tuple with boolean values (left, center, right)
+    velocity = player.force_computer.velocity_vector
+    self.observation["state"][:] = (player.position_x,player.position_y,velocity[0],velocity[1],player.state,player.facing_right,
+      level.eggs_left,level.coins_collected,level.clock / 1000.0,level.clock >= player.last_quack_time + Player.QUACK_COOLDOWN)
 
-  def __get_top_layer(self, x, y):
-    center = not MapGridObject.is_tile(self._level.get_at(x, y - 1))
-    left = not MapGridObject.is_tile(self._level.get_at(x, y - 1)) and not MapGridObject.is_tile(self._level.get_at(x - 1, y)) and not MapGridObject.is_tile(self._level.get_at(x - 1, y - 1))
-    right = not MapGridObject.is_tile(self._level.get_at(x, y - 1)) and not MapGridObject.is_tile(self._level.get_at(x + 1, y)) and not MapGridObject.is_tile(self._level.get_at(x + 1, y - 1))
+  ## Private method, makes the grid of the cell codes of the whole map
+  #  with the margins filled with the outside cells.
 
-    return (left,center,right)
+  def __make_grid(self):
+    level = self.level
+    outside = LevelEnvironment.CELL_OUTSIDE if level.outside_tile != None else LevelEnvironment.CELL_EMPTY
+    result = numpy.full((level.height + 2 * self.margin_y,level.width + 2 * self.margin_x),outside,numpy.uint8)
 
-  ## Private method, computes the screen pixel coordinates out of given
-  #  map square coordinates (float) taking camera position into account.
-  #
-  #  @param x x map position in tiles (double)
-  #  @param y y map position in tiles (double)
-  #  @return (x,y) tuple of pixel screen coordinates
+    for x in range(level.width):
+      for y in range(level.height):
+        map_grid_object = level.map_array[x][y]
+        result[y + self.margin_y,x + self.margin_x] = LevelEnvironment.CELL_EMPTY if map_grid_object == None else map_grid_object.object_type + 1
 
-  def __map_position_to_screen_position(self, x, y):
-    return (x * Renderer.TILE_WIDTH - self._camera_x,y * Renderer.TILE_HEIGHT - self._camera_y)
+    return result
 
-  ## Renders given menu.
+  ## Loads the level of the environment, call reset to start an episode.
   #
-  #  @param menu menu screen to be rendered (Menu)
-  #  @return image (Surface) with the menu rendered
+  #  @param filename level file name
+  #  @param action_repeat number of simulation steps an action is held
+  #  @param step_time simulation step length in milliseconds
+  #  @param max_time see MAX_TIME
+  #  @param observation dict of arrays made by make_observation to write
+  #         the observations to, e.g. a slot of a shared batch, or None
+  #         to make new ones
+
+  def __init__(self, filename, action_repeat = 1, step_time = STEP_TIME, max_time = MAX_TIME, observation = None):
+    if numpy == None:
+      raise ImportError("the environment needs numpy")
+
+    self.level = Level()
+    self.level.load_from_file(filename)
+    self.start_state = self.level.save_state()
+    self.action_repeat = action_repeat
+    self.step_time = step_time
+    self.max_time = max_time
+    self.observation = observation if observation != None else LevelEnvironment.make_observation()
+    self.margin_x = LevelEnvironment.VIEW_WIDTH
+    self.margin_y = LevelEnvironment.VIEW_HEIGHT
+    ## map cell codes as [y,x] with margins, the picked up objects are
+    #  cleared during the episode
+    self.start_grid = self.__make_grid()
+    self.grid = self.start_grid.copy()
+    ## number of the removed objects already cleared in the grid
+    self.removed_count = 0
+    ## seed of the next episode
+    self.seed = 0
+    self.last_score = 0
+    self.last_eggs = 0
+
+## Runs a group of environments in a worker process of
+#  VectorLevelEnvironment. The observations, actions and results are
+#  exchanged in the shared memory, the connection only carries the
+#  commands and their acknowledgements.
+#
+#  @param connection multiprocessing connection to the main process
+#  @param filenames level file names of the environments
+#  @param first index of the group's first environment in the batch
+#  @param buffers the shared arrays (see VectorLevelEnvironment)
+#  @param action_repeat see LevelEnvironment
+
+def run_environments(connection, filenames, first, buffers, action_repeat):
+  arrays = VectorLevelEnvironment.get_arrays(buffers)
+  environments = []
+
+  for i in range(len(filenames)):
+    index = first + i
+    environments.append(LevelEnvironment(filenames[i],action_repeat,observation = {"map": arrays["map"][index],"state": arrays["state"][index]}))
+
+  while True:
+    command, argument = connection.recv()
+
+    if command == "reset":
+      for i in range(len(environments)):
+        environments[i].reset(None if argument == None else argument + first + i)
+    elif command == "step":
+      for i in range(len(environments)):
+        index = first + i
+        environment = environments[i]
+        observation, reward, terminated, truncated, info = environment.step(arrays["actions"][index])
+        arrays["rewards"][index] = reward
+        arrays["terminated"][index] = terminated
+        arrays["truncated"][index] = truncated
+        arrays["scores"][index] = info["score"]
+
+        if terminated or truncated:
+          environment.reset()
+    else:
+      break
 
-  def render_menu(self, menu):
-    result = pygame.Surface((self.screen_width,self.screen_height))
-    result.fill((255,255,255))
+    connection.send(True)
 
-    result.blit(self.logo_image,(self.screen_width / 2 - self.logo_image.get_width() / 2,self.screen_height / 2 - self.logo_image.get_height() / 2))
+## Steps a batch of LevelEnvironments in lockstep, split among worker
+#  processes. The results are returned as NumPy arrays with the
+#  environment index as the first dimension, they live in the shared
+#  memory and are overwritten by the next step. The environments whose
+#  episode has ended are reset right away, their observation is then
+#  the first one of the next episode.
 
-    i = 0
+class VectorLevelEnvironment:
+  ## Makes NumPy views of the shared arrays.
+  #
+  #  @param buffers dict of multiprocessing.RawArray
+  #  @return dict of NumPy arrays
 
-    while i < len(menu.items):
-      text_image = self.font_normal.render(menu.items[i],1,(0,0,0))
-      result.blit(text_image,(100,100 + i * 40))
+  @staticmethod
+  def get_arrays(buffers):
+    count = len(buffers["rewards"])
+
+    return {
+      "map": numpy.frombuffer(buffers["map"],numpy.uint8).reshape((count,LevelEnvironment.VIEW_HEIGHT,LevelEnvironment.VIEW_WIDTH)),
+      "state": numpy.frombuffer(buffers["state"],numpy.float32).reshape((count,LevelEnvironment.STATE_SIZE)),
+      "actions": numpy.frombuffer(buffers["actions"],numpy.int32),
+      "rewards": numpy.frombuffer(buffers["rewards"],numpy.float32),
+      "terminated": numpy.frombuffer(buffers["terminated"],numpy.bool_),
+      "truncated": numpy.frombuffer(buffers["truncated"],numpy.bool_),
+      "scores": numpy.frombuffer(buffers["scores"],numpy.int32)
+      }
+
+  def __command(self, command, argument = None):
+    for connection in self.connections:
+      connection.send((command,argument))
+
+    for connection in self.connections:
+      connection.recv()
+
+  ## Starts new episodes in all the environments.
+  #
+  #  @param seed the environment i is seeded with seed + i, None
+  #         continues with the next seeds
+  #  @return observation dict of (count,...) arrays
 
-      if i == menu.selected_item:
-        result.blit(self.arrow_image,(50,95 + i * 40))
+  def reset(self, seed = None):
+    self.__command("reset",seed)
+    return self.observation
 
-      i += 1
+  ## Applies one action in each environment.
+  #
+  #  @param actions sequence of the action indices (see
+  #         LevelEnvironment.ACTIONS), one per environment
+  #  @return tuple (observation, rewards, terminated, truncated, info
+  #          dict with the "score" array) of arrays
 
-    i = 0
+  def step(self, actions):
+    self.arrays["actions"][:] = actions
+    self.__command("step")
+    return (self.observation,self.arrays["rewards"],self.arrays["terminated"],self.arrays["truncated"],{"score": self.arrays["scores"]})
 
-    while i < len(menu.text_lines):
-      text_image = self.font_small.render(menu.text_lines[i],1,(0,0,0))
-      result.blit(text_image,(100,self.screen_height / 2 + i * 30))
-      i += 1
+  ## Stops the worker processes.
 
-    return result
+  def close(self):
+    for connection in self.connections:
+      connection.send(("close",None))
+
+    for process in self.processes:
+      process.join()
+
+    self.connections = []
+    self.processes = []
 
-  ## Renders the level (without GUI).
+  ## Starts the worker processes with their environments.
   #
-  #  @return image with rendered level (pygame.Surface)
+  #  @param filenames level file names, the environment i plays the
+  #         level i modulo their count
+  #  @param count number of the environments
+  #  @param workers number of the worker processes, by default the
+  #         number of CPUs
+  #  @param action_repeat see LevelEnvironment
+
+  def __init__(self, filenames, count, workers = None, action_repeat = 1):
+    if numpy == None:
+      raise ImportError("the environment needs numpy")
+
+    self.count = count
+    workers = max(1,min(count,workers if workers != None else multiprocessing.cpu_count()))
+    view_size = LevelEnvironment.VIEW_WIDTH * LevelEnvironment.VIEW_HEIGHT
+    buffers = {
+      "map": multiprocessing.RawArray("B",count * view_size),
+      "state": multiprocessing.RawArray("f",count * LevelEnvironment.STATE_SIZE),
+      "actions": multiprocessing.RawArray("i",count),
+      "rewards": multiprocessing.RawArray("f",count),
+      "terminated": multiprocessing.RawArray("B",count),
+      "truncated": multiprocessing.RawArray("B",count),
+      "scores": multiprocessing.RawArray("i",count)
+      }
+    self.arrays = VectorLevelEnvironment.get_arrays(buffers)
+    ## observation dict of all the environments
+    self.observation = {"map": self.arrays["map"],"state": self.arrays["state"]}
+    self.connections = []
+    self.processes = []
+
+    for i in range(workers):
+      first = count * i // workers
+      end = count * (i + 1) // workers
+      connection, worker_connection = multiprocessing.Pipe()
+      process = multiprocessing.Process(target = run_environments,
+        args = (worker_connection,[filenames[index % len(filenames)] for index in range(first,end)],first,buffers,action_repeat))
+      process.daemon = True
+      process.start()
+      self.connections.append(connection)
+      self.processes.append(process)
 
-  def render_level(self):
-    result = pygame.Surface((self.screen_width,self.screen_height))
-    result.fill(self._level.background_color)
+#-----------------------------------------------------------------------
 
-    animation_frame = int(pygame.time.get_ticks() / 64)
+## Records the inputs of a level run so that the run can be replayed by
+#  the verification service. The steps are stored run-length encoded.
 
-    # draw the background image:
+class ReplayRecorder:
+  MIN_STEP_TIME = 1            # shortest simulation step accepted by ReplayVerifier in milliseconds
+  MAX_STEP_TIME = 1000         # longest simulation step accepted by ReplayVerifier in milliseconds
 
-    for i in range(self.background_repeat_times):
-      result.blit(self.background_image,(i * self.background_image.get_width(),0))
+  ## Records one simulation step.
+  #
+  #  @param controls combination of Controls flags
+  #  @param step_time step length in milliseconds
 
-    # draw the tiles and map object:
-    for j in range(self.visible_tile_area[1],self.visible_tile_area[3]):  # render only visible area
-      for i in range(self.visible_tile_area[0],self.visible_tile_area[2]):
-        map_grid_object = self._level.get_at(i,j)
+  def record(self, controls, step_time):
+    if len(self.steps) > 0 and self.steps[-1][0] == controls and self.steps[-1][1] == step_time:
+      self.steps[-1][2] += 1
+    else:
+      self.steps.append([controls,step_time,1])
 
-        if map_grid_object == None:
-          continue
-        else:
-          x = i * Renderer.TILE_WIDTH - self._camera_x
-          y = j * Renderer.TILE_HEIGHT - self._camera_y
+  ## Makes a submission of the recorded run for the verification
+  #  service.
+  #
+  #  @param level the level the run has been played in, its score and
+  #         time are claimed (Level)
+  #  @param name player name
+  #  @return dict that can be sent as JSON
 
-          if map_grid_object.object_type == MapGridObject.OBJECT_TILE:
-            result.blit(self.tile_images[map_grid_object.tile_id][map_grid_object.tile_variant],(x,y))
+  def make_submission(self, level, name):
+    return {"level": self.level_hash,"seed": self.seed,"name": name,"score": level.score,"time": level.time,"steps": self.steps}
 
-            top_layer = self.__get_top_layer(i,j)
+  ## Saves the recorded run as a JSON file in the submission format, so
+  #  that it can be replayed (e.g. by ReplayExporter).
+  #
+  #  @param filename output file name
+  #  @param level see make_submission
+  #  @param name player name
 
-            if top_layer[0]:   # left
-              result.blit(self.tile_images[map_grid_object.tile_id][0].left,(x - Renderer.TOP_LAYER_LEFT_WIDTH,y - Renderer.TOP_LAYER_OFFSET))
+  def save(self, filename, level, name):
+    output_file = open(filename,"w")
+    json.dump(self.make_submission(level,name),output_file)
+    output_file.close()
 
-            if top_layer[1]:   # center
-              result.blit(self.tile_images[map_grid_object.tile_id][0].center,(x,y - Renderer.TOP_LAYER_OFFSET))
+  ## Initialises a new recorder.
+  #
+  #  @param level_hash content hash of the level (see
+  #         Level.get_content_hash)
+  #  @param seed seed of the level random generator
+
+  def __init__(self, level_hash, seed):
+    self.level_hash = level_hash
+    self.seed = seed
+    ## recorded steps in format [controls, step time, count]
+    self.steps = []
+
+## levels loaded by a verification worker process, items are tuples
+#  (Level, start state) indexed by the file name
+verification_levels = {}
+
+## Replays a run headless, it is executed in the verification worker
+#  processes. Each level is loaded only once per process and reset to
+#  its start state for every replay.
+#
+#  @param filename level file name
+#  @param seed seed of the level random generator
+#  @param steps run steps in format (controls, step time, count)
+#  @return tuple (level state, time, score) at the end of the replay
+
+def replay_run(filename, seed, steps):
+  if not filename in verification_levels:
+    level = Level()
+    level.load_from_file(filename)
+    verification_levels[filename] = (level,level.save_state())
+
+  level, start_state = verification_levels[filename]
+  level.load_state(start_state)
+  level.random.seed(seed)
+
+  for step in steps:
+    for i in range(step[2]):
+      level.step(step[0],step[1])
+
+      if level.state != Level.STATE_PLAYING:
+        break
 
-            if top_layer[2]:   # right
-              result.blit(self.tile_images[map_grid_object.tile_id][0].right,(x + Renderer.TILE_WIDTH,y - Renderer.TOP_LAYER_OFFSET))
+    if level.state != Level.STATE_PLAYING:
+      break
 
-          elif map_grid_object.object_type == MapGridObject.OBJECT_SPIKES:
-            result.blit(self.spikes_image,(x,y))
-          elif map_grid_object.object_type == MapGridObject.OBJECT_EGG:
-            result.blit(self.egg_image,(x + 50,y + 50))
-          elif map_grid_object.object_type == MapGridObject.OBJECT_COIN:
-            result.blit(self.coin_images[animation_frame % len(self.coin_images)],(x + 20,y))
-          elif map_grid_object.object_type == MapGridObject.OBJECT_TRAMPOLINE:
-            result.blit(self.trampoline_image,(x,y))
-          elif map_grid_object.object_type == MapGridObject.OBJECT_FINISH:
-            if self._level.eggs_left > 0:
-              result.blit(self.teleport_inactive_image,(x,y))
-            else:
-              result.blit(self.teleport_active_image,(x,y))
+  return (level.state,level.time,level.score)
 
-    # draw the player:
+## Verifies submitted level runs by replaying them in a pool of worker
+#  processes and saves the scores of the runs whose replay matches the
+#  claimed result. The number of runs waiting for the verification is
+#  bounded, the submissions over the limit are refused.
 
-    player_position = self.__map_position_to_screen_position(self._level.player.position_x,self._level.player.position_y)
+class ReplayVerifier:
+  MAX_PENDING = 256            # maximum number of runs being verified at once
+  MAX_RUN_TIME = 1800000       # longest accepted run in milliseconds
+  MAX_STEPS = 500000           # most simulation steps of an accepted run (a half hour run at over 270 frames/s)
+  RESULT_TIMEOUT = 60          # in seconds
+  THROUGHPUT_WINDOW = 10000    # period the throughput is computed over in milliseconds
 
-    player_image = self.player_images.standing[0]
+  ## Private method, checks the format of a submission.
+  #
+  #  @param submission decoded JSON submission
+  #  @return error description (string) or None if the submission is
+  #          valid
 
-    if self._level.player.flapping_wings:
-      flapping_animation_frame = animation_frame % 2
-    else:
-      flapping_animation_frame = 0
+  def __check_submission(self, submission):
+    if not isinstance(submission,dict):
+      return "submission is not an object"
 
-    if pygame.time.get_ticks() < self._level.player.last_quack_time + Renderer.QUACK_LENGTH:
-      if self._level.player.facing_right:
-        player_image = self.player_images.special[0]
-      else:
-        player_image = self.player_images.special[1]
-    elif self._level.player.state == Player.PLAYER_STATE_STANDING:
-      if self._level.player.facing_right:
-        player_image = self.player_images.standing[0]
-      else:
-        player_image = self.player_images.standing[1]
-    elif self._level.player.state == Player.PLAYER_STATE_WALKING:
-      if self._level.player.facing_right:
-        player_image = self.player_images.moving_right[animation_frame % len(self.player_images.moving_right)]
-      else:
-        player_image = self.player_images.moving_left[animation_frame % len(self.player_images.moving_right)]
-    elif self._level.player.state == Player.PLAYER_STATE_JUMPING_UP:
-      if self._level.player.facing_right:
-        player_image = self.player_images.jumping[flapping_animation_frame]
-      else:
-        player_image = self.player_images.jumping[4 + flapping_animation_frame]
-    elif self._level.player.state == Player.PLAYER_STATE_JUMPING_DOWN:
-      if self._level.player.facing_right:
-        player_image = self.player_images.jumping[3 - flapping_animation_frame]
-      else:
-        player_image = self.player_images.jumping[7 - flapping_animation_frame]
+    if not submission.get("level") in self.levels:
+      return "unknown level"
 
-    result.blit(player_image,(player_position[0] - player_image.get_width() / 2,player_position[1] - player_image.get_height() / 2))
+    name = submission.get("name")
 
-    # draw the enemies:
+    if not isinstance(name,str) or len(name) == 0 or len(name) > 32 or len(name.split()) != 1:
+      return "invalid name"
 
-    for enemy in self._level.enemies:
-      enemy_position = self.__map_position_to_screen_position(enemy.position_x,enemy.position_y)
+    for key in ("seed","score","time"):
+      if not isinstance(submission.get(key),int):
+        return "invalid " + key
 
-      if enemy.enemy_type == Enemy.ENEMY_GROUND:
-        if enemy.force_computer.velocity_vector[0] > 0.5:
-          enemy_image = self.enemy_ground_images[1]
-        elif enemy.force_computer.velocity_vector[0] < -0.5:
-          enemy_image = self.enemy_ground_images[2]
-        else:
-          enemy_image = self.enemy_ground_images[0]
-      else:
-        enemy_image = self.enemy_flying_images[animation_frame % 3]
+    steps = submission.get("steps")
 
-      result.blit(enemy_image,(enemy_position[0] - enemy_image.get_width() / 2,enemy_position[1] - enemy_image.get_height() / 2))
+    if not isinstance(steps,list):
+      return "invalid steps"
 
-    # draw the GUI:
+    run_time = 0.0
+    step_count = 0
 
-    line_height = 30
+    for step in steps:
+      if (not isinstance(step,list) or len(step) != 3 or not isinstance(step[0],int) or not isinstance(step[1],(int,float)) or
+        not isinstance(step[2],int) or not ReplayRecorder.MIN_STEP_TIME <= step[1] <= ReplayRecorder.MAX_STEP_TIME or step[2] < 1):
+        return "invalid step"
 
-   # result.blit(self.score_bar_image,(22,20))
-    text_image = self.font_normal.render("time: " + self.__milliseconds_to_time(self._level.time),1,self.font_color)
-    result.blit(text_image,(50,50))
-    text_image = self.font_normal.render("score: " + str(self._level.score),1,self.font_color)
-    result.blit(text_image,(50,50 + line_height))
-    result.blit(self.scores_image,(self.screen_width - 300,50))
+      run_time += step[1] * step[2]
+      step_count += step[2]
 
-    if self._level.state == Level.STATE_LOST:
-      text_image = self.font_normal.render("you lost",1,(255,0,0))
-      result.blit(text_image,(self.screen_width / 2 - text_image.get_width() / 2,self.screen_height / 2 - text_image.get_height() / 2))
-    elif self._level.state == Level.STATE_WON:
-      text_image = self.font_normal.render("you won",1,(0,255,0))
-      result.blit(text_image,(self.screen_width / 2 - text_image.get_width() / 2,self.screen_height / 2 - text_image.get_height() / 2))
+      if run_time > ReplayVerifier.MAX_RUN_TIME or step_count > ReplayVerifier.MAX_STEPS:
+        return "run too long"
 
-    return result
+    return None
 
-  ## Sets the camera center position.
+  ## Private method, makes a digest identifying the run of a valid
+  #  submission regardless of the player name. The steps are normalised
+  #  (step times as floats, the same consecutive steps merged), so that
+  #  the same run can't be submitted again in a different form.
   #
-  #  @param camera_x x coordinate in pixels
-  #  @param camera_y y coordinate in pixels
-
-  def set_camera_position(self, camera_x, camera_y):
-    self._camera_x = camera_x - self.screen_width / 2
-    self._camera_y = camera_y - self.screen_width / 2
+  #  @param submission valid decoded JSON submission
+  #  @return digest string
 
-    helper_x = int(self._camera_x / Renderer.TILE_WIDTH)
-    helper_y = int(self._camera_y / Renderer.TILE_HEIGHT)
+  @staticmethod
+  def __get_run_digest(submission):
+    steps = []
 
-    self.visible_tile_area = (helper_x,helper_y,helper_x + self.screen_width_tiles,helper_y + self.screen_height_tiles)
+    for step in submission["steps"]:
+      if len(steps) > 0 and steps[-1][0] == step[0] and steps[-1][1] == float(step[1]):
+        steps[-1][2] += step[2]
+      else:
+        steps.append([step[0],float(step[1]),step[2]])
 
-  def __init__(self, screen_width, screen_height):
-    self.__init_attributes()
-    self.screen_width = screen_width
-    self.screen_height = screen_height
-    self.screen_width_tiles = int(math.ceil(self.screen_width / Renderer.TILE_WIDTH)) + 2
-    self.screen_height_tiles = int(math.ceil(self.screen_height / Renderer.TILE_HEIGHT)) + 2
-    return
+    return hashlib.sha1(json.dumps([submission["level"],submission["seed"],steps]).encode("utf-8")).hexdigest()
 
-#-----------------------------------------------------------------------
+  ## Verifies a submitted run and saves its score if it's valid, this
+  #  blocks until the replay is done.
+  #
+  #  @param submission decoded JSON submission
+  #  @return tuple (HTTP status, response dict)
 
-## A decorator that moves given movable object acoording to forces it
-#  computes.
+  def submit(self, submission):
+    error = self.__check_submission(submission)
+    digest = ReplayVerifier.__get_run_digest(submission) if error == None else None
 
-class ForceComputer:
-  def __init_attributes(self):
-    ## reference to decorated object (Movable)
-    self.decorated_object = None
+    with self.lock:
+      self.counts["submitted"] += 1
 
-    ## velocity in tiles per second
-    self.velocity_vector = [0,0]
+      if error != None:
+        self.counts["invalid"] += 1
+        return (400,{"accepted": False,"reason": error})
 
-    ## acceleration in tiles per second squared
-    self.acceleration_vector = [0,0]
+      if digest in self.run_digests:
+        self.counts["duplicate"] += 1
+        return (200,{"accepted": False,"reason": "run already submitted"})
 
-    ## maximum speed that will be assigned int horizontal direction
-    self.maximum_horizontal_speed = 3
+      if self.pending >= self.max_pending:
+        self.counts["refused"] += 1
+        return (503,{"accepted": False,"reason": "too many pending runs"})
 
+      self.pending += 1
+      self.run_digests.add(digest)     # reserved now, so that a copy sent meanwhile isn't verified too
 
-    ## says how much of the horizontal speed will be converted to
-    #  acceleration in opposite direction
-    self.ground_friction = 5
+    time_start = get_precise_time()
 
-  ## Applies the forces to the decorated object and computes new forces.
-  #
+    try:
+      filename = self.levels[submission["level"]].filename
+      steps = [(step[0],float(step[1]),step[2]) for step in submission["steps"]]
+      state, run_time, score = self.pool.apply_async(replay_run,(filename,submission["seed"],steps)).get(ReplayVerifier.RESULT_TIMEOUT)
+    except Exception:
+      state = None
+    finally:
+      time_now = get_precise_time()
+
+      with self.lock:
+        self.pending -= 1
+        self.verification_times.add(time_now - time_start)
+        self.finished.append((time_now,sum(step[2] for step in submission["steps"])))
+
+    if state == None:
+      reason = "replay failed"
+    elif state != Level.STATE_WON:
+      reason = "level not finished in the replay"
+    elif run_time != submission["time"] or score != submission["score"]:
+      reason = "replay result differs: time " + str(run_time) + ", score " + str(score)
+    else:
+      reason = None
 
-  def execute_step(self):
-    if frame_time == 0:    # we don't want to be diving by zero
-      return
+    with self.lock:
+      if reason != None:
+        self.counts["rejected"] += 1
+        self.run_digests.discard(digest)
+        return (200,{"accepted": False,"reason": reason})
 
-    seconds = frame_time / 1000.0
+      self.counts["accepted"] += 1
+      level = self.levels[submission["level"]]
+      level.add_score(submission["name"],run_time,score)
+      level.save_scores()
 
-    object_position = (self.decorated_object.position_x,self.decorated_object.position_y)
-    self.decorated_object.move_by(self.velocity_vector[0] * seconds,self.velocity_vector[1] * seconds)
-    object_position2 = (self.decorated_object.position_x,self.decorated_object.position_y)
+    return (200,{"accepted": True,"reason": "time " + str(run_time) + ", score " + str(score)})
 
-    self.velocity_vector = [(object_position2[0] - object_position[0]) / seconds,(object_position2[1] - object_position[1]) / seconds]
+  ## Gets the service statistics including the throughput over the last
+  #  THROUGHPUT_WINDOW milliseconds.
+  #
+  #  @return dict
 
-    self.velocity_vector[0] += (self.acceleration_vector[0] - self.velocity_vector[0] * self.ground_friction) * seconds
-    self.velocity_vector[1] += self.acceleration_vector[1] * seconds
+  def get_stats(self):
+    with self.lock:
+      window_start = get_precise_time() - ReplayVerifier.THROUGHPUT_WINDOW
 
-  def __init__(self, decorated_object):
-    self.__init_attributes()
-    self.decorated_object = decorated_object
+      while len(self.finished) > 0 and self.finished[0][0] < window_start:
+        self.finished.popleft()
 
-#-----------------------------------------------------------------------
+      result = dict(self.counts)
+      result["pending"] = self.pending
+      result["runs per second"] = len(self.finished) * 1000.0 / ReplayVerifier.THROUGHPUT_WINDOW
+      result["steps per second"] = sum(item[1] for item in self.finished) * 1000.0 / ReplayVerifier.THROUGHPUT_WINDOW
+      result["verification [ms]"] = self.verification_times.get_summary()
 
-## Represents a menu screen.
+    return result
 
-class Menu:
-  def __init__(self):
-    ## list of menu items
-    self.items = []
-    ## index of the selected item
-    self.selected_item = 0
-    ## optional text to be displayed in the menu
-    self.text_lines = []
+  ## Serves the HTTP requests until interrupted: POST /submit with a JSON
+  #  submission (see ReplayRecorder.make_submission) and GET /stats.
+  #
+  #  @param port port to listen on (localhost only)
 
-  def cursor_up(self):
-    self.selected_item = max(self.selected_item - 1,0)
+  def serve(self, port):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1",port),ReplayVerifierRequestHandler)
+    server.daemon_threads = True
+    server.request_queue_size = self.max_pending
+    server.verifier = self
+    print("verifying runs of " + str(len(self.levels)) + " levels on http://127.0.0.1:" + str(port) + " with " + str(self.workers) + " workers")
 
-  def cursor_down(self):
-    self.selected_item = min(self.selected_item + 1,len(self.items) - 1)
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+      self.pool.terminate()
+
+  ## Initialises the verifier.
+  #
+  #  @param filenames level files whose runs can be submitted, the
+  #         accepted scores are saved into them
+  #  @param workers number of worker processes, None means the number
+  #         of CPUs
+  #  @param max_pending maximum number of runs being verified at once
+
+  def __init__(self, filenames, workers = None, max_pending = MAX_PENDING):
+    ## levels indexed by their content hash, only used to keep the scores
+    self.levels = {}
+
+    for filename in filenames:
+      level = Level()
+      level.load_from_file(filename,False)
+      self.levels[Level.get_content_hash(filename)] = level
+
+    self.workers = workers if workers != None else multiprocessing.cpu_count()
+    self.max_pending = max_pending
+    self.pool = multiprocessing.Pool(self.workers)
+    self.lock = threading.Lock()
+    ## number of runs being verified
+    self.pending = 0
+    self.counts = {"submitted": 0,"accepted": 0,"rejected": 0,"invalid": 0,"duplicate": 0,"refused": 0}
+    ## digests of the accepted runs and of the runs being verified, see
+    #  __get_run_digest
+    self.run_digests = set()
+    ## finished verifications in format (time, number of replayed steps)
+    self.finished = collections.deque()
+    self.verification_times = Histogram(Histogram.DEFAULT_BOUNDS)
+
+## Handles the HTTP requests of the ReplayVerifier service.
+
+class ReplayVerifierRequestHandler(http.server.BaseHTTPRequestHandler):
+  MAX_BODY_SIZE = 4194304
+
+  def do_POST(self):
+    if self.path != "/submit":
+      self.__respond(404,{"reason": "not found"})
+      return
 
-#-----------------------------------------------------------------------
+    length = int(self.headers.get("Content-Length",0))
 
-class Config:
-  def __init__(self, filename):
-    self.sound = True
-    self.fullscreen = False
-    self.name = "player"
+    if length > ReplayVerifierRequestHandler.MAX_BODY_SIZE:
+      self.__respond(413,{"accepted": False,"reason": "submission too large"})
+      return
 
     try:
-      lines = [line.strip() for line in open(filename)]
+      submission = json.loads(self.rfile.read(length).decode("utf-8"))
+    except ValueError:
+      self.__respond(400,{"accepted": False,"reason": "invalid JSON"})
+      return
 
-      for line in lines:
-        line_split = line.split(":")
-        line_split[0] = line_split[0].lstrip().rstrip()
-        line_split[1] = line_split[1].lstrip().rstrip()
+    self.__respond(*self.server.verifier.submit(submission))
 
-        if line_split[0] == "sound":
-          self.sound = line_split[1] == "yes"
-        elif line_split[0] == "fullscreen":
-          self.fullscreen = line_split[1] == "yes"
-        elif line_split[0] == "name":
-          self.sound = line_split[1]
+  def do_GET(self):
+    if self.path != "/stats":
+      self.__respond(404,{"reason": "not found"})
+      return
 
-    except Exception:    # make a new config file
-      output_file = open(filename,'w')
-      output_file.write("name: player\nfullscreen: no\nsound: yes\n")
-      output_file.close()
+    self.__respond(200,self.server.verifier.get_stats())
+
+  def log_message(self, format, *args):
+    pass     # the requests are not logged, there are too many of them
+
+  def __respond(self, status, content):
+    body = json.dumps(content).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type","application/json")
+    self.send_header("Content-Length",str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
 
 #-----------------------------------------------------------------------
 
-## The main game class handling the inpu management, calling renderer,
-#  the main game loop etc.
+## Writes the frames received from a queue, it is executed in the
+#  ReplayExporter worker processes. None in the queue ends the worker.
+#
+#  @param queue multiprocessing.Queue of (frame index, RGB pixel data)
+#  @param output directory for the PNG sequence or the raw video file
+#  @param raw whether the frames are appended to a raw RGB24 video file
+#         instead of saved as PNG images
+#  @param size (width,height) of the frames in pixels
 
-class Game:
-  STATE_MENU_MAIN = 0
-  STATE_MENU_ABOUT = 1
-  STATE_MENU_PLAY = 2
-  STATE_IN_GAME = 3
-  VERSION = "1.1"
+def write_frames(queue, output, raw, size):
+  output_file = open(output,"wb") if raw else None
 
-  FLYING_FORCE = 2    # what number is substracted from gravity when flapping the ducks wings
+  while True:
+    item = queue.get()
 
-  UPDATE_STATE_AFTER_FRAMES = 7
+    if item == None:
+      break
 
-  ## Initialises a new game.
+    if raw:
+      output_file.write(item[1])
+    else:
+      pygame.image.save(pygame.image.frombuffer(item[1],size,"RGB"),os.path.join(output,"frame_%06d.png" % item[0]))
+
+  if output_file != None:
+    output_file.close()
+
+## Renders recorded runs (see ReplayRecorder.save) headless into an
+#  offscreen surface and exports them as a PNG sequence or a raw video.
+#  The frames are encoded in worker processes that receive them through
+#  a bounded queue, so the rendering and the encoding overlap and the
+#  rendering waits only when the encoders fall behind.
+
+class ReplayExporter:
+  QUEUE_SIZE = 16            # maximum number of frames waiting for the encoding
+
+  ## Private method, finds the level file a run has been played in.
   #
-  #  @param name player name (string)
-  #  @param fullscreen whether the game will be in fullscreen or not (boolean)
-  #  @param sounds whether sounds and music will be played
+  #  @param level_hash content hash of the level (see
+  #         Level.get_content_hash)
+  #  @return file name or None if no level matches
 
-  def __init__(self, name, fullscreen, sound):
-    ## the player's name
-    self.name = name
-    self.fullscreen = fullscreen
-    self.sound = sound
-    self.state = Game.STATE_MENU_MAIN
-    screen_width = 1024
-    screen_height = 640
+  def __find_level(self, level_hash):
+    for filename in self.level_filenames:
+      if Level.get_content_hash(filename) == level_hash:
+        return filename
 
-    if sound:
-      pygame.mixer.pre_init(22050,-16,2,512)   # smaller size of the buffer (512) prevents the audio from lagging
+    return None
 
-    pygame.init()
+  ## Private method, renders the current state of the level and passes
+  #  the frame to the encoders.
+  #
+  #  @param level the replayed level
 
-    os.environ['SDL_VIDEO_WINDOW_POS'] = "%d,%d" % (100,50)  # set the screen position
+  def __capture(self, level):
+    if level.state != Level.STATE_LOST:
+      self.renderer.set_camera_to_player()
 
-    if self.fullscreen:
-      fullscreen_size = (pygame.display.list_modes())[0]
+    self.renderer.render_level()
+    self.renderer.draw()
+    pixels = pygame.image.tobytes(self.backend.get_frame(),"RGB")
+    time_start = get_precise_time()
+    self.queue.put((self.frames,pixels))
+    self.queue_wait += get_precise_time() - time_start
+    self.frames += 1
 
-      if fullscreen_size != -1:
-        screen_width = fullscreen_size[0]
-        screen_height = fullscreen_size[1]
+  ## Exports a recorded run.
+  #
+  #  @param filename replay file (see ReplayRecorder.save)
+  #  @return number of exported frames
+
+  def export(self, filename):
+    replay = json.load(open(filename))
+    level_filename = self.__find_level(replay["level"])
+
+    if level_filename == None:
+      raise ValueError("the level of the replay hasn't been found")
+
+    os.environ["SDL_VIDEODRIVER"] = "dummy"     # no window is opened, the display is only needed to convert the images
+    pygame.display.init()
+    pygame.font.init()
+    level = Level()
+    level.load_from_file(level_filename)
+    level.random.seed(replay["seed"])
+    level.particles = ParticleSystem()
+    self.renderer = Renderer(self.size[0],self.size[1],self.backend)
+    self.renderer.synchronous_chunks = True
+    self.renderer.set_level(level)
+
+    if not self.raw and not os.path.isdir(self.output):
+      os.makedirs(self.output)
+
+    self.queue = multiprocessing.Queue(ReplayExporter.QUEUE_SIZE)
+    workers = [multiprocessing.Process(target = write_frames,args = (self.queue,self.output,self.raw,self.size)) for i in range(self.workers)]
+
+    for worker in workers:
+      worker.start()
+
+    self.frames = 0
+    self.queue_wait = 0
+    run_time = 0.0
+    self.__capture(level)
+
+    for step in replay["steps"]:
+      for i in range(step[2]):
+        if level.state != Level.STATE_PLAYING:
+          break
+
+        level.step(step[0],step[1])
+        level.particles.update(step[1])
+        run_time += step[1]
+
+        if self.fps <= 0:
+          self.__capture(level)
+        else:
+          while self.frames * 1000.0 / self.fps <= run_time:
+            self.__capture(level)
 
-      self.screen = pygame.display.set_mode((screen_width,screen_height),pygame.FULLSCREEN)
-    else:
-      self.screen = pygame.display.set_mode((screen_width,screen_height))
+    self.renderer.close()
 
-    pygame.display.set_caption("steamer duck")
-    pygame.mouse.set_visible(False)
-    self.sound_player = SoundPlayer(sound)
-    self.level = None
-    self.renderer = Renderer(screen_width,screen_height)
-    self.key_up = False
-    self.key_down = False
-    self.key_left = False
-    self.key_right = False
-    self.key_space = False
-    self.key_ctrl = False
-    self.key_return = False
-    self.key_escape = False
-    self.player_state_update_counter = 0    # the player state will be updated once every n frames,
-                                            # this will prevent the "jerky" sprite changing
-    self.menu_main = Menu()
-    self.menu_main.items.append("new game")
-    self.menu_main.items.append("about")
-    self.menu_main.items.append("exit")
+    for worker in workers:
+      self.queue.put(None)
 
-    self.menu_about = Menu()
-    self.menu_about.items.append("back")
-    self.menu_about.text_lines.append("Miloslav Ciz, 2015")
-    self.menu_about.text_lines.append("version " + Game.VERSION)
-    self.menu_about.text_lines.append("powered by Python + Pygame")
-    self.menu_about.text_lines.append("your name is set to: " + self.name)
+    for worker in workers:
+      worker.join()
 
-    self.menu_about.text_lines.append("")
-    self.menu_about.text_lines.append("arrows = move")
-    self.menu_about.text_lines.append("ctrl = quack")
-    self.menu_about.text_lines.append("space = flap wings")
-    self.menu_about.text_lines.append("get all eggs and get to the teleport")
+    return self.frames
 
-    self.menu_play = Menu()
-    self.menu_play.items.append("level 1")
-    self.menu_play.items.append("level 2")
-    self.menu_play.items.append("level 3")
-    self.menu_play.items.append("level 4")
-    self.menu_play.items.append("level 5")
-    self.menu_play.items.append("level 6")
-    self.menu_play.items.append("level 7")
-    self.menu_play.items.append("level 8")
-    self.menu_play.items.append("back")
+  ## Initialises the exporter.
+  #
+  #  @param level_filenames level files the replayed runs are looked up
+  #         in
+  #  @param output directory for the PNG images or the raw video file
+  #  @param raw whether a raw RGB24 video is written instead of the PNG
+  #         images
+  #  @param workers number of encoding processes, None means the number
+  #         of CPUs, a raw video is always written by one process
+  #  @param fps frames per second of the video, 0 means one frame per
+  #         simulation step
+  #  @param size (width,height) of the frames in pixels
+
+  def __init__(self, level_filenames, output, raw = False, workers = None, fps = 0, size = (1024,640)):
+    self.level_filenames = level_filenames
+    self.output = output
+    self.raw = raw
+    self.workers = 1 if raw else (workers if workers != None else multiprocessing.cpu_count())
+    self.fps = fps
+    self.size = size
+    ## the frames are composed in an offscreen surface, no display is
+    #  needed
+    self.backend = SurfaceBackend(None,size)
+    self.renderer = None
+    self.queue = None
+    ## number of captured frames
+    self.frames = 0
+    ## time the rendering waited for the encoders in milliseconds
+    self.queue_wait = 0
 
-  ## Runs the game.
+#-----------------------------------------------------------------------
 
-  def run(self):
-    global frame_time
-    rendered_frame = None
-    done = False
-    wait = False     # whether the waiting is going on when the game is over
-    flapping_player = False
-    wait_until = 0
-    cheat = False
-    cheat_buffer = [0,0]
+## Makes a level with randomly generated platforms, it is used by the
+#  benchmarks.
+#
+#  @param width map width in tiles
+#  @param height map height in tiles
+#  @param seed random seed
+#  @param enemies number of enemies placed randomly in the level
+#  @return Level object
+
+def generate_random_level(width, height, seed = 0, enemies = 0):
+  generator = random.Random(seed)
+  result = Level()
+  result.width = width
+  result.height = height
+  result.map_array = [[None] * height for item in range(width)]
+  result.outside_tile = MapGridObject.get_instance_from_string("0;1")
+
+  for x in range(width):
+    result.map_array[x][height - 1] = MapGridObject.get_instance_from_string("0;1")
+
+  for y in range(3,height - 1,3):
+    x = generator.randint(0,4)
+
+    while x < width:
+      length = generator.randint(2,8)
+
+      for i in range(x,min(x + length,width)):
+        result.map_array[i][y] = MapGridObject.get_instance_from_string("0;1")
+
+      x += length + generator.randint(1,4)
+
+  result.add_player(0.5,height - 1.5)
+
+  for i in range(enemies):
+    result.enemies.append(Enemy(result,generator.choice((Enemy.ENEMY_FLYING,Enemy.ENEMY_GROUND))))
+    result.enemies[-1].position_x = generator.randint(0,width - 1) + 0.5
+    result.enemies[-1].position_y = generator.randint(0,height - 2) + 0.5
+  result.trigger_index.build()
+  result.trigger_trackers = [TriggerTracker(result.trigger_index,result.player)]
+  result.navigation_graph.build()
+  result.raycast_grid.build()
+  result.activity.build()
+  return result
 
-    while not done:
-      time_start = pygame.time.get_ticks()
+## Benchmarks the simulation step on maps of different sizes with the
+#  number of enemies growing with the map area and prints the results.
 
-      for event in pygame.event.get():
-        if event.type == pygame.QUIT: sys.exit()
+def benchmark_simulation():
+  print("map size     enemies   step [ms]")
 
-        if event.type == pygame.KEYDOWN:
-          if event.key == pygame.K_RIGHT:
-            self.key_right = True
-          elif event.key == pygame.K_UP:
-            self.key_up = True
-          elif event.key == pygame.K_LEFT:
-            self.key_left = True
-          elif event.key == pygame.K_DOWN:
-            self.key_down = True
-          elif event.key == pygame.K_SPACE:
-            self.key_space = True
-          elif event.key == pygame.K_RCTRL or event.key == pygame.K_LCTRL:
-            self.key_ctrl = True
-          elif event.key == pygame.K_RETURN:
-            self.key_return = True
-          elif event.key == pygame.K_ESCAPE:
-            self.key_escape = True
-          elif event.key == pygame.K_KP4:
-            cheat_buffer[0] = cheat_buffer[1]
-            cheat_buffer[1] = 4
-          elif event.key == pygame.K_KP2:
-            cheat_buffer[0] = cheat_buffer[1]
-            cheat_buffer[1] = 2
-            if cheat_buffer[0] == 4 and cheat_buffer[1] == 2:
-              self.sound_player.play_win()
-              cheat = True
-        elif event.type == pygame.KEYUP:
-          if event.key == pygame.K_RIGHT:
-            self.key_right = False
-          elif event.key == pygame.K_LEFT:
-            self.key_left = False
-          elif event.key == pygame.K_UP:
-            self.key_up = False
-          elif event.key == pygame.K_DOWN:
-            self.key_down = False
-          elif event.key == pygame.K_SPACE:
-            self.key_space = False
-          elif event.key == pygame.K_RCTRL or event.key == pygame.K_LCTRL:
-            self.key_ctrl = False
-          elif event.key == pygame.K_RETURN:
-            self.key_return = False
-          elif event.key == pygame.K_ESCAPE:
-            self.key_escape = False
+  for size in ((50,20),(200,50),(800,100),(2000,200)):
+    level = generate_random_level(size[0],size[1],enemies = size[0] * size[1] // 20)
+    level.step(Controls.NONE,1000.0 / 60.0)
+    time_start = get_precise_time()
 
-      if self.state == Game.STATE_IN_GAME:
-        if self.key_escape:
-          self.state = Game.STATE_MENU_MAIN
+    for i in range(200):
+      level.step(Controls.RIGHT,1000.0 / 60.0)
 
-        if self.level.state == Level.STATE_PLAYING:
-          if self.key_up:
-            if not self.level.player.state in [Player.PLAYER_STATE_JUMPING_UP, Player.PLAYER_STATE_JUMPING_DOWN] and not self.level.player.is_in_air():
-              self.level.player.jump()
+    step_time = (get_precise_time() - time_start) / 200
 
-          if self.key_right and not self.key_left:
-            self.level.player.force_computer.acceleration_vector[0] = 40 if cheat else 20.0
-          elif self.key_left and not self.key_right:
-            self.level.player.force_computer.acceleration_vector[0] = -40 if cheat else -20.0
-          else:
-            self.level.player.force_computer.acceleration_vector[0] = 0
+    print(text_to_fixed_width(str(size[0]) + "x" + str(size[1]),13) + text_to_fixed_width(str(len(level.enemies)),10) + "%.3f" % step_time)
 
-          if self.key_ctrl:
-            self.level.player.quack()
+## Measures the precise collision test against the box test on player
+#  and enemy pairs near each other in random animation frames, and the
+#  collision cost per simulation step on a large map.
 
-          if self.key_space:
-            if not flapping_played:
-              self.level.sound_player.play_flap()
-              flapping_played = True
+def benchmark_collisions():
+  if not collision_masks.load():
+    print("the collision masks couldn't be loaded")
+    return
 
-            self.level.player.flapping_wings = True
-          else:
-            flapping_played = False
-            self.level.player.flapping_wings = False
+  generator = random.Random(0)
+  level = generate_random_level(200,50,enemies = 500)
+  pairs = []
+
+  for i in range(10000):
+    player = Player(level)
+    player.position_x = generator.uniform(10,190)
+    player.position_y = generator.uniform(5,45)
+    player.state = generator.choice((Player.PLAYER_STATE_STANDING,Player.PLAYER_STATE_WALKING,Player.PLAYER_STATE_JUMPING_UP,Player.PLAYER_STATE_JUMPING_DOWN))
+    player.facing_right = generator.random() < 0.5
+    player.flapping_wings = generator.random() < 0.5
+    enemy = Enemy(level,generator.choice((Enemy.ENEMY_FLYING,Enemy.ENEMY_GROUND)))
+    enemy.position_x = player.position_x + generator.uniform(-2,2)
+    enemy.position_y = player.position_y + generator.uniform(-2,2)
+    enemy.force_computer.velocity_vector[0] = generator.uniform(-1,1)
+    pairs.append((player,enemy))
+
+  time_start = get_precise_time()
+  box_hits = sum(1 for player, enemy in pairs if player.collides(enemy))
+  box_time = get_precise_time() - time_start
+  collision_masks.mask_tests = 0
+  time_start = get_precise_time()
+  mask_hits = sum(1 for player, enemy in pairs if collision_masks.collide(player,enemy))
+  mask_time = get_precise_time() - time_start
+
+  print("test      per pair [us]   hits     mask tests")
+  print(text_to_fixed_width("box",10) + text_to_fixed_width("%.2f" % (box_time * 1000.0 / len(pairs)),16) + str(box_hits))
+  print(text_to_fixed_width("mask",10) + text_to_fixed_width("%.2f" % (mask_time * 1000.0 / len(pairs)),16) +
+    text_to_fixed_width(str(mask_hits),9) + str(collision_masks.mask_tests))
+
+  level.step(Controls.NONE,1000.0 / 60.0)
+  collision_masks.tests = 0
+  collision_masks.mask_tests = 0
+  steps = 200
+
+  for i in range(steps):
+    level.step(Controls.RIGHT,1000.0 / 60.0)
+
+  tests = collision_masks.tests / float(steps)
+  print("per step on 200x50 with %d enemies: %.2f tests, %.2f mask tests, %.4f ms" %
+    (len(level.enemies),tests,collision_masks.mask_tests / float(steps),tests * mask_time / len(pairs)))
+
+## Measures the line of sight checks from all the enemies to the
+#  player, one by one and batched, on maps of different sizes, without
+#  a distance limit and with a sight range.
+
+def benchmark_raycasts():
+  for sight_range in (None,16):
+    print("sight range: " + ("none" if sight_range == None else str(sight_range)))
+    benchmark_raycast_range(sight_range)
+
+## Prints one table of benchmark_raycasts.
+#
+#  @param sight_range maximum line of sight distance or None
+
+def benchmark_raycast_range(sight_range):
+  print("map size     enemies   single [ms]   batched [ms]   visible")
+
+  for size in ((50,20),(200,50),(800,100),(2000,200)):
+    level = generate_random_level(size[0],size[1],enemies = size[0] * size[1] // 20)
+    grid = level.raycast_grid
+    player = level.player
+    time_start = get_precise_time()
+    visible = sum(1 for enemy in level.enemies if grid.has_line_of_sight(enemy.position_x,enemy.position_y,player.position_x,player.position_y,sight_range))
+    single_time = get_precise_time() - time_start
+    batched_time = 0
+
+    if numpy != None:
+      enemies_x = numpy.array([enemy.position_x for enemy in level.enemies])
+      enemies_y = numpy.array([enemy.position_y for enemy in level.enemies])
+      time_start = get_precise_time()
+      grid.have_line_of_sight(enemies_x,enemies_y,numpy.full(enemies_x.shape,player.position_x),numpy.full(enemies_y.shape,player.position_y),sight_range)
+      batched_time = get_precise_time() - time_start
+
+    print(text_to_fixed_width(str(size[0]) + "x" + str(size[1]),13) + text_to_fixed_width(str(len(level.enemies)),10) +
+      text_to_fixed_width("%.3f" % single_time,14) + text_to_fixed_width("%.3f" % batched_time,15) + str(visible))
+
+## Measures the environment steps per second with random actions, of
+#  a single environment and of the vectorized environments.
+
+def benchmark_environments():
+  if numpy == None:
+    print("the environments need numpy")
+    return
 
+  filename = os.path.join("resources","level1.lvl")
+  generator = numpy.random.default_rng(0)
+  steps = 20000
+  environment = LevelEnvironment(filename)
+  environment.reset(0)
+  actions = generator.integers(0,len(LevelEnvironment.ACTIONS),steps).tolist()
+  time_start = get_precise_time()
 
-          if self.level.player.flapping_wings:
-            self.level.player.force_computer.acceleration_vector[1] = self.level.gravity - Game.FLYING_FORCE
-          else:
-            self.level.player.force_computer.acceleration_vector[1] = self.level.gravity
+  for action in actions:
+    observation, reward, terminated, truncated, info = environment.step(action)
 
-          self.level.update()
-        else:
-          if not wait:
-            wait_until = pygame.time.get_ticks() + 3000 # wait 2 seconds
-            wait = True
-          elif pygame.time.get_ticks() >= wait_until:
-            wait = False
-            self.state = Game.STATE_MENU_MAIN
+    if terminated or truncated:
+      environment.reset()
 
-        for enemy in self.level.enemies:
-          enemy.ai_move()
+  print("environments   workers   steps/s")
+  print(text_to_fixed_width("1",15) + text_to_fixed_width("-",10) + "%.0f" % (steps * 1000.0 / (get_precise_time() - time_start)))
+  workers = multiprocessing.cpu_count()
 
-        self.level.player.force_computer.execute_step()
+  for count in (workers,4 * workers):
+    vector = VectorLevelEnvironment([filename],count,workers)
+    vector.reset(0)
+    actions = generator.integers(0,len(LevelEnvironment.ACTIONS),(steps // count,count))
+    time_start = get_precise_time()
 
-        if self.level.state != Level.STATE_LOST:     # follow the player only if he's not lost
-          self.renderer.set_camera_position(int(self.level.player.position_x * Renderer.TILE_WIDTH),int(self.level.player.position_y * Renderer.TILE_HEIGHT) + 200)
+    for batch in actions:
+      vector.step(batch)
 
-        self.player_state_update_counter = (self.player_state_update_counter + 1) % Game.UPDATE_STATE_AFTER_FRAMES
+    print(text_to_fixed_width(str(count),15) + text_to_fixed_width(str(workers),10) + "%.0f" % (len(actions) * count * 1000.0 / (get_precise_time() - time_start)))
+    vector.close()
 
-        if self.player_state_update_counter == 0:
-          if self.level.player.force_computer.velocity_vector[1] > 0.1:
-            self.level.player.state = Player.PLAYER_STATE_JUMPING_DOWN
-          elif self.level.player.force_computer.velocity_vector[1] < -0.1:
-            self.level.player.state = Player.PLAYER_STATE_JUMPING_UP
-          else:
-            if self.level.player.force_computer.velocity_vector[0] > 0.1 or self.level.player.force_computer.velocity_vector[0] < -0.1:
-              self.level.player.state = Player.PLAYER_STATE_WALKING
-            else:
-              self.level.player.state = Player.PLAYER_STATE_STANDING
+## Measures the particle update and the frame drawing with different
+#  numbers of live particles.
 
-          if self.level.player.force_computer.acceleration_vector[0] > 0.1:
-            self.level.player.facing_right = True
-          elif self.level.player.force_computer.acceleration_vector[0] < -0.1:
-            self.level.player.facing_right = False
+def benchmark_particles():
+  if numpy == None:
+    print("the particles need numpy")
+    return
 
-        self.screen.blit(self.renderer.render_level(),(0,0))
-        pygame.display.flip()
-      elif self.state == Game.STATE_MENU_MAIN:
-        if self.key_up:
-          self.menu_main.cursor_up()
-          self.key_up = False
+  os.environ["SDL_VIDEODRIVER"] = "dummy"
+  pygame.display.init()
+  pygame.font.init()
+  level = Level()
+  level.load_from_file(os.path.join("resources","level1.lvl"))
+  level.particles = ParticleSystem()
+  renderer = Renderer(1024,640,SurfaceBackend(None,(1024,640)))
+  renderer.synchronous_chunks = True
+  renderer.set_level(level)
+  renderer.set_camera_to_player()
+  print("particles   update [ms]   frame [ms]")
+
+  for count in (0,1000,2000,4000):
+    level.particles.clear()
+    update_time = 0
+    frame_time = 0
+
+    for i in range(100):
+      while level.particles.get_count() < count - 64:
+        level.particles.emit(ParticleSystem.EFFECT_DEATH,level.player.position_x + random.uniform(-8,8),level.player.position_y + random.uniform(-5,5))
+
+      time_start = get_precise_time()
+      level.particles.update(1000.0 / 60.0)
+      update_time += get_precise_time() - time_start
+
+      time_start = get_precise_time()
+      renderer.render_level()
+      renderer.draw()
+      frame_time += get_precise_time() - time_start
+
+    print(text_to_fixed_width(str(count),12) + text_to_fixed_width("%.3f" % (update_time / 100),14) + "%.3f" % (frame_time / 100))
+
+  renderer.close()
+
+## Measures the frame drawing with one and two viewports whose players
+#  are far apart, the viewports share the chunk, text and sprite caches.
+
+def benchmark_split_screen():
+  os.environ["SDL_VIDEODRIVER"] = "dummy"
+  pygame.display.init()
+  pygame.font.init()
+  level = generate_random_level(200,50)
+  level.tiles = [(0,"ground",3)]
+  level.background_layers = (("green",LevelTemplate.DEFAULT_PARALLAX,0),)
+  level.background_color = pygame.Color("#b6f454")
+  level.add_player(100.5,level.height - 1.5)
+  renderer = Renderer(1024,640,SurfaceBackend(None,(1024,640)))
+  renderer.synchronous_chunks = True
+  renderer.set_level(level)
+  print("viewports   frame [ms]")
+
+  for count in (1,2):
+    renderer.set_viewports(count)
+    frame_time = 0
+
+    for i in range(300):
+      for player in level.players:
+        player.position_x += 0.05
+
+      renderer.set_camera_to_player()
+      time_start = get_precise_time()
+      renderer.render_level()
+      renderer.draw()
+      frame_time += get_precise_time() - time_start
+
+    print(text_to_fixed_width(str(count),12) + "%.3f" % (frame_time / 300))
+
+  renderer.close()
+
+## Measures the frame drawing and presenting at high resolutions when
+#  the frame is composed in a separate surface and copied to the display
+#  surface, and when it is composed in the display surface directly.
+
+def benchmark_present():
+  os.environ["SDL_VIDEODRIVER"] = "dummy"
+  pygame.display.init()
+  pygame.font.init()
+  level = Level()
+  level.load_from_file(os.path.join("resources","level1.lvl"))
+  print("resolution   target    frame [ms]   copied per frame [kB]")
+
+  for size in ((1280,720),(1920,1080),(2560,1440),(3840,2160)):
+    backend = SurfaceBackend(pygame.display.set_mode(size))
+    renderer = Renderer(size[0],size[1],backend)
+    renderer.synchronous_chunks = True
+    renderer.set_level(level)
+    renderer.set_camera_to_player()
+
+    for target in (pygame.Surface(size),None):
+      backend.set_target(target)
+      time_start = get_precise_time()
+
+      for i in range(50):
+        renderer.render_level()
+        renderer.present()
+
+      frame_time = (get_precise_time() - time_start) / 50
+      print(text_to_fixed_width(str(size[0]) + "x" + str(size[1]),13) + text_to_fixed_width("buffer" if target != None else "display",10) +
+        text_to_fixed_width("%.3f" % frame_time,13) + "%.0f" % (backend.bytes_copied / 1024.0))
+
+    renderer.close()
+
+## Tries to solve given level files with LevelSolver and prints the
+#  results.
+#
+#  @param filenames list of level file names
+#  @param time_budget search time budget per level in seconds
+#  @param output_directory if not None, the best scripts are written to
+#         this directory
+#  @return True if all the levels have been solved
+
+def solve_levels(filenames, time_budget, output_directory = None):
+  result = True
+
+  for filename in filenames:
+    level = Level()
+    level.load_from_file(filename)
+    solver = LevelSolver(level)
+    time_start = get_precise_time()
+    solved = solver.solve(time_budget)
+    search_time = (get_precise_time() - time_start) / 1000.0
+
+    if solved:
+      print(filename + ": solved, time " + str(int(solver.best_time)) + " ms, score " + str(solver.best_score) +
+        " (" + str(solver.expanded) + " expanded, %.1f s)" % search_time)
+
+      if output_directory != None:
+        solver.save_script(os.path.join(output_directory,os.path.splitext(os.path.basename(filename))[0] + ".script"))
+    else:
+      print(filename + ": not solved (" + str(solver.expanded) + " expanded, %.1f s)" % search_time)
+      result = False
 
-        if self.key_down:
-          self.menu_main.cursor_down()
-          self.key_down = False
+  return result
 
-        if self.key_return:
-          if self.menu_main.selected_item == 0:
-            self.state = Game.STATE_MENU_PLAY
-          elif self.menu_main.selected_item == 1:
-            self.state = Game.STATE_MENU_ABOUT
-          elif self.menu_main.selected_item == 2:
-            done = True
+## Benchmarks the navigation graph (building, uncached and cached path
+#  queries and incremental updates) on maps of different sizes and
+#  prints the results.
 
-          self.key_return = False
+def benchmark_navigation():
+  print("map size     segments  build [ms]  query [ms]  cached [ms]  update [ms]")
 
-        self.screen.blit(self.renderer.render_menu(self.menu_main),(0,0))
-        pygame.display.flip()
-      elif self.state == Game.STATE_MENU_ABOUT:
-        if self.key_return:
-          self.state = Game.STATE_MENU_MAIN
-          self.key_return = False
+  for size in ((50,20),(200,50),(800,100),(2000,200)):
+    level = generate_random_level(size[0],size[1])
+    graph = level.navigation_graph
+    generator = random.Random(1)
 
-        self.screen.blit(self.renderer.render_menu(self.menu_about),(0,0))
-        pygame.display.flip()
-      elif self.state == Game.STATE_MENU_PLAY:
-        if self.key_up:
-          self.menu_play.cursor_up()
-          self.key_up = False
+    time_start = get_precise_time()
+    graph.build()
+    build_time = get_precise_time() - time_start
 
-        if self.key_down:
-          self.menu_play.cursor_down()
-          self.key_down = False
+    cells = list(graph.cell_segments.keys())
+    queries = [(generator.choice(cells),generator.choice(cells)) for i in range(100)]
 
-        if self.key_return:
-          if self.menu_play.selected_item == 8:
-            self.state = Game.STATE_MENU_MAIN
-          else:
-            level_name = "level" + str(self.menu_play.selected_item + 1) + ".lvl"
-            self.level = Level(self)
-            self.level.load_from_file("resources/" + level_name)
-            self.renderer.set_level(self.level)
-            self.state = Game.STATE_IN_GAME
+    graph.path_cache.clear()
+    time_start = get_precise_time()
 
-          self.key_return = False
+    for query in queries:
+      graph.find_path(query[0],query[1])
 
-        self.screen.blit(self.renderer.render_menu(self.menu_play),(0,0))
-        pygame.display.flip()
+    query_time = (get_precise_time() - time_start) / len(queries)
 
-      frame_time = pygame.time.get_ticks() - time_start
+    time_start = get_precise_time()
 
-#-----------------------------------------------------------------------
+    for query in queries:
+      graph.find_path(query[0],query[1])
 
-config = Config("config.txt")
-game = Game(config.name,config.fullscreen,config.sound)
-game.run()
+    cached_time = (get_precise_time() - time_start) / len(queries)
 
+    time_start = get_precise_time()
 
+    for i in range(20):
+      x = generator.randint(0,size[0] - 1)
+      y = generator.randint(1,size[1] - 2)
+      level.set_at(x,y,None if MapGridObject.is_tile(level.map_array[x][y]) else MapGridObject.get_instance_from_string("0;1"))
 
+    update_time = (get_precise_time() - time_start) / 20
 
+    print(text_to_fixed_width(str(size[0]) + "x" + str(size[1]),13) + text_to_fixed_width(str(len(graph.segments)),10) +
+      text_to_fixed_width("%.2f" % build_time,12) + text_to_fixed_width("%.3f" % query_time,12) +
+      text_to_fixed_width("%.4f" % cached_time,13) + "%.3f" % update_time)
 
+#-----------------------------------------------------------------------
 
+## Runs the game or one of the tools according to the command line
+#  arguments.
+
+def main():
+  parser = argparse.ArgumentParser(description = "Steamer duck, a 2D platformer game.")
+  subparsers = parser.add_subparsers(dest = "command")
+  subparsers.add_parser("bench-nav",help = "benchmark the enemy navigation graph")
+  subparsers.add_parser("bench-sim",help = "benchmark the simulation step on large maps")
+  subparsers.add_parser("bench-particles",help = "benchmark the particle effects")
+  subparsers.add_parser("bench-split",help = "benchmark the split-screen drawing")
+  subparsers.add_parser("bench-collision",help = "benchmark the precise collisions")
+  subparsers.add_parser("bench-env",help = "benchmark the learning environments")
+  subparsers.add_parser("bench-raycast",help = "benchmark the line of sight checks")
+  subparsers.add_parser("bench-present",help = "benchmark the frame presenting at high resolutions")
+  pack_parser = subparsers.add_parser("build-pack",help = "pack the resource files into a single asset pack")
+  pack_parser.add_argument("--source",default = resource_loader.directory,help = "directory with the resource files")
+  pack_parser.add_argument("--output",default = Game.ASSET_PACK_FILENAME,help = "pack file to be written")
+  solve_parser = subparsers.add_parser("solve",help = "check that levels can be completed and find fast solutions")
+  solve_parser.add_argument("levels",nargs = "+",help = "level files")
+  solve_parser.add_argument("--budget",type = float,default = 10.0,help = "search time per level in seconds")
+  solve_parser.add_argument("--output",help = "directory to write the best input scripts to")
+  verify_parser = subparsers.add_parser("verify-server",help = "run the replay verification service for the level scores")
+  verify_parser.add_argument("levels",nargs = "*",help = "level files, all the levels in the resources by default")
+  verify_parser.add_argument("--port",type = int,default = 8050,help = "port to listen on")
+  verify_parser.add_argument("--workers",type = int,help = "number of worker processes")
+  verify_parser.add_argument("--max-pending",type = int,default = ReplayVerifier.MAX_PENDING,help = "maximum number of runs being verified at once")
+  export_parser = subparsers.add_parser("export",help = "render a recorded run (e.g. " + Game.LAST_RUN_FILENAME + ") into images or a raw video")
+  export_parser.add_argument("replay",help = "replay file")
+  export_parser.add_argument("output",help = "directory for the PNG images, or the video file with --raw")
+  export_parser.add_argument("--raw",action = "store_true",help = "write a raw RGB24 video instead of the PNG images")
+  export_parser.add_argument("--fps",type = int,default = 0,help = "frames per second, by default one frame per simulation step")
+  export_parser.add_argument("--workers",type = int,help = "number of PNG encoding processes")
+  arguments = parser.parse_args()
+
+  if arguments.command == "bench-nav":
+    benchmark_navigation()
+    return
+  elif arguments.command == "bench-sim":
+    benchmark_simulation()
+    return
+  elif arguments.command == "bench-particles":
+    benchmark_particles()
+    return
+  elif arguments.command == "bench-split":
+    benchmark_split_screen()
+    return
+  elif arguments.command == "bench-collision":
+    benchmark_collisions()
+    return
+  elif arguments.command == "bench-env":
+    benchmark_environments()
+    return
+  elif arguments.command == "bench-raycast":
+    benchmark_raycasts()
+    return
+  elif arguments.command == "bench-present":
+    benchmark_present()
+    return
+  elif arguments.command == "build-pack":
+    count = AssetPack.build(arguments.source,arguments.output)
+    corrupted = AssetPack(arguments.output).verify()
+    print(str(count) + " files packed into " + arguments.output + ("" if len(corrupted) == 0 else ", corrupted: " + " ".join(corrupted)))
+    return
+  elif arguments.command == "solve":
+    sys.exit(0 if solve_levels(arguments.levels,arguments.budget,arguments.output) else 1)
+  elif arguments.command == "verify-server":
+    levels = arguments.levels
 
+    if len(levels) == 0:
+      levels = sorted(os.path.join("resources",filename) for filename in os.listdir("resources") if filename.endswith(".lvl"))
 
+    ReplayVerifier(levels,arguments.workers,arguments.max_pending).serve(arguments.port)
+    return
+  elif arguments.command == "export":
+    levels = sorted(os.path.join("resources",filename) for filename in os.listdir("resources") if filename.endswith(".lvl"))
+    exporter = ReplayExporter(levels,arguments.output,arguments.raw,arguments.workers,arguments.fps)
+    time_start = get_precise_time()
+    frames = exporter.export(arguments.replay)
+    export_time = get_precise_time() - time_start
+    print("%d frames exported in %.1f s (%.1f frames/s), waited for the encoders %.1f s" % (frames,export_time / 1000.0,frames * 1000.0 / export_time,exporter.queue_wait / 1000.0))
 
+    if arguments.raw:
+      print("video format: rawvideo rgb24 %dx%d" % exporter.size)
 
+    return
 
+  config = Config("config.txt")
+  game = Game(config.name,config.fullscreen,config.sound,config.stats,config.developer,config.verifier,
+    config.gc_control,config.allocations,config.renderer,config.memory_budgets,config.players,config.level_directories)
+  game.run()
 
+if __name__ == "__main__":
+  main()